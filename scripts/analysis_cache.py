@@ -0,0 +1,148 @@
+"""
+Content-addressed on-disk cache for audio analysis results.
+
+Entries are keyed by the audio file's SHA-256 plus the analysis parameters and
+CACHE_VERSION, so editing the song, changing analysis settings or bumping the
+version all miss cleanly. Arrays are stored as .npz, scalars like beat0 as .npy.
+Least-recently-used files are evicted once the cache grows past max_bytes.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from typing import Dict, Optional
+
+import numpy as np
+
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = ".analysis_cache"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 of the file contents."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def params_digest(params: Dict) -> str:
+    blob = json.dumps(params, sort_keys=True, default=str).encode()
+    return hashlib.sha256(blob).hexdigest()[:16]
+
+
+class AnalysisCache:
+    def __init__(self, root: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def key(self, audio_path: str, params: Dict) -> str:
+        """Cache key for one audio file analysed with `params`."""
+        blob = json.dumps(
+            {"audio": file_digest(audio_path), "params": params, "version": CACHE_VERSION},
+            sort_keys=True,
+            default=str,
+        ).encode()
+        return hashlib.sha256(blob).hexdigest()[:32]
+
+    # -------------------------
+    # Arrays
+    # -------------------------
+    def load_arrays(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        path = os.path.join(self.root, f"{key}.npz")
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as z:
+                arrays = {name: z[name] for name in z.files}
+        except (OSError, ValueError):
+            return None
+        self._touch(path)
+        return arrays
+
+    def save_arrays(self, key: str, **arrays: np.ndarray) -> None:
+        self._write(f"{key}.npz", lambda f: np.savez(f, **arrays))
+
+    # -------------------------
+    # Scalars (e.g. beat0 for a given BPM / search setup)
+    # -------------------------
+    def load_scalar(self, key: str, name: str, params: Dict) -> Optional[float]:
+        path = os.path.join(self.root, f"{key}.{name}-{params_digest(params)}.npy")
+        if not os.path.exists(path):
+            return None
+        try:
+            value = float(np.load(path, allow_pickle=False))
+        except (OSError, ValueError):
+            return None
+        self._touch(path)
+        return value
+
+    def save_scalar(self, key: str, name: str, params: Dict, value: float) -> None:
+        fname = f"{key}.{name}-{params_digest(params)}.npy"
+        self._write(fname, lambda f: np.save(f, np.float64(value)))
+
+    # -------------------------
+    # Housekeeping
+    # -------------------------
+    def size_bytes(self) -> int:
+        return sum(size for _, size, _ in self._stat_entries())
+
+    def evict(self) -> None:
+        """Delete least-recently-used files until the cache fits in max_bytes."""
+        entries = self._stat_entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self) -> None:
+        for path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+
+    def _entries(self):
+        if not os.path.isdir(self.root):
+            return []
+        return [
+            os.path.join(self.root, name)
+            for name in os.listdir(self.root)
+            if name.endswith((".npz", ".npy"))
+        ]
+
+    def _stat_entries(self):
+        """(mtime, size, path) per entry; files another process removed since the listing are skipped."""
+        out = []
+        for path in self._entries():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            out.append((st.st_mtime, st.st_size, path))
+        return out
+
+    def _touch(self, path: str) -> None:
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _write(self, fname: str, writer) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                writer(f)
+            os.replace(tmp, os.path.join(self.root, fname))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self.evict()
@@ -1,40 +1,153 @@
+import argparse
+import hashlib
 import json
-import random
-from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple
+import os
+import time
+import zlib
+from dataclasses import dataclass, field, replace
+from typing import Callable, Dict, List, Optional, Tuple
 
 import numpy as np
-import librosa
 
-
-@dataclass
-class Event:
-    hit: float
-    end: float          # == hit for taps; > hit for holds
-    type: str           # "tap" or "hold"
+from analysis_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, AnalysisCache, params_digest
+from audio_io import DECODERS, analysis_frame, decode_audio, native_rate, resolve_decoder
+from chart_core import ChartConfig, stage_window
+from chart_core.notes import NoteArray
+from chart_core.validate import ChartRules, validate_file
+from chart_format import FORMATS, decode_chart, write_chart
+from lanes import NO_LANE, assign_lanes
+from onset_bands import BAND_NAMES, band_strength, dominant_band, mel_band_slices, normalize_bands, onset_envelopes
+from onset_peaks import sliding_max, window_radius
+from phase_timer import PhaseTimer, format_rss
+from tempo import (
+    TEMPO_VERSION, TempoMap, TempoSegment, estimate_bpm, estimate_tempo_map, fit_time_warp, make_fixed_grid,
+    make_grid, track_phase, warp_residuals,
+)
+
+# Bump when the onset analysis below changes, so cached results are recomputed.
+ANALYSIS_VERSION = 2
+# Bump when stage selection, lanes or row layout change, so spliced rebuilds (--watch,
+# .stages.json) stop reusing stages built by the old code.
+STAGE_VERSION = 1
 
 
 @dataclass
-class Note:
-    spawn: float
-    hit: float
-    end: float
-    lane: int
-    stage: int
-    speed: float
-    type: str           # "tap" or "hold"
+class Analysis:
+    onset_env: np.ndarray
+    onset_times_env: np.ndarray
+    duration: float
+    sr: int
+    cache_key: Optional[str] = None
+    hop_length: int = 512
+    band_env: Optional[np.ndarray] = None  # (bands, frames) low/mid/high onsets, each scaled to its 95th percentile
+    peak_envs: Dict = field(default_factory=dict, repr=False)  # window radius -> max-filtered (onset_env, band_env)
 
 
 # -------------------------
 # Helpers
 # -------------------------
-def make_fixed_grid(duration_s: float, bpm: float, subdiv_per_beat: int, beat0: float) -> np.ndarray:
-    """Fixed BPM grid times. subdiv_per_beat: 1=quarters, 2=eighths, 4=sixteenths."""
+def score_beat_phases(
+    offsets: np.ndarray,
+    *,
+    bpm: float,
+    duration: float,
+    onset_times_env: np.ndarray,
+    onset_env: np.ndarray,
+    search_window: Optional[Tuple[float, float]] = (0.0, 45.0),
+    grid_subdiv: int = 1,
+    max_batch: int = 1 << 20,
+) -> np.ndarray:
+    """
+    Summed onset strength on the fixed grid for every candidate beat0 at once.
+    Row k of the (offsets x grid steps) matrix is make_fixed_grid(beat0=offsets[k]),
+    so all offsets are sampled with one np.interp per batch of rows.
+    Offsets whose grid misses the window score -inf.
+    """
+    offsets = np.asarray(offsets, dtype=float)
+    dt = (60.0 / bpm) / grid_subdiv
+    t_min, t_max = search_window if search_window is not None else (0.0, duration)
+    t_min = max(t_min, 0.0)
+    t_max = min(t_max, duration)
+
+    scores = np.full(len(offsets), -np.inf)
+    if len(offsets) == 0 or t_max < t_min:
+        return scores
+
+    # Only gather the grid steps that can land inside the window for some offset.
+    n_steps = np.maximum(np.floor((duration - offsets) / dt).astype(int) + 1, 1)
+    o_lo, o_hi = float(np.min(offsets)), float(np.max(offsets))
+    j_lo = max(0, int(np.floor((t_min - o_hi) / dt)) - 1)
+    j_hi = min(int(np.max(n_steps)), int(np.ceil((t_max - o_lo) / dt)) + 2)
+    if j_hi <= j_lo:
+        return scores
+    steps = np.arange(j_lo, j_hi, dtype=float)
+
+    rows_per_batch = max(1, max_batch // len(steps))
+    for r0 in range(0, len(offsets), rows_per_batch):
+        o = offsets[r0:r0 + rows_per_batch]
+        t = o[:, None] + steps[None, :] * dt
+        mask = (
+            (steps[None, :] < n_steps[r0:r0 + rows_per_batch, None])
+            & (t >= 0.0) & (t <= duration)
+            & (t >= t_min) & (t <= t_max)
+        )
+        s = np.interp(t.ravel(), onset_times_env, onset_env).reshape(t.shape)
+        s = np.where(mask, s, 0.0)
+        batch = np.sum(s, axis=1)
+        batch[~np.any(mask, axis=1)] = -np.inf
+        scores[r0:r0 + rows_per_batch] = batch
+
+    return scores
+
+
+def fold_beat_phases(
+    *,
+    bpm: float,
+    duration: float,
+    onset_times_env: np.ndarray,
+    onset_env: np.ndarray,
+    search_window: Optional[Tuple[float, float]] = (0.0, 45.0),
+    grid_subdiv: int = 1,
+    steps: int = 240,
+) -> np.ndarray:
+    """
+    Approximate score_beat_phases for offsets k * spb / steps in O(frames + steps log steps).
+    The envelope is folded onto `steps` phase bins of one beat, then circularly
+    correlated (FFT) with the grid's sampling kernel: a comb of linear-interp
+    hats, one tooth per subdivision.
+    """
     spb = 60.0 / bpm
-    dt = spb / subdiv_per_beat
-    n = int(np.floor((duration_s - beat0) / dt)) + 1
-    t = beat0 + np.arange(max(n, 1), dtype=float) * dt
-    return t[(t >= 0.0) & (t <= duration_s)]
+    dt = spb / grid_subdiv
+    t_min, t_max = search_window if search_window is not None else (0.0, duration)
+    t_max = min(t_max, duration)
+
+    lo = int(np.searchsorted(onset_times_env, t_min, side="left"))
+    hi = int(np.searchsorted(onset_times_env, t_max, side="right"))
+    t = onset_times_env[lo:hi]
+    e = onset_env[lo:hi]
+    if len(t) == 0:
+        return np.zeros(steps)
+
+    bin_w = spb / steps
+    pos = t / bin_w
+    i0 = np.floor(pos)
+    w1 = e * (pos - i0)
+    i0 = i0.astype(np.int64) % steps
+    hist = (
+        np.bincount(i0, weights=e - w1, minlength=steps)
+        + np.bincount((i0 + 1) % steps, weights=w1, minlength=steps)
+    )
+
+    n_env = len(onset_times_env)
+    frame_dt = float(onset_times_env[-1] - onset_times_env[0]) / (n_env - 1) if n_env > 1 else bin_w
+    lag = np.arange(steps) * bin_w
+    kernel = np.zeros(steps)
+    for m in range(grid_subdiv):
+        d = np.abs(np.mod(lag - m * dt + spb / 2, spb) - spb / 2)
+        kernel += np.maximum(0.0, 1.0 - d / frame_dt)
+
+    # score[k] = sum_b hist[b] * kernel[(k - b) mod steps]
+    return np.fft.irfft(np.fft.rfft(hist) * np.fft.rfft(kernel), n=steps)
 
 
 def estimate_beat0(
@@ -43,74 +156,220 @@ def estimate_beat0(
     duration: float,
     onset_times_env: np.ndarray,
     onset_env: np.ndarray,
-    search_window: Tuple[float, float] = (0.0, 45.0),
+    search_window: Optional[Tuple[float, float]] = (0.0, 45.0),
     grid_subdiv: int = 1,
     steps: int = 240,
+    refine: int = 0,
+    shortlist: int = 4,
 ) -> float:
-    """Auto-find beat0 in [0, spb) that maximizes onset strength sampled on a beat grid."""
+    """
+    Auto-find beat0 in [0, spb) that maximizes onset strength sampled on a beat grid.
+    The folded FFT pass ranks all `steps` offsets; the best `shortlist` (and their
+    neighbours) are then scored exactly. search_window=None searches the whole song.
+    Each refine pass re-searches +-1 step around the best offset at 8x finer resolution.
+    """
     spb = 60.0 / bpm
-    t_min, t_max = search_window
-    t_max = min(t_max, duration)
-
-    best_o = 0.0
-    best_score = -1e18
+    kw = dict(
+        bpm=bpm,
+        duration=duration,
+        onset_times_env=onset_times_env,
+        onset_env=onset_env,
+        search_window=search_window,
+        grid_subdiv=grid_subdiv,
+    )
 
-    for o in np.linspace(0.0, spb, steps, endpoint=False):
-        grid = make_fixed_grid(duration_s=duration, bpm=bpm, subdiv_per_beat=grid_subdiv, beat0=o)
-        grid = grid[(grid >= t_min) & (grid <= t_max)]
-        if len(grid) == 0:
-            continue
-        s = np.interp(grid, onset_times_env, onset_env)
-        score = float(np.sum(s))
-        if score > best_score:
-            best_score = score
-            best_o = float(o)
+    coarse = fold_beat_phases(**kw, steps=steps)
+    top = np.argpartition(coarse, -min(shortlist, steps))[-min(shortlist, steps):]
+    idx = np.unique(np.mod(top[:, None] + np.array([-1, 0, 1])[None, :], steps))
+    offsets = idx * (spb / steps)
+    scores = score_beat_phases(offsets, **kw)
+    if not np.isfinite(np.max(scores)):
+        return 0.0
+    best_i = int(np.argmax(scores))
+    best_o = float(offsets[best_i])
+    best_score = float(scores[best_i])
+
+    step = spb / steps
+    for _ in range(refine):
+        fine = np.mod(best_o + np.linspace(-step, step, 17), spb)
+        fine_scores = score_beat_phases(fine, **kw)
+        i = int(np.argmax(fine_scores))
+        if fine_scores[i] > best_score:
+            best_o = float(fine[i])
+            best_score = float(fine_scores[i])
+        step = step / 8.0
 
     return best_o
 
 
-def build_stage_hit_window(
+def analyze_audio(
+    mp3_path: str,
     *,
-    stage_idx: int,
-    start_boundary: float,
-    end_boundary: float,
-    speed: float,
-    spawn_y: float,
-    hit_y: float,
-    popup_seconds: float,
-    miss_px: float,
-    song_duration: float,
-) -> Tuple[float, float, float]:
+    cache: Optional[AnalysisCache] = None,
+    stream: bool = False,
+    decoder: str = "librosa",
+    sr: Optional[int] = None,
+    timer: Optional[PhaseTimer] = None,
+) -> Analysis:
     """
-    Returns (hit_start, hit_end, travel_time) for this stage.
-    Ensures no notes are on screen during popups by:
-    - start hits late enough that spawn happens after popup ends (except stage 1)
-    - end hits early enough that misses clear before popup starts
+    Decode audio and compute the normalized onset envelope (cached on disk if `cache`).
+    stream=True decodes block by block (scripts/stream_onset.py) so memory doesn't
+    grow with track length; the envelope matches the in-memory path to ~1e-6.
+    decoder / sr pick the backend and analysis rate (scripts/audio_io.py);
+    sr=None analyzes at the file's native rate. The low/mid/high band envelopes
+    (scripts/onset_bands.py) come out of the same mel pass as the broadband one.
     """
-    travel_time = (hit_y - spawn_y) / speed
-    clear_time = miss_px / speed
+    timer = timer or PhaseTimer(enabled=False)
+    if stream and sr is not None:
+        raise ValueError("stream mode analyzes at the native sample rate (sr must be None)")
+    decoder = "soundfile" if stream else resolve_decoder(mp3_path, decoder)
+    params = {
+        "version": ANALYSIS_VERSION,
+        "sr": sr,
+        "mono": True,
+        "feature": "onset_strength",
+        "bands": list(BAND_NAMES),
+        "stream": stream,
+        "decoder": decoder,
+    }
+    key = cache.key(mp3_path, params) if cache is not None else None
+    if cache is not None:
+        with timer.phase("cache_load") as info:
+            hit = cache.load_arrays(key)
+            info["hit"] = hit is not None
+        if hit is not None:
+            return Analysis(
+                onset_env=hit["onset_env"],
+                onset_times_env=hit["onset_times_env"],
+                duration=float(hit["duration"]),
+                sr=int(hit["sr"]),
+                cache_key=key,
+                hop_length=int(hit["hop_length"]) if "hop_length" in hit else 512,
+                band_env=hit["band_env"],
+            )
+
+    n_fft, hop_length = analysis_frame(sr, native_rate(mp3_path)) if sr else analysis_frame(None, 0)
+    if stream:
+        from stream_onset import stream_onset_multi
 
-    if stage_idx == 1:
-        hit_start = start_boundary
+        with timer.phase("stream_onset") as info:
+            channels = [slice(None)] + mel_band_slices(native_rate(mp3_path))
+            envs, sr, duration = stream_onset_multi(mp3_path, channels=channels)
+            onset_env, band_env = envs[0], envs[1:]
+            info["frames"] = len(onset_env)
     else:
-        hit_start = start_boundary + popup_seconds + travel_time
-
-    hit_end = end_boundary - clear_time
-    hit_start = max(0.0, hit_start)
-    hit_end = min(song_duration, hit_end)
-    return hit_start, hit_end, travel_time
-
-
-def thin_by_gap(times: np.ndarray, min_gap_s: float) -> List[float]:
-    """Keep times such that consecutive kept times are at least min_gap_s apart."""
-    out: List[float] = []
-    last = -1e9
-    for t in times:
-        t = float(t)
-        if t - last >= min_gap_s:
-            out.append(t)
-            last = t
-    return out
+        with timer.phase("decode", decoder=decoder) as info:
+            y, sr = decode_audio(mp3_path, decoder=decoder, sr=sr)
+            info.update(samples=len(y), sr=int(sr), mb=round(y.nbytes / 2**20, 2))
+        import librosa  # deferred: loading it pulls in scipy/numba and costs seconds
+
+        duration = float(librosa.get_duration(y=y, sr=sr))
+        with timer.phase("onset") as info:
+            onset_env, band_env = onset_envelopes(y, sr=sr, n_fft=n_fft, hop_length=hop_length)
+            info.update(frames=len(onset_env), bands=len(band_env))
+
+    onset_env = np.maximum(onset_env, 0.0)
+    if np.max(onset_env) > 1e-9:
+        onset_env = onset_env / np.max(onset_env)
+    band_env = normalize_bands(band_env)
+    onset_times_env = np.arange(len(onset_env)) * hop_length / sr  # librosa.times_like
+
+    if cache is not None:
+        with timer.phase("cache_save"):
+            cache.save_arrays(
+                key,
+                onset_env=onset_env,
+                onset_times_env=onset_times_env,
+                duration=np.float64(duration),
+                sr=np.int64(sr),
+                hop_length=np.int64(hop_length),
+                band_env=band_env,
+            )
+    return Analysis(
+        onset_env=onset_env,
+        onset_times_env=onset_times_env,
+        duration=duration,
+        sr=sr,
+        cache_key=key,
+        hop_length=hop_length,
+        band_env=band_env,
+    )
+
+
+def find_beat0(
+    analysis: Analysis,
+    *,
+    bpm: float,
+    search_window: Optional[Tuple[float, float]] = (0.0, 45.0),
+    grid_subdiv: int = 1,
+    steps: int = 240,
+    refine: int = 0,
+    cache: Optional[AnalysisCache] = None,
+) -> float:
+    """estimate_beat0 on an Analysis, memoized per (audio, BPM, search setup) in `cache`."""
+    params = {
+        "bpm": bpm,
+        "search_window": search_window,
+        "grid_subdiv": grid_subdiv,
+        "steps": steps,
+        "refine": refine,
+    }
+    if cache is not None and analysis.cache_key is not None:
+        beat0 = cache.load_scalar(analysis.cache_key, "beat0", params)
+        if beat0 is not None:
+            return beat0
+
+    beat0 = estimate_beat0(
+        bpm=bpm,
+        duration=analysis.duration,
+        onset_times_env=analysis.onset_times_env,
+        onset_env=analysis.onset_env,
+        search_window=search_window,
+        grid_subdiv=grid_subdiv,
+        steps=steps,
+        refine=refine,
+    )
+    if cache is not None and analysis.cache_key is not None:
+        cache.save_scalar(analysis.cache_key, "beat0", params, beat0)
+    return beat0
+
+
+def thin_by_gap(times: np.ndarray, min_gap_s: float) -> np.ndarray:
+    """
+    Keep sorted times such that consecutive kept times are at least min_gap_s apart
+    (greedy from the first). nxt[i] is the next time a kept time i allows; the kept
+    chain from index 0 is then collected by pointer doubling in O(n log n).
+    """
+    times = np.asarray(times, dtype=float)
+    n = len(times)
+    if n == 0:
+        return times
+
+    idx = np.arange(n)
+    nxt = np.maximum(np.searchsorted(times, times + min_gap_s, side="left"), idx + 1)
+    # searchsorted tests t_j >= t_i + gap, the greedy rule is t_j - t_i >= gap; nudge where rounding disagrees
+    while True:
+        back = (nxt - 1 > idx) & (times[nxt - 1] - times >= min_gap_s)
+        if not back.any():
+            break
+        nxt[back] -= 1
+    while True:
+        fwd = nxt < n
+        fwd[fwd] = times[nxt[fwd]] - times[fwd] < min_gap_s
+        if not fwd.any():
+            break
+        nxt[fwd] += 1
+
+    jump = np.append(nxt, n)  # index n is an absorbing "past the end" node
+    on_chain = np.zeros(n + 1, dtype=bool)
+    on_chain[0] = True
+    while True:
+        reached = jump[on_chain]
+        if on_chain[reached].all():
+            break
+        on_chain[reached] = True
+        jump = jump[jump]
+    return times[on_chain[:n]]
 
 
 def enforce_max_gap_on_grid(
@@ -125,309 +384,919 @@ def enforce_max_gap_on_grid(
     Prevent long dead zones:
     - fills BETWEEN notes (like before)
     - ALSO fills at EDGES: [hit_start -> first] and [last -> hit_end]
-    Inserts up to fill_rate grid-aligned hits per oversized gap.
+    Inserts up to fill_rate grid-aligned hits per oversized gap, evenly spaced
+    over the grid points strictly inside the gap.
     """
-    chosen = np.array(sorted([float(t) for t in chosen if hit_start <= t <= hit_end]), dtype=float)
+    chosen = np.asarray(chosen, dtype=float)
+    chosen = np.sort(chosen[(chosen >= hit_start) & (chosen <= hit_end)])
     stage_grid = grid[(grid >= hit_start) & (grid <= hit_end)]
     if len(stage_grid) == 0:
         return chosen
 
     # If empty, seed with one note near the middle so we can fill from edges
     if len(chosen) == 0:
-        mid = float(stage_grid[len(stage_grid) // 2])
-        chosen = np.array([mid], dtype=float)
-
-    def insert_between(a: float, b: float, filled_list: List[float]):
-        gap = b - a
-        if gap <= max_gap_s:
-            return
-        between = stage_grid[(stage_grid > a) & (stage_grid < b)]
-        if len(between) == 0:
-            return
-        k = min(fill_rate, len(between))
-        idxs = np.linspace(0, len(between) - 1, k + 2)[1:-1].astype(int)
-        for idx in idxs:
-            filled_list.append(float(between[idx]))
-
-    filled: List[float] = []
-
-    # --- EDGE 1: stage start -> first note
-    first = float(chosen[0])
-    filled.append(first)
-    insert_between(hit_start, first, filled)
-
-    # --- MIDDLES: between notes
-    for a, b in zip(chosen[:-1], chosen[1:]):
-        a = float(a); b = float(b)
-        insert_between(a, b, filled)
-        filled.append(b)
-
-    # --- EDGE 2: last note -> stage end
-    last = float(chosen[-1])
-    insert_between(last, hit_end, filled)
+        mid = len(stage_grid) // 2
+        chosen = stage_grid[mid:mid + 1].astype(float)
+
+    # Every gap, edges included: [hit_start, c0], [c0, c1], ..., [c_last, hit_end]
+    a = np.concatenate([[hit_start], chosen])
+    b = np.concatenate([chosen, [hit_end]])
+    lo = np.searchsorted(stage_grid, a, side="right")   # first grid point > a
+    hi = np.searchsorted(stage_grid, b, side="left")    # first grid point >= b
+    m = hi - lo
+    k = np.minimum(fill_rate, m)
+    fill_gap = (b - a > max_gap_s) & (m > 0) & (k > 0)
+
+    lo, m, k = lo[fill_gap], m[fill_gap], k[fill_gap]
+    # Same picks as np.linspace(0, m - 1, k + 2)[1:-1].astype(int), for all gaps at once
+    gap_of = np.repeat(np.arange(len(k)), k)
+    r = np.arange(len(gap_of)) - np.repeat(np.cumsum(k) - k, k) + 1
+    pick = (r * ((m[gap_of] - 1.0) / (k[gap_of] + 1))).astype(int)
+    fills = stage_grid[lo[gap_of] + pick]
 
     # unique + sorted
-    return np.array(sorted(set(np.round(filled, 4))), dtype=float)
+    return np.unique(np.round(np.concatenate([chosen, fills]), 4))
 
 
 def cluster_to_holds(
-    hit_times: List[float],
+    hit_times: np.ndarray,
     *,
     cluster_gap_s: float,
     hold_min_s: float,
     hit_end_limit: float,
-) -> List[Event]:
+    breaks: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
     """
     Deterministic holds:
     - If consecutive hits are closer than cluster_gap_s, convert that run into ONE hold
       from first hit to last hit in the run.
+    Returns (hit, end, is_hold) arrays; end == hit for taps. Runs too short to
+    become a hold stay as individual taps. breaks[i] (len n - 1) forbids a run
+    from continuing from hit i to hit i + 1.
     """
-    if not hit_times:
-        return []
+    t = np.asarray(hit_times, dtype=float)
+    n = len(t)
+    if n == 0:
+        return t, t.copy(), np.zeros(0, dtype=bool)
 
-    events: List[Event] = []
-    i = 0
-    n = len(hit_times)
+    linked = np.diff(t) <= cluster_gap_s
+    if breaks is not None:
+        linked &= ~breaks
+    run_start = np.flatnonzero(np.concatenate([[True], ~linked]))
+    run_last = np.append(run_start[1:] - 1, n - 1)
+    run_end = np.minimum(t[run_last], hit_end_limit)
+    run_hold = run_end - t[run_start] >= hold_min_s
 
-    while i < n:
-        start = hit_times[i]
-        end = start
-        j = i
+    run_of = np.repeat(np.arange(len(run_start)), np.diff(np.append(run_start, n)))
+    in_hold = run_hold[run_of]
+    keep = ~in_hold | (np.arange(n) == run_start[run_of])
 
-        while j + 1 < n and (hit_times[j + 1] - hit_times[j]) <= cluster_gap_s:
-            end = hit_times[j + 1]
-            j += 1
+    hit = t[keep]
+    end = np.where(in_hold, run_end[run_of], t)[keep]
+    return hit, end, in_hold[keep]
 
-        end = min(end, hit_end_limit)
 
-        if end - start >= hold_min_s:
-            events.append(Event(hit=start, end=end, type="hold"))
-            i = j + 1
+# -------------------------
+# Chart building
+# -------------------------
+def resolve_tempo(
+    analysis: Analysis,
+    cfg: ChartConfig,
+    *,
+    cache: Optional[AnalysisCache] = None,
+) -> Tuple[ChartConfig, float, Optional[TempoMap]]:
+    """
+    Settle the grid timing for cfg: returns (cfg with a numeric bpm, beat0, tempo map or None).
+    bpm="auto" is estimated from the onset envelope (memoized in `cache`). With
+    cfg.tempo_map, a piecewise map is estimated around that BPM and every segment
+    gets its own beat phase; a single-segment map collapses to the fixed grid.
+    With cfg.tempo_warp, the grid's phase is tracked across the whole song and
+    a smooth time-warp (tempo.fit_time_warp) is carried on the map for every
+    grid; its per-stage residuals are in tempo_map.warp.residuals.
+    """
+    if cfg.bpm == "auto":
+        params = {"version": TEMPO_VERSION, "bpm_range": list(cfg.bpm_range)}
+        bpm = None
+        if cache is not None and analysis.cache_key is not None:
+            bpm = cache.load_scalar(analysis.cache_key, "bpm", params)
+        if bpm is None:
+            bpm = estimate_bpm(
+                analysis.onset_env, sr=analysis.sr, hop_length=analysis.hop_length, bpm_range=cfg.bpm_range
+            )
+            if cache is not None and analysis.cache_key is not None:
+                cache.save_scalar(analysis.cache_key, "bpm", params, bpm)
+        cfg = replace(cfg, bpm=round(bpm, 4))
+
+    beat0 = find_beat0(
+        analysis,
+        bpm=cfg.bpm,
+        search_window=cfg.beat0_search_window,
+        refine=cfg.beat0_refine,
+        cache=cache,
+    )
+    tmap = None
+    if cfg.tempo_map:
+        tmap = estimate_tempo_map(
+            analysis.onset_env, sr=analysis.sr, hop_length=analysis.hop_length, duration=analysis.duration, bpm=cfg.bpm
+        )
+        if len(tmap.segments) == 1:
+            tmap = None
         else:
-            events.append(Event(hit=start, end=start, type="tap"))
-            i += 1
+            for j, seg in enumerate(tmap.segments):
+                if j == 0 and cfg.beat0_search_window is not None:
+                    window = (max(seg.start, cfg.beat0_search_window[0]), min(seg.end, cfg.beat0_search_window[1]))
+                else:
+                    window = (seg.start, min(seg.end, seg.start + 45.0))
+                seg.bpm = round(seg.bpm, 4)
+                seg.beat0 = estimate_beat0(
+                    bpm=seg.bpm,
+                    duration=analysis.duration,
+                    onset_times_env=analysis.onset_times_env,
+                    onset_env=analysis.onset_env,
+                    search_window=window,
+                    refine=cfg.beat0_refine,
+                )
+            beat0 = tmap.segments[0].beat0
+
+    if cfg.tempo_warp:
+        # track the onsets' phase against the grid over the whole song and warp every grid onto it
+        tmap = tmap or TempoMap([TempoSegment(0.0, analysis.duration, cfg.bpm, beat0)])
+        beats = make_grid(analysis.duration, bpm=cfg.bpm, subdiv_per_beat=1, beat0=beat0, tempo_map=tmap)
+        track = track_phase(analysis.onset_env, analysis.onset_times_env, beats)
+        tmap.warp = fit_time_warp(track, duration=analysis.duration)
+        if tmap.warp is None:
+            tmap = None if len(tmap.segments) == 1 else tmap
+        else:
+            tmap.warp.residuals = warp_residuals(track, tmap.warp, cfg.boundaries)
+    return cfg, beat0, tmap
+
 
-    return events
+@dataclass
+class StageCandidates:
+    stage: int
+    hit_start: float
+    hit_end: float
+    travel_time: float
+    speed: float
+    grid: np.ndarray      # full-song grid at this stage's subdivision
+    cand: np.ndarray      # grid points inside [hit_start, hit_end]
+    scores: np.ndarray    # peak-emphasized onset strength per candidate
 
 
-def pick_lane_available(
-    rng: random.Random,
-    prev_lane: Optional[int],
-    lane_busy_until: List[float],
-    t: float,
-    jumpiness: float,
-) -> int:
-    """Choose a lane that isn't currently held at time t. Prefer nearby lanes unless jumpy."""
-    lanes = [0, 1, 2, 3]
-    available = [l for l in lanes if lane_busy_until[l] <= t]
-    if not available:
-        available = lanes
+@dataclass
+class StageEvents:
+    hit: np.ndarray
+    end: np.ndarray
+    is_hold: np.ndarray
+    chosen: int = 0       # after top-k + gap filling
+    thinned: int = 0      # after min-gap thinning
 
-    if prev_lane is None or prev_lane not in available:
-        return rng.choice(available)
 
-    weights = []
-    for l in available:
-        d = abs(l - prev_lane)
-        base = 1.0 / (1.0 + d)
-        w = (1.0 - jumpiness) * base + jumpiness * 1.0
-        weights.append(w)
+def band_envelopes(analysis: Analysis) -> np.ndarray:
+    if analysis.band_env is None:
+        raise ValueError("band_weight / band_lanes need the band envelopes from analyze_audio()")
+    return analysis.band_env
 
-    return rng.choices(available, weights=weights, k=1)[0]
 
+def scoring_envelopes(analysis: Analysis, window_s: float) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    (onset envelope, band envelopes) the candidate scores sample. With a score
+    window both are max-filtered over +-window_s (scripts/onset_peaks.py), once
+    per song and window; every stage and subdivision reuses them.
+    """
+    if window_s <= 0.0:
+        return analysis.onset_env, analysis.band_env
+    radius = window_radius(window_s, analysis.onset_times_env)
+    if radius not in analysis.peak_envs:
+        bands = None if analysis.band_env is None else sliding_max(analysis.band_env, radius)
+        analysis.peak_envs[radius] = (sliding_max(analysis.onset_env, radius), bands)
+    return analysis.peak_envs[radius]
+
+
+def stage_candidates(
+    analysis: Analysis,
+    cfg: ChartConfig,
+    stage_idx: int,
+    *,
+    beat0: float,
+    tempo_map: Optional[TempoMap] = None,
+) -> Optional[StageCandidates]:
+    """Hit window, beat-locked grid and candidate scores for one stage (None if the stage is unplayable)."""
+    win = stage_window(
+        cfg.boundaries,
+        stage_idx,
+        speed=cfg.stage_speeds[stage_idx - 1],
+        spawn_y=cfg.spawn_y,
+        hit_y=cfg.hit_y,
+        popup_seconds=cfg.popup_seconds,
+        miss_px=cfg.miss_px,
+        duration=analysis.duration,
+    )
+    if not win.playable:
+        return None
+    hit_start, hit_end = win.hit_start, win.hit_end
+
+    # Beat-locked candidate times
+    subdiv = cfg.stage_subdiv[stage_idx - 1]
+    grid = make_grid(analysis.duration, bpm=cfg.bpm, subdiv_per_beat=subdiv, beat0=beat0, tempo_map=tempo_map)
+    cand = grid[(grid >= hit_start) & (grid <= hit_end)]
+
+    onset_env, band_env = scoring_envelopes(analysis, cfg.score_window_s)
+    scores = np.interp(cand, analysis.onset_times_env, onset_env)
+    if cfg.band_weight > 0.0:
+        # a candidate also scores by its strongest band, so quiet hats/snares can compete with the kick
+        band_envelopes(analysis)
+        band = np.minimum(band_strength(band_env, analysis.onset_times_env, cand).max(axis=0), 1.0)
+        scores = (1.0 - cfg.band_weight) * scores + cfg.band_weight * band
+    scores = scores ** 1.6  # peak emphasis
+
+    return StageCandidates(
+        stage=stage_idx,
+        hit_start=hit_start,
+        hit_end=hit_end,
+        travel_time=win.travel,
+        speed=win.speed,
+        grid=grid,
+        cand=cand,
+        scores=scores,
+    )
 
-# -------------------------
-# Main
-# -------------------------
-def main():
-    rng = random.Random(42)
 
-    mp3_path = "song.mp3"
-    out_path = "chart.json"
+def choose_stage_hits(sc: StageCandidates, cfg: ChartConfig) -> np.ndarray:
+    """Top-k candidates by score, plus on-grid fillers in gaps longer than the stage's max gap."""
+    i = sc.stage - 1
+    k = max(1, int(len(sc.cand) * cfg.stage_keep[i]))
+    top_idx = np.argpartition(sc.scores, -k)[-k:]
+    chosen = np.sort(sc.cand[top_idx])
+
+    # Fill long gaps on-grid (per stage)
+    max_gap = cfg.stage_max_gap[i]
+    if max_gap is not None and len(chosen) >= 2:
+        chosen = enforce_max_gap_on_grid(
+            chosen=chosen,
+            grid=sc.grid,
+            hit_start=sc.hit_start,
+            hit_end=sc.hit_end,
+            max_gap_s=max_gap,
+            fill_rate=cfg.stage_fill_rate[i],
+        )
+    return chosen
 
-    bpm = 144.0 #144 - the drunk & 75 - mikito
- 
-    # Match Phaser
-    popup_seconds = 1.4
-    miss_px = 60.0
-    spawn_y = -60.0
-    hit_y = 600.0
 
-    # Your stage boundaries (keep as-is)
-    boundaries = [0.0, 15.0, 30.0, 75.0, 110.0, 160.0, 230.0]
+def select_stage_events(sc: StageCandidates, cfg: ChartConfig) -> StageEvents:
+    """Top-k selection, gap filling, min-gap thinning and hold clustering for one stage."""
+    i = sc.stage - 1
+    chosen = choose_stage_hits(sc, cfg)
 
-    # Must match in-game stage speeds
-    stage_speeds = [320.0, 360.0, 400.0, 440.0, 480.0, 520.0]
+    # Enforce minimum gap
+    thinned = thin_by_gap(chosen, min_gap_s=cfg.stage_min_gap[i])
+    thinned = thinned + cfg.global_offset
+    thinned = thinned[(thinned >= sc.hit_start) & (thinned <= sc.hit_end)]
 
-    # Difficulty ramp (tweak here)
-    stage_subdiv =    [1, 2, 2, 2, 4, 4]
-    stage_keep =      [0.40, 0.50, 0.60, 0.65, 0.70, 0.85]   # stage 6 harder
-    stage_min_gap =   [0.35, 0.33, 0.30, 0.28, 0.24, 0.21]   # stage 6 denser
-    stage_jumpiness = [0.15, 0.20, 0.22, 0.22, 0.26, 0.45]   # stage 6 more lane movement
+    # Turn clusters into holds (optionally disabled for stage 6 to make it harder)
+    if sc.stage == 6 and not cfg.stage6_holds_enabled:
+        return StageEvents(
+            hit=thinned, end=thinned, is_hold=np.zeros(len(thinned), dtype=bool),
+            chosen=len(chosen), thinned=len(thinned),
+        )
+    hit, end, is_hold = cluster_to_holds(
+        thinned,
+        cluster_gap_s=cfg.stage_cluster_gap[i],
+        hold_min_s=cfg.hold_min_s,
+        hit_end_limit=sc.hit_end,
+    )
+    return StageEvents(hit=hit, end=end, is_hold=is_hold, chosen=len(chosen), thinned=len(thinned))
 
-    # Holds from clusters (NOT random)
-    hold_min_s = 0.40
-    stage_cluster_gap = [0.42, 0.38, 0.32, 0.28, 0.26, 0.22]  # slightly fewer holds late
 
-    # NEW: max-gap enforcement per stage (fix gaps in 3 & 4 too)
-    # max allowed silence between notes in that stage
-    stage_max_gap =   [1.00, 1.00, 1.00, 1.00, 1.00, 0.85]   # stage 6 constant pressure
-    # how many fillers can be inserted inside an oversized gap
-    stage_fill_rate = [1,    1,    3,    1,    2,    2]
+def select_nested_events(sc: StageCandidates, cfg: ChartConfig, base: NoteArray) -> StageEvents:
+    """
+    The events a harder difficulty adds to `base` (an easier chart's notes for
+    this stage, which stay as they are). New hits keep the stage's min gap to
+    every base hit and stay out of base holds; new holds never span a base hit.
+    """
+    i = sc.stage - 1
+    min_gap = cfg.stage_min_gap[i]
+    chosen = choose_stage_hits(sc, cfg)
+    t = chosen + cfg.global_offset
+    t = t[(t >= sc.hit_start) & (t <= sc.hit_end)]
+
+    order = np.argsort(base.hit, kind="stable")
+    base_hit = base.hit[order]
+    # latest end of any base note (hold tails included) at or before each base hit
+    base_reach = np.maximum.accumulate(np.maximum(base.end[order], base_hit)) if len(base) else base_hit
+    j = np.searchsorted(base_hit, t, side="left")
+    prev_reach = np.where(j > 0, base_reach[np.maximum(j - 1, 0)], -np.inf)
+    next_hit = np.where(j < len(base_hit), base_hit[np.minimum(j, len(base_hit) - 1)], np.inf)
+    t = t[(t - prev_reach >= min_gap) & (next_hit - t >= min_gap)]
+
+    thinned = thin_by_gap(t, min_gap_s=min_gap)
+    if sc.stage == 6 and not cfg.stage6_holds_enabled:
+        return StageEvents(
+            hit=thinned, end=thinned, is_hold=np.zeros(len(thinned), dtype=bool),
+            chosen=len(chosen), thinned=len(thinned),
+        )
+    slot = np.searchsorted(base_hit, thinned)
+    hit, end, is_hold = cluster_to_holds(
+        thinned,
+        cluster_gap_s=cfg.stage_cluster_gap[i],
+        hold_min_s=cfg.hold_min_s,
+        hit_end_limit=sc.hit_end,
+        breaks=np.diff(slot) != 0,
+    )
+    return StageEvents(hit=hit, end=end, is_hold=is_hold, chosen=len(chosen), thinned=len(thinned))
 
-    # Make stage 6 more tap-heavy by preventing too many clusters from collapsing into holds:
-    # If you want *more* holds in stage 6, raise this.
-    stage6_holds_enabled = False
 
-    global_offset = 0.00
+def assign_nested_lanes(
+    hit: np.ndarray,
+    end: np.ndarray,
+    is_hold: np.ndarray,
+    base: NoteArray,
+    *,
+    rng: np.random.Generator,
+    n_lanes: int,
+    jumpiness: float,
+    bands: Optional[np.ndarray] = None,
+    band_bias: float = 0.0,
+) -> np.ndarray:
+    """Lanes for notes added between base notes; each run continues from the base note before it."""
+    order = np.argsort(base.hit, kind="stable")
+    base_hit, base_lane = base.hit[order], base.lane[order]
+    slot = np.searchsorted(base_hit, hit)
+    lanes = np.empty(len(hit), dtype=np.int64)
+    bounds = np.flatnonzero(np.diff(slot)) + 1
+    for lo, hi in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(hit)]])):
+        if hi <= lo:
+            continue
+        s = slot[lo]
+        lanes[lo:hi] = assign_lanes(
+            hit[lo:hi], end[lo:hi], is_hold[lo:hi],
+            rng=rng, n_lanes=n_lanes, jumpiness=jumpiness,
+            prev_lane=int(base_lane[s - 1]) if s > 0 else None,
+            bands=None if bands is None else bands[lo:hi], band_bias=band_bias,
+        )
+    return lanes
 
-    # Load audio
-    y, sr = librosa.load(mp3_path, sr=None, mono=True)
-    duration = float(librosa.get_duration(y=y, sr=sr))
 
-    onset_env = librosa.onset.onset_strength(y=y, sr=sr)
-    onset_env = np.maximum(onset_env, 0.0)
-    if np.max(onset_env) > 1e-9:
-        onset_env = onset_env / np.max(onset_env)
-    onset_times_env = librosa.times_like(onset_env, sr=sr)
+def stage_seed(seed: int, stage_idx: int) -> int:
+    """Each stage draws lanes from its own RNG, so stages can be rebuilt independently."""
+    return zlib.crc32(f"{seed}:stage{stage_idx}".encode()) & 0x7FFFFFFF
 
-    beat0 = estimate_beat0(
-        bpm=bpm,
-        duration=duration,
-        onset_times_env=onset_times_env,
-        onset_env=onset_env,
-        search_window=(0.0, 45.0),
-        grid_subdiv=1,
-        steps=240,
-    )
-    print(f"Estimated beat0 ≈ {beat0:.4f}s (BPM={bpm})")
-
-    notes: List[Note] = []
-    prev_lane: Optional[int] = None
-
-    for stage_idx in range(1, 7):
-        start_boundary = boundaries[stage_idx - 1]
-        end_boundary = boundaries[stage_idx]
-        speed = stage_speeds[stage_idx - 1]
-
-        hit_start, hit_end, travel_time = build_stage_hit_window(
-            stage_idx=stage_idx,
-            start_boundary=start_boundary,
-            end_boundary=end_boundary,
-            speed=speed,
-            spawn_y=spawn_y,
-            hit_y=hit_y,
-            popup_seconds=popup_seconds,
-            miss_px=miss_px,
-            song_duration=duration,
-        )
-        if hit_end <= hit_start:
-            print(f"Stage {stage_idx}: no playable window.")
-            continue
 
-        subdiv = stage_subdiv[stage_idx - 1]
-        keep_frac = stage_keep[stage_idx - 1]
-        min_gap = stage_min_gap[stage_idx - 1]
-        jumpiness = stage_jumpiness[stage_idx - 1]
-        cluster_gap = stage_cluster_gap[stage_idx - 1]
+def analysis_digest(analysis: Analysis) -> str:
+    h = hashlib.sha256(np.ascontiguousarray(analysis.onset_env).tobytes())
+    h.update(repr(analysis.duration).encode())
+    return h.hexdigest()[:16]
 
-        max_gap = stage_max_gap[stage_idx - 1]
-        fill_rate = stage_fill_rate[stage_idx - 1]
 
-        # Beat-locked candidate times
-        grid = make_fixed_grid(duration_s=duration, bpm=bpm, subdiv_per_beat=subdiv, beat0=beat0)
-        cand = grid[(grid >= hit_start) & (grid <= hit_end)]
-        if len(cand) == 0:
-            print(f"Stage {stage_idx}: empty grid window.")
-            continue
+def stage_key(
+    cfg: ChartConfig,
+    stage_idx: int,
+    *,
+    beat0: float,
+    analysis_id: str,
+    tempo_map: Optional[TempoMap] = None,
+) -> str:
+    """Digest of everything one stage's notes depend on."""
+    i = stage_idx - 1
+    inputs = dict(
+        version=STAGE_VERSION,
+        stage=stage_idx,  # seeds the lane RNG and tags every row
+        analysis=analysis_id,
+        beat0=beat0,
+        bpm=cfg.bpm,
+        tempo_map=None if tempo_map is None else tempo_map.to_dict(),
+        seed=cfg.seed,
+        lanes=cfg.lanes,
+        window=cfg.boundaries[i:i + 2],
+        geometry=[cfg.popup_seconds, cfg.miss_px, cfg.spawn_y, cfg.hit_y],
+        hold_min_s=cfg.hold_min_s,
+        global_offset=cfg.global_offset,
+        bands=[cfg.band_weight, cfg.band_lanes],
+        score_window_s=cfg.score_window_s,
+        stage_params=[
+            getattr(cfg, name)[i]
+            for name in (
+                "stage_speeds", "stage_subdiv", "stage_keep", "stage_min_gap", "stage_jumpiness",
+                "stage_cluster_gap", "stage_max_gap", "stage_fill_rate",
+            )
+        ],
+        holds_off=stage_idx == 6 and not cfg.stage6_holds_enabled,
+    )
+    return params_digest(inputs)
+
+
+def stage_notes(
+    analysis: Analysis,
+    cfg: ChartConfig,
+    stage_idx: int,
+    *,
+    beat0: float,
+    tempo_map: Optional[TempoMap] = None,
+    timer: Optional[PhaseTimer] = None,
+    sc: Optional[StageCandidates] = None,
+    base: Optional[NoteArray] = None,
+) -> Tuple[NoteArray, Dict]:
+    """
+    Select, thin and lane-assign one stage. Returns (notes sorted by spawn, stats).
 
-        scores = np.interp(cand, onset_times_env, onset_env)
-        scores = scores ** 1.6  # peak emphasis
-
-        k = max(1, int(len(cand) * keep_frac))
-        top_idx = np.argpartition(scores, -k)[-k:]
-        chosen = np.sort(cand[top_idx])
-
-        # Fill long gaps on-grid (per stage)
-        if max_gap is not None and len(chosen) >= 2:
-            chosen = enforce_max_gap_on_grid(
-                chosen=chosen,
-                grid=grid,
-                hit_start=hit_start,
-                hit_end=hit_end,
-                max_gap_s=max_gap,
-                fill_rate=fill_rate,
+    `sc` reuses candidates computed for another config with the same grid
+    (build_difficulties). With `base`, an easier difficulty's notes for this
+    stage are kept verbatim and only the notes this config adds around them
+    are selected and lane-assigned.
+    """
+    timer = timer or PhaseTimer(enabled=False)
+
+    if sc is None:
+        with timer.phase("candidates", stage=stage_idx) as info:
+            sc = stage_candidates(analysis, cfg, stage_idx, beat0=beat0, tempo_map=tempo_map)
+            info["cand"] = 0 if sc is None else len(sc.cand)
+    if sc is None:
+        return NoteArray.from_notes([]), dict(stage=stage_idx, skipped="no playable window")
+    if len(sc.cand) == 0:
+        return NoteArray.from_notes([]), dict(stage=stage_idx, skipped="empty grid window")
+
+    with timer.phase("select", stage=stage_idx) as info:
+        ev = select_stage_events(sc, cfg) if base is None else select_nested_events(sc, cfg, base)
+        info.update(chosen=ev.chosen, thinned=ev.thinned, events=len(ev.hit))
+
+    # notes that would spawn before the song starts are dropped before they take a lane
+    spawnable = ev.hit - sc.travel_time >= 0.0
+    hit, end, is_hold = ev.hit[spawnable], ev.end[spawnable], ev.is_hold[spawnable]
+    rng = np.random.default_rng(stage_seed(cfg.seed, stage_idx))
+    jumpiness = cfg.stage_jumpiness[stage_idx - 1]
+
+    with timer.phase("lanes", stage=stage_idx) as info:
+        bias = dict(bands=None, band_bias=0.0)
+        if cfg.band_lanes > 0.0:
+            bias.update(
+                bands=dominant_band(band_envelopes(analysis), analysis.onset_times_env, hit),
+                band_bias=cfg.band_lanes,
+            )
+        if base is None:
+            lanes = assign_lanes(hit, end, is_hold, rng=rng, n_lanes=cfg.lanes, jumpiness=jumpiness, **bias)
+        else:
+            lanes = assign_nested_lanes(
+                hit, end, is_hold, base, rng=rng, n_lanes=cfg.lanes, jumpiness=jumpiness, **bias
             )
+        notes = NoteArray(
+            spawn=hit - sc.travel_time,
+            hit=hit,
+            end=end,
+            lane=lanes,
+            stage=np.full(len(hit), stage_idx),
+            speed=np.full(len(hit), sc.speed),
+            hold=is_hold,
+        )
+        # a note arriving while every lane is held has nowhere to go
+        notes = notes.take((notes.hit >= 0.0) & (notes.hit <= analysis.duration) & (notes.lane != NO_LANE))
+        if base is not None:
+            notes = NoteArray.concat([base, notes])
+        info.update(notes=len(notes), holds=int(np.count_nonzero(notes.hold)))
+
+    stats = dict(
+        stage=stage_idx,
+        subdiv=cfg.stage_subdiv[stage_idx - 1],
+        cand=len(sc.cand),
+        chosen=ev.chosen,
+        thinned=ev.thinned,
+        events=len(ev.hit),
+        keep=cfg.stage_keep[stage_idx - 1],
+        min_gap=cfg.stage_min_gap[stage_idx - 1],
+        max_gap=cfg.stage_max_gap[stage_idx - 1],
+        fill=cfg.stage_fill_rate[stage_idx - 1],
+        notes=len(notes),
+        holds=int(np.count_nonzero(notes.hold)),
+    )
+    if base is not None:
+        stats["base"] = len(base)
+    return notes.sorted_by_spawn(), stats
 
-        # Enforce minimum gap
-        thinned = thin_by_gap(chosen, min_gap_s=min_gap)
-        thinned = [t + global_offset for t in thinned]
-        thinned = [t for t in thinned if hit_start <= t <= hit_end]
 
-        # Turn clusters into holds (optionally disabled for stage 6 to make it harder)
-        if stage_idx == 6 and not stage6_holds_enabled:
-            events = [Event(hit=t, end=t, type="tap") for t in thinned]
+def build_stage(
+    analysis: Analysis,
+    cfg: ChartConfig,
+    stage_idx: int,
+    *,
+    beat0: float,
+    tempo_map: Optional[TempoMap] = None,
+    timer: Optional[PhaseTimer] = None,
+) -> Tuple[List[Dict], Dict]:
+    """Select, thin and lane-assign one stage. Returns (chart rows sorted by spawn, stats)."""
+    notes, stats = stage_notes(analysis, cfg, stage_idx, beat0=beat0, tempo_map=tempo_map, timer=timer)
+    return notes.to_rows(), stats
+
+
+def build_chart(
+    analysis: Analysis,
+    cfg: ChartConfig,
+    *,
+    beat0: float,
+    tempo_map: Optional[TempoMap] = None,
+    timer: Optional[PhaseTimer] = None,
+    reuse: Optional[Dict[str, Tuple[List[Dict], Dict]]] = None,
+) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Build every stage and merge them by spawn time. Returns (chart rows, per-stage stats).
+
+    Each stat carries the stage's input digest under "key". Stages whose key is
+    in `reuse` ({key: (rows, stats)}, e.g. from the previous build) are spliced
+    in instead of recomputed and marked "reused".
+    """
+    timer = timer or PhaseTimer(enabled=False)
+    analysis_id = analysis_digest(analysis)
+
+    per_stage: List[List[Dict]] = []
+    stats: List[Dict] = []
+    for stage_idx in range(1, cfg.n_stages + 1):
+        key = stage_key(cfg, stage_idx, beat0=beat0, analysis_id=analysis_id, tempo_map=tempo_map)
+        if reuse is not None and key in reuse:
+            rows, st = reuse[key]
+            st = dict(st, reused=True)
         else:
-            events = cluster_to_holds(
-                thinned,
-                cluster_gap_s=cluster_gap,
-                hold_min_s=hold_min_s,
-                hit_end_limit=hit_end,
+            rows, st = build_stage(analysis, cfg, stage_idx, beat0=beat0, tempo_map=tempo_map, timer=timer)
+            st = dict(st, reused=False)
+        st["key"] = key
+        per_stage.append(rows)
+        stats.append(st)
+
+    with timer.phase("rows") as info:
+        # stable sort: ties keep stage order
+        out = sorted((r for rows in per_stage for r in rows), key=lambda r: r["spawn"])
+        info["notes"] = len(out)
+    return out, stats
+
+
+def stage_results(out: List[Dict], stats: List[Dict]) -> Dict[str, Tuple[List[Dict], Dict]]:
+    """{stage key: (rows, stats)} for a built chart, the `reuse` input of the next build_chart."""
+    by_stage: Dict[int, List[Dict]] = {st["stage"]: [] for st in stats}
+    for r in out:
+        by_stage.setdefault(r["stage"], []).append(r)
+    return {
+        st["key"]: (by_stage[st["stage"]], {k: v for k, v in st.items() if k not in ("key", "reused")})
+        for st in stats
+    }
+
+
+# -------------------------
+# Difficulties
+# -------------------------
+# Only selection knobs may differ between difficulties: stage windows, grid
+# timing, speeds and lane count are shared, so harder charts can nest easier ones.
+DIFFICULTY_KEYS = (
+    "stage_subdiv", "stage_keep", "stage_min_gap", "stage_max_gap", "stage_fill_rate",
+    "stage_cluster_gap", "stage_jumpiness", "hold_min_s", "stage6_holds_enabled",
+)
+
+
+def difficulty_configs(cfg: ChartConfig, profiles: Dict[str, Dict]) -> Dict[str, ChartConfig]:
+    """{name: cfg with that profile's overrides}, in the profiles' order (easiest first)."""
+    if not profiles:
+        raise ValueError("no difficulty profiles given")
+    out: Dict[str, ChartConfig] = {}
+    for name, overrides in profiles.items():
+        bad = sorted(set(overrides) - set(DIFFICULTY_KEYS))
+        if bad:
+            raise ValueError(
+                f"difficulty {name!r} overrides {', '.join(bad)}; profiles may only set {', '.join(DIFFICULTY_KEYS)}"
             )
+        out[name] = replace(cfg, **overrides)
+        out[name].validate()
+    return out
+
+
+def build_difficulties(
+    analysis: Analysis,
+    cfgs: Dict[str, ChartConfig],
+    *,
+    beat0: float,
+    tempo_map: Optional[TempoMap] = None,
+    nested: bool = True,
+    timer: Optional[PhaseTimer] = None,
+) -> Dict[str, Tuple[List[Dict], List[Dict]]]:
+    """
+    Build every difficulty from one analysis and beat0: {name: (chart rows, per-stage stats)}.
 
-        lane_busy_until = [0.0, 0.0, 0.0, 0.0]
-        stage_notes = 0
-        hold_count = 0
+    Candidates (grid + scores) are computed once per (stage, subdivision) and
+    shared. With `nested`, difficulties are taken in order and every stage keeps
+    the previous difficulty's notes verbatim, adding only its own extra notes, so
+    each chart's rows are a superset of the one before it (see is_superset).
+    """
+    timer = timer or PhaseTimer(enabled=False)
+    shared: Dict[Tuple[int, int], Optional[StageCandidates]] = {}
+    charts: Dict[str, Tuple[List[Dict], List[Dict]]] = {}
+    prev: Dict[int, NoteArray] = {}
+
+    for name, cfg in cfgs.items():
+        per_stage: Dict[int, NoteArray] = {}
+        stats: List[Dict] = []
+        for stage_idx in range(1, cfg.n_stages + 1):
+            key = (stage_idx, cfg.stage_subdiv[stage_idx - 1])
+            if key not in shared:
+                with timer.phase("candidates", stage=stage_idx, subdiv=key[1]) as info:
+                    shared[key] = stage_candidates(analysis, cfg, stage_idx, beat0=beat0, tempo_map=tempo_map)
+                    info["cand"] = 0 if shared[key] is None else len(shared[key].cand)
+            notes, st = stage_notes(
+                analysis, cfg, stage_idx,
+                beat0=beat0, tempo_map=tempo_map, timer=timer,
+                sc=shared[key], base=prev.get(stage_idx) if nested else None,
+            )
+            per_stage[stage_idx] = notes
+            stats.append(dict(st, difficulty=name))
+        with timer.phase("rows", difficulty=name) as info:
+            rows = NoteArray.concat(list(per_stage.values())).sorted_by_spawn().to_rows()
+            info["notes"] = len(rows)
+        charts[name] = (rows, stats)
+        prev = per_stage
+    return charts
+
+
+def is_superset(harder: List[Dict], easier: List[Dict]) -> bool:
+    """Every row of `easier` appears verbatim in `harder`."""
+    have = {tuple(sorted(r.items())) for r in harder}
+    return all(tuple(sorted(r.items())) in have for r in easier)
+
+
+def difficulty_path(out_path: str, name: str) -> str:
+    """chart.json -> chart.hard.json"""
+    stem, ext = os.path.splitext(out_path)
+    return f"{stem}.{name}{ext}"
+
+
+def format_stage_stats(st: Dict) -> str:
+    reused = " (unchanged)" if st.get("reused") else ""
+    if "skipped" in st:
+        return f"Stage {st['stage']}: {st['skipped']}.{reused}"
+    return (
+        f"Stage {st['stage']}: subdiv={st['subdiv']} cand={st['cand']} keep={st['keep']:.2f} "
+        f"minGap={st['min_gap']:.2f}s maxGap={st['max_gap']:.2f}s fill={st['fill']} "
+        f"notes={st['notes']} holds={st['holds']}{reused}"
+    )
 
-        for ev in events:
-            lane = pick_lane_available(rng, prev_lane, lane_busy_until, ev.hit, jumpiness=jumpiness)
-            prev_lane = lane
 
-            spawn = ev.hit - travel_time
-            if spawn < 0.0:
+STAGES_SUFFIX = ".stages.json"
+
+
+def load_stage_results(out_path: str) -> Dict[str, Tuple[List[Dict], Dict]]:
+    """Per-stage results of the chart already at out_path ({} if missing, unreadable or edited since)."""
+    try:
+        with open(out_path + STAGES_SUFFIX) as f:
+            meta = json.load(f)
+        with open(out_path, "rb") as f:
+            blob = f.read()
+        if hashlib.sha256(blob).hexdigest() != meta["chart_sha256"]:
+            return {}
+        rows, _ = decode_chart(blob)
+        return stage_results(rows, meta["stages"])
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def save_stage_results(out_path: str, stats: List[Dict]) -> None:
+    with open(out_path, "rb") as f:
+        sha = hashlib.sha256(f.read()).hexdigest()
+    with open(out_path + STAGES_SUFFIX, "w") as f:
+        json.dump({"chart_sha256": sha, "stages": stats}, f, indent=2)
+
+
+def watch_params(params_path: str, rebuild: Callable[[ChartConfig], None], poll_s: float = 0.05) -> None:
+    """Poll the params file and call rebuild(cfg) whenever it is saved, until Ctrl-C."""
+    last = os.stat(params_path).st_mtime_ns
+    print(f"\nWatching {params_path} (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(poll_s)
+            try:
+                mtime = os.stat(params_path).st_mtime_ns
+            except FileNotFoundError:  # editors that save via rename
                 continue
+            if mtime == last:
+                continue
+            last = mtime
+            try:
+                with open(params_path) as f:
+                    cfg = ChartConfig.from_dict(json.load(f))
+                rebuild(cfg)
+            except Exception as e:  # keep watching through typos
+                print(f"[{time.strftime('%H:%M:%S')}] {type(e).__name__}: {e}")
+    except KeyboardInterrupt:
+        print()
+
+
+def write_cprofile(profiler, path: str, top: int = 25) -> Dict:
+    """Dump pstats to `path` and return the top functions by cumulative time for the report."""
+    import pstats
+
+    profiler.dump_stats(path)
+    st = pstats.Stats(profiler)
+    rows = []
+    for (filename, line, func), (cc, nc, tt, ct, _) in sorted(st.stats.items(), key=lambda kv: -kv[1][3])[:top]:
+        rows.append(dict(function=f"{filename}:{line}({func})", calls=nc, tottime=round(tt, 6), cumtime=round(ct, 6)))
+    return dict(path=path, top_cumulative=rows)
+
+
+def write_profile_report(args, analysis: Analysis, timer: PhaseTimer, profiler, **run) -> None:
+    """--profile: the run report (<out>.profile.json) plus the phase table on stdout."""
+    tempo_map = run.pop("tempo_map")
+    report = dict(
+        audio=args.audio,
+        out=args.out,
+        stream=args.stream,
+        cached=any(r["name"] == "cache_load" and r["hit"] for r in timer.records),
+        duration=analysis.duration,
+        sr=analysis.sr,
+        frames=len(analysis.onset_env),
+        envelope_mb=round((analysis.onset_env.nbytes + analysis.onset_times_env.nbytes) / 2**20, 3),
+        bpm=run.pop("bpm"),
+        beat0=run.pop("beat0"),
+        tempo_map=None if tempo_map is None else tempo_map.to_dict(),
+        warp_residuals=None if tempo_map is None or tempo_map.warp is None else tempo_map.warp.residuals,
+        **run,
+        **timer.report(),
+    )
+    if profiler is not None:
+        report["cprofile"] = write_cprofile(profiler, args.out + ".prof")
+    profile_out = args.profile_out or args.out + ".profile.json"
+    with open(profile_out, "w") as f:
+        json.dump(report, f, indent=2)
+    print()
+    print(timer.format())
+    print(f"Wrote {profile_out} (total {report['total_seconds']:.2f}s, peak RSS {format_rss(report['peak_rss_mb'])}MB)")
 
-            if ev.type == "hold":
-                lane_busy_until[lane] = max(lane_busy_until[lane], ev.end)
-                hold_count += 1
-
-            notes.append(Note(
-                spawn=spawn,
-                hit=ev.hit,
-                end=ev.end,
-                lane=lane,
-                stage=stage_idx,
-                speed=speed,
-                type=ev.type,
-            ))
-            stage_notes += 1
-
-        print(
-            f"Stage {stage_idx}: subdiv={subdiv} cand={len(cand)} keep={keep_frac:.2f} "
-            f"minGap={min_gap:.2f}s maxGap={max_gap:.2f}s fill={fill_rate} "
-            f"notes={stage_notes} holds={hold_count}"
-        )
 
-    notes.sort(key=lambda n: n.spawn)
-
-    out: List[Dict] = [
-        {
-            "spawn": round(n.spawn, 4),
-            "hit": round(n.hit, 4),
-            "end": round(n.end, 4),
-            "lane": n.lane,
-            "stage": n.stage,
-            "speed": round(n.speed, 2),
-            "type": n.type,
-        }
-        for n in notes
-        if 0.0 <= n.hit <= duration
-    ]
-
-    with open(out_path, "w") as f:
-        json.dump(out, f, indent=2)
-
-    print(f"\nWrote {out_path} | notes={len(out)} | duration={duration:.2f}s")
+# -------------------------
+# Main
+# -------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Generate a beat-locked chart from an audio file.")
+    ap.add_argument("--audio", default="song.mp3")
+    ap.add_argument("--out", default="chart.json")
+    ap.add_argument("--format", choices=FORMATS, default="json", help="row JSON, minified columnar JSON or binary")
+    ap.add_argument("--compress", action="store_true", help="also write .gz/.br sidecars")
+    ap.add_argument("--params", help="JSON file overriding ChartConfig fields (bpm, boundaries, stage_* lists, ...)")
+    ap.add_argument("--bpm", help='override the BPM; "auto" estimates it from the onset envelope')
+    ap.add_argument("--tempo-map", action="store_true", help="follow tempo changes with a piecewise grid")
+    ap.add_argument("--tempo-warp", action="store_true", help="track the beat phase over the whole song and warp the grid")
+    ap.add_argument("--stream", action="store_true", help="block-wise decode + onset analysis for very long audio")
+    ap.add_argument("--decoder", choices=DECODERS, default="librosa", help="audio decode backend")
+    ap.add_argument("--sr", type=int, help="analysis sample rate, e.g. 22050 or 11025 (default: the file's own)")
+    ap.add_argument("--no-cache", action="store_true", help="always decode and analyze from scratch")
+    ap.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    ap.add_argument("--cache-max-mb", type=float, default=DEFAULT_MAX_BYTES / (1024 * 1024))
+    ap.add_argument("--profile", action="store_true", help="time every phase/stage and write a JSON run report")
+    ap.add_argument("--profile-out", help="run report path (default: <out>.profile.json)")
+    ap.add_argument("--cprofile", action="store_true",
+                    help="with --profile: also run analysis + charting under cProfile (<out>.prof)")
+    ap.add_argument("--full", action="store_true", help="rebuild every stage instead of splicing unchanged ones")
+    ap.add_argument("--watch", action="store_true", help="rebuild the chart each time the --params file is saved")
+    ap.add_argument("--difficulties", help="JSON {name: overrides of DIFFICULTY_KEYS}, easiest first; "
+                                           "writes one chart per name (chart.json -> chart.<name>.json)")
+    ap.add_argument("--independent", action="store_true",
+                    help="with --difficulties: build each chart on its own instead of nesting easier ones")
+    ap.add_argument("--no-validate", action="store_true", help="skip the post-write chart check (validate_chart.py)")
+    args = ap.parse_args()
+    if args.watch and not args.params:
+        ap.error("--watch needs --params")
+    if args.watch and args.difficulties:
+        ap.error("--watch builds a single chart; drop --difficulties")
+
+    def with_cli_tempo(cfg: ChartConfig) -> ChartConfig:
+        if args.bpm is not None:
+            cfg = replace(cfg, bpm=args.bpm if args.bpm == "auto" else float(args.bpm))
+        if args.tempo_map:
+            cfg = replace(cfg, tempo_map=True)
+        if args.tempo_warp:
+            cfg = replace(cfg, tempo_warp=True)
+        cfg.validate()
+        return cfg
+
+    def check_written(path: str, cfg: ChartConfig, timer: PhaseTimer) -> bool:
+        """Read the written chart back and check its timing invariants; prints any violations."""
+        if args.no_validate:
+            return True
+        with timer.phase("validate") as info:
+            report = validate_file(path, ChartRules.from_config(cfg))
+            info["ok"] = report.ok
+        if not report.ok:
+            print(f"{path}: {report.format()}")
+        return report.ok
+
+    cfg = ChartConfig()
+    if args.params:
+        with open(args.params) as f:
+            cfg = ChartConfig.from_dict(json.load(f))
+
+    cache = None
+    if not args.no_cache:
+        cache = AnalysisCache(args.cache_dir, max_bytes=int(args.cache_max_mb * 1024 * 1024))
+
+    timer = PhaseTimer(enabled=args.profile)
+    profiler = None
+    if args.profile and args.cprofile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    # Load audio (or reuse the cached analysis)
+    analysis = analyze_audio(
+        args.audio, cache=cache, stream=args.stream, decoder=args.decoder, sr=args.sr, timer=timer
+    )
+
+    if args.difficulties:
+        with open(args.difficulties) as f:
+            cfgs = difficulty_configs(with_cli_tempo(cfg), json.load(f))
+        with timer.phase("tempo"):
+            tempo_cfg, beat0, tempo_map = resolve_tempo(analysis, next(iter(cfgs.values())), cache=cache)
+        cfgs = {name: replace(c, bpm=tempo_cfg.bpm) for name, c in cfgs.items()}
+        charts = build_difficulties(
+            analysis, cfgs, beat0=beat0, tempo_map=tempo_map, nested=not args.independent, timer=timer
+        )
+        if profiler is not None:
+            profiler.disable()
+        print(f"Estimated beat0 ≈ {beat0:.4f}s (BPM={tempo_cfg.bpm})")
+        prev_rows: Optional[List[Dict]] = None
+        valid = True
+        for name, (rows, stats) in charts.items():
+            path = difficulty_path(args.out, name)
+            with timer.phase("write", format=args.format, difficulty=name):
+                write_chart(rows, path, args.format, compress=args.compress)
+            valid &= check_written(path, cfgs[name], timer)
+            nested = ""
+            if prev_rows is not None:
+                superset = is_superset(rows, prev_rows)
+                nested = f" | superset of previous: {superset}"
+                # nested charts guarantee it; a miss fails the run like a validation error
+                if not args.independent and not superset:
+                    print(f"{path}: FAILED: not a superset of the previous difficulty")
+                    valid = False
+            print(f"\n[{name}]")
+            for st in stats:
+                print(format_stage_stats(st))
+            print(f"Wrote {path} | notes={len(rows)}{nested}")
+            prev_rows = rows
+        if args.profile:
+            write_profile_report(
+                args, analysis, timer, profiler,
+                bpm=tempo_cfg.bpm, beat0=beat0, tempo_map=tempo_map,
+                notes={name: len(rows) for name, (rows, _) in charts.items()},
+                stages={name: stats for name, (_, stats) in charts.items()},
+            )
+        if not valid:
+            raise SystemExit(1)
+        return
+
+    # Stages whose inputs are unchanged since the last run are spliced from the existing chart
+    reuse = {} if args.full else load_stage_results(args.out)
+
+    def chart_and_write(cfg: ChartConfig, timer: PhaseTimer) -> Tuple[ChartConfig, float, Optional[TempoMap], List[Dict], List[Dict]]:
+        nonlocal reuse
+        with timer.phase("tempo"):
+            cfg, beat0, tempo_map = resolve_tempo(analysis, cfg, cache=cache)
+        out, stats = build_chart(analysis, cfg, beat0=beat0, tempo_map=tempo_map, timer=timer, reuse=reuse)
+        with timer.phase("write", format=args.format):
+            write_chart(out, args.out, args.format, compress=args.compress)
+            save_stage_results(args.out, stats)
+        reuse = stage_results(out, stats)
+        return cfg, beat0, tempo_map, out, stats
+
+    cfg, beat0, tempo_map, out, stats = chart_and_write(with_cli_tempo(cfg), timer)
+    if profiler is not None:
+        profiler.disable()
+    print(f"Estimated beat0 ≈ {beat0:.4f}s (BPM={cfg.bpm})")
+    if tempo_map is not None:
+        for seg in tempo_map.segments:
+            print(f"  tempo {seg.start:7.2f}s - {seg.end:7.2f}s: {seg.bpm:.3f} BPM, beat0 ≈ {seg.beat0:.4f}s")
+        if tempo_map.warp is not None:
+            print(f"  time-warp: {min(tempo_map.warp.offsets) * 1e3:+.1f} .. {max(tempo_map.warp.offsets) * 1e3:+.1f} ms")
+            for r in tempo_map.warp.residuals:
+                if r["windows"]:
+                    print(f"  stage {r['stage']} phase error: {r['before_ms']:6.1f} ms -> {r['after_ms']:5.1f} ms"
+                          f" ({r['windows']} windows)")
+    for st in stats:
+        print(format_stage_stats(st))
+
+    print(f"\nWrote {args.out} | notes={len(out)} | duration={analysis.duration:.2f}s")
+    valid = check_written(args.out, cfg, timer)
+
+    if args.profile:
+        write_profile_report(
+            args, analysis, timer, profiler,
+            bpm=cfg.bpm, beat0=beat0, tempo_map=tempo_map, notes=len(out), stages=stats,
+        )
+    if not valid and not args.watch:
+        raise SystemExit(1)
+
+    if args.watch:
+        def rebuild(cfg: ChartConfig) -> None:
+            t0 = time.perf_counter()
+            timer = PhaseTimer(enabled=False)
+            cfg, _, _, out, stats = chart_and_write(with_cli_tempo(cfg), timer)
+            check_written(args.out, cfg, timer)
+            rebuilt = [st["stage"] for st in stats if not st["reused"]]
+            print(f"[{time.strftime('%H:%M:%S')}] stages {rebuilt or 'none'} rebuilt -> {args.out} "
+                  f"({len(out)} notes) in {(time.perf_counter() - t0) * 1e3:.0f} ms", flush=True)
+
+        watch_params(args.params, rebuild)
 
 
 if __name__ == "__main__":
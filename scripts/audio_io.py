@@ -0,0 +1,128 @@
+"""
+Audio decoding backends for the analysis pipeline.
+
+- "librosa":   librosa.load (the original path; handles anything audioread can)
+- "soundfile": libsndfile directly (WAV/FLAC/OGG, and MP3 with libsndfile >= 1.1)
+- "ffmpeg":    an `ffmpeg` subprocess piping mono float32 PCM (any codec, and
+               ffmpeg resamples while decoding)
+- "auto":      soundfile if it can open the file, else ffmpeg if it is on PATH,
+               else librosa
+
+sr=None keeps the file's native rate. Otherwise audio is downmixed and then
+resampled once to `sr` (onset detection is fine at 22.05 or 11.025 kHz and
+the STFT cost scales with the sample count). analysis_frame() scales the STFT
+with the rate so frames last as long as the native-rate 2048/512 ones: with
+a fixed 2048/512 STFT the onset envelope of a 44.1 kHz file lags ~40 ms more
+at 22.05 kHz, which shifts beat0 and every note. Use scripts/compare_decode.py to check a song's beat0
+and note times against the full-rate path before switching it over.
+
+soundfile and librosa are imported on first decode, so importing this module
+(e.g. for DECODERS in a CLI parser) stays cheap.
+"""
+import math
+import shutil
+import subprocess
+from typing import Optional, Tuple
+
+import numpy as np
+
+DECODERS = ["auto", "librosa", "soundfile", "ffmpeg"]
+RES_TYPE = "soxr_hq"
+N_FFT = 2048
+HOP_LENGTH = 512
+
+
+def analysis_frame(sr: Optional[int], native_sr: int) -> Tuple[int, int]:
+    """(n_fft, hop_length) at `sr` spanning the same time as librosa's defaults at
+    the file's native rate (the power of two closest to it when resampling down)."""
+    if sr is None or sr >= native_sr:
+        return N_FFT, HOP_LENGTH
+    n_fft = int(2 ** round(math.log2(N_FFT * sr / native_sr)))
+    return n_fft, n_fft // 4
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which("ffmpeg") is not None
+
+
+def soundfile_can_read(path: str) -> bool:
+    import soundfile as sf
+
+    try:
+        sf.info(path)
+    except (RuntimeError, OSError):  # LibsndfileError is a RuntimeError
+        return False
+    return True
+
+
+def resolve_decoder(path: str, decoder: str = "auto") -> str:
+    """The concrete backend `decoder` stands for on this file and machine."""
+    if decoder not in DECODERS:
+        raise ValueError(f"unknown decoder {decoder!r} (expected one of {DECODERS})")
+    if decoder != "auto":
+        return decoder
+    if soundfile_can_read(path):
+        return "soundfile"
+    if ffmpeg_available():
+        return "ffmpeg"
+    return "librosa"
+
+
+def native_rate(path: str) -> int:
+    import soundfile as sf
+
+    try:
+        return int(sf.info(path).samplerate)
+    except (RuntimeError, OSError):
+        pass
+    if ffmpeg_available():
+        return _ffmpeg_native_rate(path)
+    import librosa
+
+    return int(librosa.get_samplerate(path))
+
+
+def _ffmpeg_native_rate(path: str) -> int:
+    out = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=sample_rate",
+         "-of", "default=noprint_wrappers=1:nokey=1", path],
+        capture_output=True, text=True, check=True,
+    ).stdout.strip()
+    return int(out.splitlines()[0])
+
+
+def _decode_ffmpeg(path: str, sr: Optional[int]) -> Tuple[np.ndarray, int]:
+    if not ffmpeg_available():
+        raise RuntimeError("the ffmpeg decoder needs ffmpeg on PATH")
+    rate = sr or _ffmpeg_native_rate(path)
+    proc = subprocess.run(
+        ["ffmpeg", "-nostdin", "-v", "error", "-i", path, "-f", "f32le", "-ac", "1", "-ar", str(rate), "-"],
+        capture_output=True, check=True,
+    )
+    return np.frombuffer(proc.stdout, dtype="<f4").astype(np.float32, copy=False), rate
+
+
+def decode_audio(
+    path: str,
+    *,
+    decoder: str = "librosa",
+    sr: Optional[int] = None,
+    res_type: str = RES_TYPE,
+) -> Tuple[np.ndarray, int]:
+    """Mono float32 samples and their rate."""
+    decoder = resolve_decoder(path, decoder)
+    if decoder == "ffmpeg":
+        return _decode_ffmpeg(path, sr)
+    import librosa
+    import soundfile as sf
+
+    if decoder == "librosa":
+        y, rate = librosa.load(path, sr=sr, mono=True, res_type=res_type)
+        return y, int(rate)
+
+    data, rate = sf.read(path, dtype="float32", always_2d=True)
+    y = np.mean(data, axis=1) if data.shape[1] > 1 else data[:, 0]
+    if sr is not None and sr != rate:
+        y = librosa.resample(y, orig_sr=rate, target_sr=sr, res_type=res_type)
+        rate = sr
+    return np.ascontiguousarray(y, dtype=np.float32), int(rate)
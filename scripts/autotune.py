@@ -0,0 +1,323 @@
+"""
+Search per-stage selection parameters against a target difficulty curve.
+
+The onset analysis is loaded once (through the analysis cache, or straight
+from a feature store with --features/--song), copied into
+shared memory and attached read-only by every worker process. A stage's notes
+depend only on that stage's own parameters, so each stage is tuned on its own:
+every (keep, min_gap, max_gap, fill_rate, cluster_gap) combination is scored
+by how close its notes-per-second and hold ratio land to the target.
+
+    python scripts/autotune.py --audio song.mp3 --params params.json \\
+        --target-nps 0.8 1.4 1.9 2.2 2.6 3.4 --target-hold 0.3 0.1 0 0 0 0 \\
+        --out chart.json --report tune-report.json
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, replace
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from analysis_cache import DEFAULT_CACHE_DIR, AnalysisCache
+from analyze_song import (
+    Analysis,
+    ChartConfig,
+    analyze_audio,
+    build_chart,
+    resolve_tempo,
+    stage_candidates,
+    stage_notes,
+)
+from chart_format import FORMATS, write_chart
+from tempo import TempoMap
+
+# ChartConfig list field tuned for each search key
+STAGE_FIELDS = {
+    "keep": "stage_keep",
+    "min_gap": "stage_min_gap",
+    "max_gap": "stage_max_gap",
+    "fill_rate": "stage_fill_rate",
+    "cluster_gap": "stage_cluster_gap",
+    "subdiv": "stage_subdiv",
+}
+
+DEFAULT_SPACE = {
+    "keep": [round(0.20 + 0.05 * i, 2) for i in range(16)],          # 0.20 .. 0.95
+    "min_gap": [round(0.15 + 0.02 * i, 2) for i in range(16)],       # 0.15 .. 0.45
+    "max_gap": [0.60, 0.85, 1.00, 1.50],
+    "fill_rate": [1, 2, 3],
+    "cluster_gap": [0.20, 0.24, 0.28, 0.32, 0.38, 0.42, 0.46],
+}
+
+
+# -------------------------
+# Shared read-only analysis
+# -------------------------
+def share_arrays(arrays: Dict[str, np.ndarray]) -> Tuple[List[shared_memory.SharedMemory], Dict]:
+    """Copy arrays into named shared memory. Returns (handles to keep alive/unlink, attach spec)."""
+    handles, spec = [], {}
+    for name, a in arrays.items():
+        shm = shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1))
+        np.ndarray(a.shape, dtype=a.dtype, buffer=shm.buf)[...] = a
+        handles.append(shm)
+        spec[name] = (shm.name, a.shape, a.dtype.str)
+    return handles, spec
+
+
+def attach_arrays(spec: Dict) -> Tuple[List[shared_memory.SharedMemory], Dict[str, np.ndarray]]:
+    handles, arrays = [], {}
+    for name, (shm_name, shape, dtype) in spec.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        a = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        a.flags.writeable = False
+        handles.append(shm)
+        arrays[name] = a
+    return handles, arrays
+
+
+_worker: Dict = {}
+
+
+def _init_worker(spec: Dict, duration: float, sr: int, cfg: Dict, beat0: float, tempo_map: Optional[List[Dict]]) -> None:
+    handles, arrays = attach_arrays(spec)
+    _worker.update(
+        handles=handles,
+        analysis=Analysis(
+            onset_env=arrays["onset_env"],
+            onset_times_env=arrays["onset_times_env"],
+            duration=duration,
+            sr=sr,
+            band_env=arrays.get("band_env"),
+        ),
+        cfg=ChartConfig.from_dict(cfg),
+        beat0=beat0,
+        tempo_map=None if tempo_map is None else TempoMap.from_dict(tempo_map),
+        cands={},
+    )
+
+
+# -------------------------
+# Evaluation
+# -------------------------
+def stage_config(cfg: ChartConfig, stage_idx: int, combo: Dict) -> ChartConfig:
+    """cfg with this stage's entries replaced by the combo's values."""
+    changes = {}
+    for key, value in combo.items():
+        name = STAGE_FIELDS[key]
+        values = list(getattr(cfg, name))
+        values[stage_idx - 1] = value
+        changes[name] = values
+    return replace(cfg, **changes)
+
+
+def stage_metrics(
+    analysis: Analysis,
+    cfg: ChartConfig,
+    stage_idx: int,
+    *,
+    beat0: float,
+    cands: Dict,
+    tempo_map: Optional[TempoMap] = None,
+) -> Optional[Dict]:
+    subdiv = cfg.stage_subdiv[stage_idx - 1]
+    key = (stage_idx, subdiv)
+    if key not in cands:
+        cands[key] = stage_candidates(analysis, cfg, stage_idx, beat0=beat0, tempo_map=tempo_map)
+    sc = cands[key]
+    if sc is None or len(sc.cand) == 0:
+        return None
+
+    # count what the chart would ship: stage_notes also drops notes outside the song and
+    # notes arriving while every lane is held
+    stage, _ = stage_notes(analysis, cfg, stage_idx, beat0=beat0, tempo_map=tempo_map, sc=sc)
+    notes = len(stage)
+    holds = int(np.count_nonzero(stage.hold))
+    return dict(
+        notes=notes,
+        holds=holds,
+        nps=notes / (sc.hit_end - sc.hit_start),
+        hold_ratio=holds / notes if notes else 0.0,
+    )
+
+
+def score_metrics(m: Optional[Dict], target_nps: float, target_hold: float, hold_weight: float) -> float:
+    """Lower is better: squared relative NPS error + weighted squared hold-ratio error."""
+    if m is None:
+        return float("inf")
+    nps_err = (m["nps"] - target_nps) / max(target_nps, 1e-6)
+    return nps_err ** 2 + hold_weight * (m["hold_ratio"] - target_hold) ** 2
+
+
+def _evaluate(task: Tuple[int, List[Dict], float, float, float]) -> List[Tuple[int, Dict, Optional[Dict], float]]:
+    stage_idx, combos, target_nps, target_hold, hold_weight = task
+    w = _worker
+    out = []
+    for combo in combos:
+        cfg = stage_config(w["cfg"], stage_idx, combo)
+        m = stage_metrics(w["analysis"], cfg, stage_idx, beat0=w["beat0"], cands=w["cands"], tempo_map=w["tempo_map"])
+        out.append((stage_idx, combo, m, score_metrics(m, target_nps, target_hold, hold_weight)))
+    return out
+
+
+def sample_space(space: Dict[str, List], samples: int, rng: random.Random, current: Dict) -> List[Dict]:
+    """The full grid if it fits in `samples`, else a seeded random subset (always incl. `current`)."""
+    keys = sorted(space)
+    total = 1
+    for k in keys:
+        total *= len(space[k])
+    if total <= samples:
+        combos = [dict(zip(keys, values)) for values in itertools.product(*(space[k] for k in keys))]
+    else:
+        seen = set()
+        combos = []
+        while len(combos) < samples:
+            values = tuple(rng.choice(space[k]) for k in keys)
+            if values not in seen:
+                seen.add(values)
+                combos.append(dict(zip(keys, values)))
+    if current not in combos:
+        combos.append(current)
+    return combos
+
+
+# -------------------------
+# Main
+# -------------------------
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--audio", default="song.mp3")
+    ap.add_argument("--features", help="feature store (feature_store.py) holding the song's analysis")
+    ap.add_argument("--song", help="with --features: tune this stored song instead of analyzing --audio")
+    ap.add_argument("--params", help="starting ChartConfig overrides (JSON)")
+    ap.add_argument("--target-nps", type=float, nargs="+", required=True, help="notes/second per stage")
+    ap.add_argument("--target-hold", type=float, nargs="+", help="hold ratio per stage (default 0)")
+    ap.add_argument("--hold-weight", type=float, default=4.0)
+    ap.add_argument("--space", help="JSON {key: [values]} over keep/min_gap/max_gap/fill_rate/cluster_gap/subdiv")
+    ap.add_argument("--samples", type=int, default=3000, help="combinations tried per stage")
+    ap.add_argument("--stages", type=int, nargs="+", help="only tune these stages (1-based)")
+    ap.add_argument("--jobs", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--seed", type=int, default=0, help="sampling seed")
+    ap.add_argument("--top", type=int, default=10, help="ranked results kept per stage in the report")
+    ap.add_argument("--out", default="chart.json")
+    ap.add_argument("--format", choices=FORMATS, default="json")
+    ap.add_argument("--params-out", help="write the tuned ChartConfig here (default: <out>.params.json)")
+    ap.add_argument("--report", help="ranked per-stage report (default: <out>.tune.json)")
+    ap.add_argument("--no-cache", action="store_true")
+    ap.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    args = ap.parse_args()
+
+    cfg = ChartConfig()
+    if args.params:
+        with open(args.params) as f:
+            cfg = ChartConfig.from_dict(json.load(f))
+    n = cfg.n_stages
+    if len(args.target_nps) != n:
+        ap.error(f"--target-nps needs {n} values (one per stage)")
+    target_hold = args.target_hold or [0.0] * n
+    if len(target_hold) != n:
+        ap.error(f"--target-hold needs {n} values (one per stage)")
+    space = DEFAULT_SPACE
+    if args.space:
+        with open(args.space) as f:
+            space = json.load(f)
+        unknown = sorted(set(space) - set(STAGE_FIELDS))
+        if unknown:
+            ap.error(f"unknown search keys: {', '.join(unknown)}")
+
+    if args.song and not args.features:
+        ap.error("--song needs --features")
+
+    cache = None if args.no_cache else AnalysisCache(args.cache_dir)
+    t0 = time.perf_counter()
+    if args.song:
+        from feature_store import FeatureStore
+
+        store = FeatureStore(args.features)
+        analysis = store.analysis(args.song)
+        tempo = store.resolved_tempo(args.song, cfg)
+    else:
+        analysis = analyze_audio(args.audio, cache=cache)
+        tempo = None
+    cfg, beat0, tempo_map = tempo or resolve_tempo(analysis, cfg, cache=cache)
+    print(f"Analysis ready in {time.perf_counter() - t0:.2f}s (BPM={cfg.bpm}, beat0 ≈ {beat0:.4f}s)")
+
+    rng = random.Random(args.seed)
+    stages = args.stages or list(range(1, n + 1))
+    tasks = []
+    for stage_idx in stages:
+        current = {k: getattr(cfg, STAGE_FIELDS[k])[stage_idx - 1] for k in space}
+        combos = sample_space(space, args.samples, rng, current)
+        chunk = max(1, len(combos) // (4 * max(1, args.jobs)))
+        for c0 in range(0, len(combos), chunk):
+            tasks.append((stage_idx, combos[c0:c0 + chunk], args.target_nps[stage_idx - 1],
+                          target_hold[stage_idx - 1], args.hold_weight))
+
+    shared = {
+        "onset_env": np.ascontiguousarray(analysis.onset_env),
+        "onset_times_env": np.ascontiguousarray(analysis.onset_times_env),
+    }
+    if analysis.band_env is not None:
+        shared["band_env"] = np.ascontiguousarray(analysis.band_env)
+    handles, spec = share_arrays(shared)
+    results: Dict[int, List] = {s: [] for s in stages}
+    t0 = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(
+            max_workers=max(1, args.jobs),
+            initializer=_init_worker,
+            initargs=(spec, analysis.duration, analysis.sr, asdict(cfg), beat0,
+                      None if tempo_map is None else tempo_map.to_dict()),
+        ) as pool:
+            for batch in pool.map(_evaluate, tasks):
+                for stage_idx, combo, m, score in batch:
+                    results[stage_idx].append((score, combo, m))
+    finally:
+        for shm in handles:
+            shm.close()
+            shm.unlink()
+    elapsed = time.perf_counter() - t0
+    evaluated = sum(len(r) for r in results.values())
+    print(f"Evaluated {evaluated} combinations in {elapsed:.2f}s ({evaluated / elapsed * 60:.0f}/min, {args.jobs} workers)\n")
+
+    best_cfg = cfg
+    report = dict(audio=args.audio, bpm=cfg.bpm, beat0=beat0, evaluated=evaluated, seconds=elapsed, stages=[])
+    for stage_idx in stages:
+        ranked = sorted(results[stage_idx], key=lambda r: r[0])
+        score, combo, m = ranked[0]
+        best_cfg = stage_config(best_cfg, stage_idx, combo)
+        report["stages"].append(dict(
+            stage=stage_idx,
+            target_nps=args.target_nps[stage_idx - 1],
+            target_hold=target_hold[stage_idx - 1],
+            ranked=[dict(score=s, params=c, metrics=mm) for s, c, mm in ranked[:args.top]],
+        ))
+        if m is None:
+            print(f"Stage {stage_idx}: no playable notes")
+            continue
+        print(
+            f"Stage {stage_idx}: score={score:.4f} nps={m['nps']:.2f} (target {args.target_nps[stage_idx - 1]:.2f}) "
+            f"holds={m['hold_ratio']:.2f} (target {target_hold[stage_idx - 1]:.2f}) "
+            + " ".join(f"{k}={v}" for k, v in sorted(combo.items()))
+        )
+
+    params_out = args.params_out or args.out + ".params.json"
+    with open(params_out, "w") as f:
+        json.dump(asdict(best_cfg), f, indent=2)
+    report_path = args.report or args.out + ".tune.json"
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    out, _ = build_chart(analysis, best_cfg, beat0=beat0, tempo_map=tempo_map)
+    write_chart(out, args.out, args.format)
+    print(f"\nWrote {args.out} | notes={len(out)} | params={params_out} | report={report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Chart a whole song library in parallel.
+
+The manifest is JSON:
+
+    {
+      "seed": 42,
+      "out_dir": "charts",
+      "defaults": {"generator": "analyze", "stage_keep": [...]},
+      "songs": [
+        {"id": "drunk", "audio": "audio/drunk.mp3", "bpm": 144, "boundaries": [...]},
+        {"id": "mikito", "audio": "audio/song.mp3", "bpm": 75, "stage_min_gap": [...]},
+        {"id": "practice", "generator": "random", "bpm": 120, "duration_seconds": 180}
+      ]
+    }
+
+"stream": true analyzes that song block by block (for hour-long mixes); "decoder"
+and "sr" pick its decode backend and analysis rate (see scripts/audio_io.py).
+Every other key of a song entry (besides id/audio/out/generator/stream/decoder/sr) is a ChartConfig
+(analyze) or RandomChartConfig (random) field and overrides "defaults".
+Relative paths are resolved against the manifest's directory. Each song gets
+its own seed (explicit "seed", else derived from the manifest seed and the id),
+so results don't depend on scheduling order or worker count. Every written
+chart is read back and checked by validate_chart.py; a chart that fails is
+reported as a failed song (--no-validate skips the check). With --features,
+songs stored in that feature store (scripts/feature_store.py) from the same
+file and decode settings skip decoding and analysis entirely, and also the
+tempo / beat0 search if they were stored with the same tempo settings.
+
+    python scripts/batch_chart.py library.json --jobs 8
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+from analysis_cache import DEFAULT_CACHE_DIR
+from chart_format import FORMAT_EXT, FORMATS, write_chart
+
+ENTRY_KEYS = {"id", "audio", "out", "generator", "stream", "decoder", "sr"}
+
+
+def song_seed(base_seed: int, song_id: str) -> int:
+    """Deterministic per-song seed, independent of manifest order."""
+    return zlib.crc32(f"{base_seed}:{song_id}".encode()) & 0x7FFFFFFF
+
+
+def load_jobs(
+    manifest_path: str,
+    *,
+    out_dir: Optional[str] = None,
+    cache_dir: Optional[str] = None,
+    fmt: str = "json",
+    compress: bool = False,
+    validate: bool = True,
+    features: Optional[str] = None,
+) -> List[Dict]:
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    base_seed = int(manifest.get("seed", 42))
+    out_dir = out_dir or os.path.join(base, manifest.get("out_dir", "charts"))
+    defaults = manifest.get("defaults", {})
+
+    jobs: List[Dict] = []
+    seen = set()
+    for i, song in enumerate(manifest["songs"]):
+        entry = {**defaults, **song}
+        song_id = str(entry.get("id") or os.path.splitext(os.path.basename(entry.get("audio", f"song{i}")))[0])
+        if song_id in seen:
+            raise ValueError(f"Duplicate song id in manifest: {song_id}")
+        seen.add(song_id)
+
+        generator = entry.get("generator", "analyze")
+        if generator not in ("analyze", "random"):
+            raise ValueError(f"{song_id}: unknown generator {generator!r}")
+
+        config = {k: v for k, v in entry.items() if k not in ENTRY_KEYS}
+        config.setdefault("seed", song_seed(base_seed, song_id))
+
+        audio = entry.get("audio")
+        if generator == "analyze" and not audio:
+            raise ValueError(f"{song_id}: 'audio' is required for the analyze generator")
+
+        jobs.append(dict(
+            id=song_id,
+            generator=generator,
+            audio=os.path.join(base, audio) if audio else None,
+            out=os.path.join(base, entry["out"]) if "out" in entry else os.path.join(out_dir, song_id + FORMAT_EXT[fmt]),
+            config=config,
+            stream=bool(entry.get("stream", False)),
+            decoder=entry.get("decoder", "librosa"),
+            sr=entry.get("sr"),
+            cache_dir=cache_dir,
+            format=fmt,
+            compress=compress,
+            validate=validate,
+            features=features,
+        ))
+    return jobs
+
+
+def chart_song(job: Dict) -> Dict:
+    """Worker: chart one song and write it. Never raises, failures are reported."""
+    t0 = time.perf_counter()
+    result = dict(id=job["id"], out=job["out"], ok=False, seconds=0.0, notes=0, holds=0)
+    try:
+        if job["generator"] == "analyze":
+            from analysis_cache import AnalysisCache
+            from analyze_song import ChartConfig, analyze_audio, build_chart, resolve_tempo
+
+            cfg = ChartConfig.from_dict(job["config"])
+            cache = AnalysisCache(job["cache_dir"]) if job["cache_dir"] else None
+            settings = dict(stream=job["stream"], decoder=job["decoder"], sr=job["sr"])
+            store, tempo = None, None
+            if job["features"]:
+                from feature_store import FeatureStore
+
+                store = FeatureStore(job["features"])
+            if store is not None and store.is_fresh(job["id"], job["audio"], **settings):
+                analysis = store.analysis(job["id"])
+                # bpm / beat0 / tempo map as stored, if the song was added with this job's tempo settings
+                tempo = store.resolved_tempo(job["id"], cfg)
+                result.update(features=True, stored_tempo=tempo is not None)
+            else:
+                analysis = analyze_audio(job["audio"], cache=cache, **settings)
+            cfg, beat0, tempo_map = tempo or resolve_tempo(analysis, cfg, cache=cache)
+            out, _ = build_chart(analysis, cfg, beat0=beat0, tempo_map=tempo_map)
+            result.update(bpm=cfg.bpm, beat0=beat0)
+        else:
+            from generate_chart import RandomChartConfig, build_random_chart
+
+            cfg = RandomChartConfig.from_dict(job["config"])
+            out, _ = build_random_chart(cfg)
+
+        os.makedirs(os.path.dirname(os.path.abspath(job["out"])), exist_ok=True)
+        write_chart(out, job["out"], job["format"], compress=job["compress"])
+        result.update(notes=len(out), holds=sum(1 for n in out if n["type"] == "hold"))
+        if job["validate"]:
+            from chart_core.validate import ChartRules, validate_file
+
+            report = validate_file(job["out"], ChartRules.from_config(cfg))
+            if not report.ok:
+                bad = ", ".join(f"{name}={len(idx)}" for name, idx in report.violations.items() if len(idx))
+                raise ValueError(f"chart failed validation ({bad})")
+        result["ok"] = True
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        result["traceback"] = traceback.format_exc()
+    result["seconds"] = time.perf_counter() - t0
+    return result
+
+
+def format_summary(results: List[Dict]) -> str:
+    width = max([len("song")] + [len(r["id"]) for r in results])
+    lines = [f"{'song':<{width}}  {'status':<6} {'time':>8} {'notes':>6} {'holds':>6}  output"]
+    for r in results:
+        status = "ok" if r["ok"] else "FAILED"
+        detail = r["out"] if r["ok"] else r.get("error", "")
+        lines.append(f"{r['id']:<{width}}  {status:<6} {r['seconds']:>7.2f}s {r['notes']:>6} {r['holds']:>6}  {detail}")
+    return "\n".join(lines)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("manifest")
+    ap.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="worker processes (default: all cores)")
+    ap.add_argument("--out-dir", help="override the manifest's out_dir")
+    ap.add_argument("--only", nargs="+", help="chart only these song ids")
+    ap.add_argument("--format", choices=FORMATS, default="json")
+    ap.add_argument("--compress", action="store_true", help="also write .gz/.br sidecars")
+    ap.add_argument("--no-cache", action="store_true")
+    ap.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    ap.add_argument("--summary-json", help="also write the per-song results here")
+    ap.add_argument("--no-validate", action="store_true", help="skip the post-write chart check (validate_chart.py)")
+    ap.add_argument("--features", help="feature store (feature_store.py) to read up-to-date analyses from")
+    args = ap.parse_args()
+
+    jobs = load_jobs(
+        args.manifest,
+        out_dir=args.out_dir,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        fmt=args.format,
+        compress=args.compress,
+        validate=not args.no_validate,
+        features=args.features,
+    )
+    if args.only:
+        unknown = sorted(set(args.only) - {j["id"] for j in jobs})
+        if unknown:
+            ap.error(f"--only: no song with id {', '.join(unknown)} in {args.manifest}")
+        jobs = [j for j in jobs if j["id"] in set(args.only)]
+
+    t0 = time.perf_counter()
+    results: Dict[str, Dict] = {}
+    workers = max(1, min(args.jobs, len(jobs)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(chart_song, job): job for job in jobs}
+        for fut in as_completed(futures):
+            job = futures[fut]
+            try:
+                r = fut.result()
+            except Exception as e:  # worker process died
+                r = dict(id=job["id"], out=job["out"], ok=False, seconds=0.0, notes=0, holds=0,
+                         error=f"{type(e).__name__}: {e}")
+            results[job["id"]] = r
+            status = "ok" if r["ok"] else f"FAILED ({r['error']})"
+            print(f"[{len(results)}/{len(jobs)}] {r['id']}: {status} in {r['seconds']:.2f}s", flush=True)
+
+    ordered = [results[j["id"]] for j in jobs]
+    print()
+    print(format_summary(ordered))
+    failed = sum(1 for r in ordered if not r["ok"])
+    print(f"\n{len(ordered) - failed}/{len(ordered)} charts in {time.perf_counter() - t0:.2f}s ({workers} workers)")
+
+    if args.summary_json:
+        with open(args.summary_json, "w") as f:
+            json.dump([{k: v for k, v in r.items() if k != "traceback"} for r in ordered], f, indent=2)
+
+    for r in ordered:
+        if not r["ok"] and r.get("traceback"):
+            print(f"\n--- {r['id']} ---\n{r['traceback']}", file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Benchmark the batched beat0 phase search against the original per-offset loop.
+
+Runs on a synthetic onset envelope (no audio needed):
+    python scripts/bench_beat0.py --bpm 144 --durations 45 230 3600
+"""
+import argparse
+import time
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+from analyze_song import estimate_beat0, make_fixed_grid
+
+
+def legacy_estimate_beat0(
+    *,
+    bpm: float,
+    duration: float,
+    onset_times_env: np.ndarray,
+    onset_env: np.ndarray,
+    search_window: Optional[Tuple[float, float]] = (0.0, 45.0),
+    grid_subdiv: int = 1,
+    steps: int = 240,
+) -> float:
+    """The original loop: one full-song grid + np.interp per candidate offset."""
+    spb = 60.0 / bpm
+    t_min, t_max = search_window if search_window is not None else (0.0, duration)
+    t_max = min(t_max, duration)
+
+    best_o = 0.0
+    best_score = -1e18
+
+    for o in np.linspace(0.0, spb, steps, endpoint=False):
+        grid = make_fixed_grid(duration_s=duration, bpm=bpm, subdiv_per_beat=grid_subdiv, beat0=o)
+        grid = grid[(grid >= t_min) & (grid <= t_max)]
+        if len(grid) == 0:
+            continue
+        s = np.interp(grid, onset_times_env, onset_env)
+        score = float(np.sum(s))
+        if score > best_score:
+            best_score = score
+            best_o = float(o)
+
+    return best_o
+
+
+def synth_onset_env(
+    *,
+    duration: float,
+    bpm: float,
+    beat0: float,
+    sr: int = 44100,
+    hop: int = 512,
+    seed: int = 0,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Noisy click envelope with 8th-note ghosts and a known beat phase."""
+    rng = np.random.default_rng(seed)
+    times = np.arange(int(duration * sr / hop) + 1) * (hop / sr)
+    spb = 60.0 / bpm
+    phase = np.mod(times - beat0, spb) / spb
+    dist = np.minimum(phase, 1.0 - phase) * spb
+    half = np.abs(phase - 0.5) * spb
+    env = np.exp(-(dist / 0.01) ** 2) + 0.4 * np.exp(-(half / 0.01) ** 2)
+    env += 0.15 * rng.random(len(times))
+    return times, env / np.max(env)
+
+
+def best_time(fn: Callable[[], float], repeat: int) -> Tuple[float, float]:
+    best = float("inf")
+    result = 0.0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--bpm", type=float, default=144.0)
+    ap.add_argument("--beat0", type=float, default=0.1234)
+    ap.add_argument("--durations", type=float, nargs="+", default=[45.0, 230.0, 3600.0])
+    ap.add_argument("--steps", type=int, default=240)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    print(f"{'duration':>9} {'window':>7} {'loop ms':>9} {'batched ms':>11} {'speedup':>8} "
+          f"{'loop beat0':>11} {'batched':>9} {'refined':>9}")
+
+    for duration in args.durations:
+        times, env = synth_onset_env(duration=duration, bpm=args.bpm, beat0=args.beat0)
+        for window in [(0.0, 45.0), None]:
+            kw = dict(
+                bpm=args.bpm,
+                duration=duration,
+                onset_times_env=times,
+                onset_env=env,
+                search_window=window,
+                steps=args.steps,
+            )
+            t_loop, b_loop = best_time(lambda: legacy_estimate_beat0(**kw), args.repeat)
+            t_vec, b_vec = best_time(lambda: estimate_beat0(**kw), args.repeat)
+            b_ref = estimate_beat0(**kw, refine=2)
+
+            label = "45s" if window else "song"
+            print(f"{duration:>8.0f}s {label:>7} {t_loop * 1e3:>9.2f} {t_vec * 1e3:>11.2f} "
+                  f"{t_loop / t_vec:>7.1f}x {b_loop:>11.4f} {b_vec:>9.4f} {b_ref:>9.5f}")
+            if abs(b_loop - b_vec) > 1e-9:
+                print(f"  !! batched search disagrees with loop ({b_vec} vs {b_loop})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""
+Benchmark every phase of the chart pipeline on synthetic drum tracks.
+
+Fixtures are rendered locally (kick on the bar, snare on 2/4, hats on every
+subdivision, a little noise) and cached as WAV files, so no external audio is
+needed. Each (length, bpm) case runs in a fresh process so its peak RSS is
+its own. Phases:
+
+    load      librosa.load(sr=None, mono=True)
+    onset     librosa.onset.onset_strength (or stream_onset with --stream)
+    bands     onset_bands.onset_envelopes: broadband + low/mid/high from one
+              mel pass, as analyze_audio runs it (stream_onset_multi with --stream)
+    tempo     tempo.estimate_bpm + estimate_tempo_map on the envelope
+    beat0     find_beat0 over the default search window
+    select    stage_candidates + select_stage_events for every stage
+    chart     build_chart (selection + lane assignment)
+    random    generate_chart.build_random_chart (generate_stage_notes per stage)
+
+The summary line after the table gives bands/onset, the cost of the
+multi-band analysis relative to the broadband envelope alone.
+
+Times are the best of --repeat untraced runs; peak_mb is the tracemalloc peak
+of one extra traced run (numpy buffers included). Stage boundaries are scaled
+to the track length so long fixtures exercise every stage.
+
+    python scripts/bench_pipeline.py --minutes 1 5 30 60 --out bench.json
+    python scripts/bench_pipeline.py --minutes 1 5 --out new.json --compare bench.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+from phase_timer import format_rss, peak_rss_mb
+
+PHASES = ["load", "onset", "bands", "tempo", "beat0", "select", "chart", "random"]
+DEFAULT_FIXTURE_DIR = ".bench_fixtures"
+
+
+# -------------------------
+# Synthetic audio
+# -------------------------
+def render_drums(
+    n: int,
+    *,
+    start: int,
+    sr: int,
+    bpm: float,
+    subdiv: int,
+    beat0: float,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    """Samples [start, start + n) of the drum pattern; hits that began before `start` ring on."""
+    spb = 60.0 / bpm
+    step = spb / subdiv
+    t0, t1 = start / sr, (start + n) / sr
+    tail = 0.25  # longest voice decay we render, seconds
+
+    out = 0.02 * rng.standard_normal(n).astype(np.float32)
+    k_first = max(0, int(np.floor((t0 - tail - beat0) / step)))
+    k_last = int(np.ceil((t1 - beat0) / step))
+
+    for k in range(k_first, k_last + 1):
+        onset = beat0 + k * step
+        beat, sub = divmod(k, subdiv)
+        if sub == 0 and beat % 4 == 0:
+            dur, gain, kind = 0.25, 0.9, "kick"
+        elif sub == 0 and beat % 2 == 1:
+            dur, gain, kind = 0.18, 0.6, "snare"
+        else:
+            dur, gain, kind = 0.05, 0.25 if sub else 0.35, "hat"
+
+        i0 = int(round(onset * sr)) - start
+        a, b = max(i0, 0), min(i0 + int(dur * sr), n)
+        if b <= a:
+            continue
+        t = (np.arange(a, b) - i0) / sr
+        env = np.exp(-t / (dur / 5.0))
+        if kind == "kick":
+            wave = np.sin(2 * np.pi * (50.0 * t + 60.0 * (1.0 - np.exp(-t * 30.0)) / 30.0))
+        elif kind == "snare":
+            wave = 0.5 * np.sin(2 * np.pi * 190.0 * t) + rng.standard_normal(b - a)
+        else:
+            wave = np.diff(rng.standard_normal(b - a + 1))  # crude high-passed noise
+        out[a:b] += (gain * env * wave).astype(np.float32)
+    return np.clip(out, -1.0, 1.0)
+
+
+def ensure_fixture(
+    fixture_dir: str,
+    *,
+    minutes: float,
+    bpm: float,
+    subdiv: int,
+    sr: int,
+    beat0: float = 0.1,
+    seed: int = 0,
+) -> str:
+    """Render (or reuse) a WAV drum track, written block by block."""
+    import soundfile as sf
+
+    os.makedirs(fixture_dir, exist_ok=True)
+    name = f"drums_{minutes:g}m_{bpm:g}bpm_{subdiv}x_{sr}hz_s{seed}.wav"
+    path = os.path.join(fixture_dir, name)
+    if os.path.exists(path):
+        return path
+
+    rng = np.random.default_rng(seed)
+    total = int(minutes * 60.0 * sr)
+    block = 30 * sr
+    tmp = path + ".part"
+    with sf.SoundFile(tmp, "w", samplerate=sr, channels=1, subtype="PCM_16", format="WAV") as f:
+        for start in range(0, total, block):
+            n = min(block, total - start)
+            f.write(render_drums(n, start=start, sr=sr, bpm=bpm, subdiv=subdiv, beat0=beat0, rng=rng))
+    os.replace(tmp, path)
+    return path
+
+
+# -------------------------
+# Measurement
+# -------------------------
+def measure(fn: Callable[[], object], repeat: int, trace: bool) -> Tuple[float, float, object]:
+    """Returns (best seconds, tracemalloc peak MB or None, last result)."""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+
+    peak_mb = None
+    if trace:
+        result = None
+        tracemalloc.start()
+        try:
+            result = fn()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+    return best, peak_mb, result
+
+
+def run_case(case: Dict) -> Dict:
+    """Worker: time every phase on one fixture. Runs in its own process."""
+    import librosa
+    from analyze_song import Analysis, ChartConfig, build_chart, find_beat0, select_stage_events, stage_candidates
+    from generate_chart import RandomChartConfig, build_random_chart
+    from onset_bands import mel_band_slices, normalize_bands, onset_envelopes
+    from tempo import estimate_bpm, estimate_tempo_map
+
+    repeat, trace = case["repeat"], case["trace"]
+    phases: Dict[str, Dict] = {}
+
+    def record(name: str, fn: Callable[[], object]) -> object:
+        seconds, peak_mb, result = measure(fn, repeat, trace)
+        phases[name] = dict(seconds=round(seconds, 6), peak_mb=None if peak_mb is None else round(peak_mb, 2))
+        return result
+
+    path = case["audio"]
+    # Warm up lazy imports / codec setup so the first timed phase doesn't pay for them
+    librosa.onset.onset_strength(y=librosa.load(path, sr=None, mono=True, duration=1.0)[0], sr=case["sr"])
+
+    if case["stream"]:
+        from stream_onset import stream_onset_multi, stream_onset_strength
+
+        phases["load"] = dict(seconds=0.0, peak_mb=0.0)  # decoding happens inside the streamed onset pass
+        onset_env, sr, duration = record("onset", lambda: stream_onset_strength(path))
+        channels = [slice(None)] + mel_band_slices(sr)
+        band_env = record("bands", lambda: stream_onset_multi(path, channels=channels))[0][1:]
+    else:
+        y, sr = record("load", lambda: librosa.load(path, sr=None, mono=True))
+        duration = librosa.get_duration(y=y, sr=sr)
+        onset_env = record("onset", lambda: librosa.onset.onset_strength(y=y, sr=sr))
+        band_env = record("bands", lambda: onset_envelopes(y, sr=sr))[1]
+        del y
+
+    onset_env = onset_env / (np.max(onset_env) + 1e-9)
+    analysis = Analysis(
+        onset_env=onset_env,
+        onset_times_env=librosa.times_like(onset_env, sr=sr),
+        duration=duration,
+        sr=sr,
+        band_env=normalize_bands(band_env),
+    )
+
+    def detect_tempo() -> Tuple[float, int]:
+        bpm = estimate_bpm(onset_env, sr=sr)
+        return bpm, len(estimate_tempo_map(onset_env, sr=sr, duration=duration, bpm=bpm).segments)
+
+    detected_bpm, tempo_segments = record("tempo", detect_tempo)
+
+    base = ChartConfig(bpm=case["bpm"])
+    scale = duration / base.boundaries[-1]
+    cfg = replace(base, boundaries=[b * scale for b in base.boundaries])
+
+    beat0 = record("beat0", lambda: find_beat0(
+        analysis, bpm=cfg.bpm, search_window=cfg.beat0_search_window, refine=cfg.beat0_refine,
+    ))
+
+    def select_all() -> int:
+        n = 0
+        for stage_idx in range(1, cfg.n_stages + 1):
+            sc = stage_candidates(analysis, cfg, stage_idx, beat0=beat0)
+            if sc is not None and len(sc.cand):
+                n += len(select_stage_events(sc, cfg).hit)
+        return n
+
+    record("select", select_all)
+    rows, _ = record("chart", lambda: build_chart(analysis, cfg, beat0=beat0))
+
+    rbase = RandomChartConfig(bpm=case["bpm"], duration_seconds=duration)
+    rscale = duration / rbase.boundaries[-1]
+    rcfg = replace(rbase, boundaries=[b * rscale for b in rbase.boundaries])
+    random_rows, _ = record("random", lambda: build_random_chart(rcfg))
+
+    rss = peak_rss_mb()
+    return dict(
+        minutes=case["minutes"],
+        bpm=case["bpm"],
+        subdiv=case["subdiv"],
+        sr=int(sr),
+        stream=case["stream"],
+        duration=round(float(duration), 3),
+        beat0=round(float(beat0), 5),
+        detected_bpm=round(float(detected_bpm), 4),
+        tempo_segments=tempo_segments,
+        notes=len(rows),
+        random_notes=len(random_rows),
+        peak_rss_mb=rss if rss is None else round(rss, 1),
+        phases=phases,
+    )
+
+
+# -------------------------
+# Reporting
+# -------------------------
+def environment() -> Dict:
+    import librosa
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return dict(
+        commit=commit,
+        python=platform.python_version(),
+        numpy=np.__version__,
+        librosa=librosa.__version__,
+        platform=platform.platform(),
+        cpus=os.cpu_count(),
+    )
+
+
+def case_key(r: Dict) -> Tuple:
+    return (r["minutes"], r["bpm"], r["subdiv"], r["sr"], r.get("stream", False))
+
+
+def format_results(results: List[Dict]) -> str:
+    head = f"{'minutes':>7} {'bpm':>5} " + " ".join(f"{p:>9}" for p in PHASES) + f" {'total':>8} {'rss MB':>7} {'notes':>6}"
+    lines = [head]
+    for r in results:
+        secs = [r["phases"][p]["seconds"] for p in PHASES]
+        lines.append(
+            f"{r['minutes']:>7g} {r['bpm']:>5g} " + " ".join(f"{s:>8.3f}s" for s in secs)
+            + f" {sum(secs):>7.2f}s {format_rss(r['peak_rss_mb']):>7} {r['notes']:>6}"
+        )
+        if any(r["phases"][p]["peak_mb"] is not None for p in PHASES):
+            lines.append(" " * 13 + " ".join(
+                f"{r['phases'][p]['peak_mb']:>7.1f}MB" if r["phases"][p]["peak_mb"] is not None else f"{'-':>9}"
+                for p in PHASES
+            ))
+    ratios = [
+        r["phases"]["bands"]["seconds"] / r["phases"]["onset"]["seconds"]
+        for r in results
+        if "bands" in r["phases"] and r["phases"]["onset"]["seconds"] > 0
+    ]
+    if ratios:
+        lines.append(f"\nbands/onset: {min(ratios):.2f}x - {max(ratios):.2f}x (multi-band vs broadband-only analysis)")
+    return "\n".join(lines)
+
+
+def format_comparison(results: List[Dict], baseline: List[Dict], threshold: float) -> Tuple[str, int]:
+    """Per-phase new/old time ratios for cases present in both runs. Returns (table, regressions)."""
+    old = {case_key(r): r for r in baseline}
+    lines = [f"{'minutes':>7} {'bpm':>5} " + " ".join(f"{p:>9}" for p in PHASES)]
+    regressions = 0
+    for r in results:
+        prev = old.get(case_key(r))
+        if prev is None:
+            continue
+        cells = []
+        for p in PHASES:
+            if p not in prev["phases"]:
+                cells.append(f"{'-':>9}")
+                continue
+            a, b = prev["phases"][p]["seconds"], r["phases"][p]["seconds"]
+            ratio = b / a if a > 0 else float("nan")
+            flag = "!" if ratio > threshold and b - a > 0.005 else " "
+            regressions += flag == "!"
+            cells.append(f"{ratio:>7.2f}x{flag}")
+        lines.append(f"{r['minutes']:>7g} {r['bpm']:>5g} " + " ".join(cells))
+    if len(lines) == 1:
+        return "no cases in common with the baseline", 0
+    return "\n".join(lines), regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--minutes", type=float, nargs="+", default=[1.0, 5.0, 30.0, 60.0])
+    ap.add_argument("--bpm", type=float, nargs="+", default=[144.0])
+    ap.add_argument("--subdiv", type=int, default=2, help="hat hits per beat in the fixture")
+    ap.add_argument("--sr", type=int, default=22050, help="fixture sample rate")
+    ap.add_argument("--stream", action="store_true", help="use the bounded-memory onset path (stream_onset.py)")
+    ap.add_argument("--repeat", type=int, default=1, help="timed runs per phase (best is kept)")
+    ap.add_argument("--no-trace", action="store_true", help="skip the extra tracemalloc run per phase")
+    ap.add_argument("--fixture-dir", default=DEFAULT_FIXTURE_DIR)
+    ap.add_argument("--out", help="write results JSON here")
+    ap.add_argument("--compare", help="baseline results JSON to compare against")
+    ap.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio reported as a regression")
+    args = ap.parse_args()
+
+    cases = []
+    for bpm in args.bpm:
+        for minutes in args.minutes:
+            audio = ensure_fixture(args.fixture_dir, minutes=minutes, bpm=bpm, subdiv=args.subdiv, sr=args.sr)
+            cases.append(dict(
+                audio=audio, minutes=minutes, bpm=bpm, subdiv=args.subdiv, sr=args.sr, stream=args.stream,
+                repeat=max(1, args.repeat), trace=not args.no_trace,
+            ))
+
+    # A fresh process per case so ru_maxrss belongs to that case alone
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for case in cases:
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            r = pool.submit(run_case, case).result()
+        results.append(r)
+        total = sum(p["seconds"] for p in r["phases"].values())
+        print(f"{r['minutes']:g} min @ {r['bpm']:g} bpm: {total:.2f}s, peak RSS {format_rss(r['peak_rss_mb'])}MB", flush=True)
+
+    print()
+    print(format_results(results))
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(dict(env=environment(), results=results), f, indent=2)
+        print(f"\nwrote {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        table, regressions = format_comparison(results, baseline["results"], args.threshold)
+        print(f"\nvs {args.compare} (commit {baseline['env'].get('commit')}), new/old time:")
+        print(table)
+        if regressions:
+            print(f"\n{regressions} phase(s) slower than {args.threshold:.2f}x")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
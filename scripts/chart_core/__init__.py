@@ -0,0 +1,29 @@
+"""
+Pieces shared by the chart generators and the cursed_rhythm CLI.
+
+- config:  ChartConfig / RandomChartConfig and their validation (no numpy)
+- window:  stage_window(), the per-stage hit window both generators use
+- notes:   Note (slotted) and NoteArray (numpy columns) -> chart rows
+- validate: ChartRules and the timing checks of validate_chart.py (numpy)
+
+config and window import only the standard library; notes and validate
+(numpy) are loaded on first use, so `from chart_core import ChartConfig`
+stays cheap.
+"""
+from chart_core.config import MAX_LANES, MIN_LANES, ChartConfig, RandomChartConfig, check_lane_count
+from chart_core.window import StageWindow, stage_window
+
+_LAZY = {"Note": "chart_core.notes", "NoteArray": "chart_core.notes", "note_row": "chart_core.notes"}
+
+__all__ = [
+    "MAX_LANES", "MIN_LANES", "ChartConfig", "RandomChartConfig", "check_lane_count",
+    "StageWindow", "stage_window", *_LAZY,
+]
+
+
+def __getattr__(name: str):
+    if name in _LAZY:
+        import importlib
+
+        return getattr(importlib.import_module(_LAZY[name]), name)
+    raise AttributeError(f"module 'chart_core' has no attribute {name!r}")
@@ -0,0 +1,166 @@
+"""
+Chart configuration shared by the generators: ChartConfig for beat-locked
+charts from audio (analyze_song.py), RandomChartConfig for random fixed-BPM
+charts (generate_chart.py). Plain dataclasses with no numpy, so a params file
+can be validated without loading the analysis stack:
+
+    python scripts/cursed_rhythm.py check-params params.json
+"""
+from dataclasses import dataclass, field, fields
+from typing import Dict, List, Optional, Tuple, Union
+
+MIN_LANES = 4
+MAX_LANES = 7
+
+
+def check_lane_count(n_lanes: int) -> None:
+    if not (isinstance(n_lanes, int) and MIN_LANES <= n_lanes <= MAX_LANES):
+        raise ValueError(f"lanes must be an integer in [{MIN_LANES}, {MAX_LANES}], got {n_lanes!r}")
+
+
+@dataclass
+class ChartConfig:
+    bpm: Union[float, str] = 144.0  # 144 - the drunk & 75 - mikito; "auto" estimates it from the onsets
+    bpm_range: Tuple[float, float] = (60.0, 200.0)  # "auto" search range; narrow it to pick the octave
+    tempo_map: bool = False  # follow tempo changes with a piecewise grid instead of one fixed BPM
+    tempo_warp: bool = False  # track the beat phase over the whole song and warp every grid onto it
+    seed: int = 42
+    lanes: int = 4  # 4-7 lane layouts (the game board draws 4)
+
+    # Match Phaser
+    popup_seconds: float = 1.4
+    miss_px: float = 60.0
+    spawn_y: float = -60.0
+    hit_y: float = 600.0
+
+    # Your stage boundaries (keep as-is)
+    boundaries: List[float] = field(default_factory=lambda: [0.0, 15.0, 30.0, 75.0, 110.0, 160.0, 230.0])
+
+    # Must match in-game stage speeds
+    stage_speeds: List[float] = field(default_factory=lambda: [320.0, 360.0, 400.0, 440.0, 480.0, 520.0])
+
+    # Difficulty ramp (tweak here)
+    stage_subdiv: List[int] = field(default_factory=lambda: [1, 2, 2, 2, 4, 4])
+    stage_keep: List[float] = field(default_factory=lambda: [0.40, 0.50, 0.60, 0.65, 0.70, 0.85])  # stage 6 harder
+    stage_min_gap: List[float] = field(default_factory=lambda: [0.35, 0.33, 0.30, 0.28, 0.24, 0.21])  # stage 6 denser
+    stage_jumpiness: List[float] = field(default_factory=lambda: [0.15, 0.20, 0.22, 0.22, 0.26, 0.45])  # stage 6 more lane movement
+
+    # Holds from clusters (NOT random)
+    hold_min_s: float = 0.40
+    stage_cluster_gap: List[float] = field(default_factory=lambda: [0.42, 0.38, 0.32, 0.28, 0.26, 0.22])  # slightly fewer holds late
+
+    # NEW: max-gap enforcement per stage (fix gaps in 3 & 4 too)
+    # max allowed silence between notes in that stage
+    stage_max_gap: List[float] = field(default_factory=lambda: [1.00, 1.00, 1.00, 1.00, 1.00, 0.85])  # stage 6 constant pressure
+    # how many fillers can be inserted inside an oversized gap
+    stage_fill_rate: List[int] = field(default_factory=lambda: [1, 1, 3, 1, 2, 2])
+
+    # Make stage 6 more tap-heavy by preventing too many clusters from collapsing into holds:
+    # If you want *more* holds in stage 6, raise this.
+    stage6_holds_enabled: bool = False
+
+    global_offset: float = 0.00
+
+    # Multi-band onsets (scripts/onset_bands.py): band_weight blends the strongest
+    # low/mid/high band into the candidate scores, so hats and snares that the
+    # broadband envelope underweights can still become notes; band_lanes biases
+    # lanes by the band that fired (low -> left, high -> right). 0 = broadband only.
+    band_weight: float = 0.0
+    band_lanes: float = 0.0
+
+    # Candidates score the onset envelope max-filtered over +-score_window_s
+    # (scripts/onset_peaks.py), so a transient a few ms off the grid still
+    # counts; 0 samples the envelope exactly at each grid time.
+    score_window_s: float = 0.0
+
+    # beat0 phase search: None searches the whole song; each refine pass
+    # narrows the offset resolution by another factor of 8
+    beat0_search_window: Optional[Tuple[float, float]] = (0.0, 45.0)
+    beat0_refine: int = 0
+
+    @property
+    def n_stages(self) -> int:
+        return len(self.boundaries) - 1
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "ChartConfig":
+        """Build a config from JSON-style overrides; unknown keys are an error."""
+        known = {f.name for f in fields(cls)}
+        unknown = sorted(set(d) - known)
+        if unknown:
+            raise ValueError(f"Unknown chart config keys: {', '.join(unknown)}")
+        cfg = cls(**d)
+        if cfg.beat0_search_window is not None:
+            cfg.beat0_search_window = tuple(cfg.beat0_search_window)
+        cfg.bpm_range = tuple(cfg.bpm_range)
+        cfg.validate()
+        return cfg
+
+    def validate(self) -> None:
+        if self.bpm != "auto" and not (isinstance(self.bpm, (int, float)) and self.bpm > 0):
+            raise ValueError(f"bpm must be a positive number or \"auto\", got {self.bpm!r}")
+        check_lane_count(self.lanes)
+        for name in ("band_weight", "band_lanes"):
+            if not 0.0 <= getattr(self, name) <= 1.0:
+                raise ValueError(f"{name} must be in [0, 1], got {getattr(self, name)!r}")
+        if not 0.0 <= self.score_window_s <= 0.25:
+            raise ValueError(f"score_window_s must be in [0, 0.25], got {self.score_window_s!r}")
+        for name in (
+            "stage_speeds", "stage_subdiv", "stage_keep", "stage_min_gap", "stage_jumpiness",
+            "stage_cluster_gap", "stage_max_gap", "stage_fill_rate",
+        ):
+            if len(getattr(self, name)) != self.n_stages:
+                raise ValueError(
+                    f"{name} has {len(getattr(self, name))} entries but boundaries define {self.n_stages} stages"
+                )
+
+
+@dataclass
+class RandomChartConfig:
+    seed: int = 42
+    lanes: int = 4  # 4-7 lane layouts (the game board draws 4)
+
+    # --- Song constants ---
+    bpm: float = 75.0
+    duration_seconds: float = 231.0
+    offset: float = 0.20
+
+    # --- Match Phaser geometry ---
+    spawn_y: float = -60.0
+    hit_y: float = 600.0   # IMPORTANT: set this to your Phaser hitY for perfect visual sync
+
+    # --- Popup timing (must match your showStagePopup total on-screen time) ---
+    popup_seconds: float = 1.4
+
+    # --- Miss window in pixels in your Phaser code ---
+    miss_px: float = 60.0
+
+    # Raw conceptual stage boundaries (where popup triggers)
+    boundaries: List[float] = field(default_factory=lambda: [0.0, 35.0, 70.0, 105.0, 145.0, 190.0, 231.0])  # 6 stages
+
+    # Difficulty ramp per stage
+    params: List[Dict] = field(default_factory=lambda: [
+        dict(grid_beats=1.0,  density=0.70, max_gap_beats=2.0,  speed=320.0, jumpiness=0.05),
+        dict(grid_beats=0.5,  density=0.45, max_gap_beats=2.0,  speed=360.0, jumpiness=0.10),
+        dict(grid_beats=0.5,  density=0.55, max_gap_beats=1.5,  speed=400.0, jumpiness=0.18),
+        dict(grid_beats=0.5,  density=0.65, max_gap_beats=1.0,  speed=440.0, jumpiness=0.25),
+        dict(grid_beats=0.25, density=0.38, max_gap_beats=1.0,  speed=480.0, jumpiness=0.35),
+        dict(grid_beats=0.25, density=0.48, max_gap_beats=0.75, speed=520.0, jumpiness=0.45),
+    ])
+
+    @property
+    def n_stages(self) -> int:
+        return len(self.boundaries) - 1
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "RandomChartConfig":
+        """Build a config from JSON-style overrides; unknown keys are an error."""
+        known = {f.name for f in fields(cls)}
+        unknown = sorted(set(d) - known)
+        if unknown:
+            raise ValueError(f"Unknown chart config keys: {', '.join(unknown)}")
+        cfg = cls(**d)
+        if len(cfg.params) != cfg.n_stages:
+            raise ValueError(f"params has {len(cfg.params)} entries but boundaries define {cfg.n_stages} stages")
+        check_lane_count(cfg.lanes)
+        return cfg
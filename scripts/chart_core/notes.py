@@ -0,0 +1,117 @@
+"""
+Note records and the chart row format.
+
+Note is a slotted dataclass for code that builds notes one at a time
+(generate_chart.py). NoteArray holds a whole stage or chart as parallel numpy
+columns, so the vectorized generator never materializes per-note objects
+until rows are written. Both produce the same rows:
+
+    {"spawn", "hit", "end", "lane", "stage", "speed", "type"}
+
+with times rounded to 4 decimals and speed to 2.
+"""
+from dataclasses import dataclass
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+from chart_format import TYPES
+
+
+@dataclass(slots=True)
+class Note:
+    spawn: float
+    hit: float
+    end: float          # end hit time (== hit for taps)
+    lane: int
+    stage: int
+    speed: float
+    type: str           # "tap" or "hold"
+
+
+def note_row(n: Note) -> Dict:
+    return {
+        "spawn": round(n.spawn, 4),
+        "hit": round(n.hit, 4),
+        "end": round(n.end, 4),
+        "lane": n.lane,
+        "stage": n.stage,
+        "speed": round(n.speed, 2),
+        "type": n.type,
+    }
+
+
+@dataclass
+class NoteArray:
+    spawn: np.ndarray
+    hit: np.ndarray
+    end: np.ndarray
+    lane: np.ndarray
+    stage: np.ndarray
+    speed: np.ndarray
+    hold: np.ndarray     # bool: hold (True) or tap
+
+    def __len__(self) -> int:
+        return len(self.hit)
+
+    @classmethod
+    def from_notes(cls, notes: Iterable[Note]) -> "NoteArray":
+        notes = list(notes)
+        return cls(
+            spawn=np.array([n.spawn for n in notes], dtype=np.float64),
+            hit=np.array([n.hit for n in notes], dtype=np.float64),
+            end=np.array([n.end for n in notes], dtype=np.float64),
+            lane=np.array([n.lane for n in notes], dtype=np.int64),
+            stage=np.array([n.stage for n in notes], dtype=np.int64),
+            speed=np.array([n.speed for n in notes], dtype=np.float64),
+            hold=np.array([n.type == "hold" for n in notes], dtype=bool),
+        )
+
+    @classmethod
+    def from_rows(cls, rows: List[Dict]) -> "NoteArray":
+        """Columns of chart rows (as read back by chart_format.read_chart)."""
+        return cls(
+            spawn=np.array([r["spawn"] for r in rows], dtype=np.float64),
+            hit=np.array([r["hit"] for r in rows], dtype=np.float64),
+            end=np.array([r["end"] for r in rows], dtype=np.float64),
+            lane=np.array([r["lane"] for r in rows], dtype=np.int64),
+            stage=np.array([r["stage"] for r in rows], dtype=np.int64),
+            speed=np.array([r["speed"] for r in rows], dtype=np.float64),
+            hold=np.array([r["type"] == "hold" for r in rows], dtype=bool),
+        )
+
+    @classmethod
+    def concat(cls, parts: List["NoteArray"]) -> "NoteArray":
+        return cls(**{
+            name: np.concatenate([getattr(p, name) for p in parts])
+            for name in ("spawn", "hit", "end", "lane", "stage", "speed", "hold")
+        })
+
+    def take(self, index: np.ndarray) -> "NoteArray":
+        """Subset (boolean mask) or reorder (indices) every column."""
+        return NoteArray(**{
+            name: getattr(self, name)[index]
+            for name in ("spawn", "hit", "end", "lane", "stage", "speed", "hold")
+        })
+
+    def sorted_by_spawn(self) -> "NoteArray":
+        """Stable: notes with equal spawn keep their order."""
+        return self.take(np.argsort(self.spawn, kind="stable"))
+
+    def to_rows(self) -> List[Dict]:
+        # Python round() on floats, so rows match note_row() exactly
+        return [
+            {
+                "spawn": round(spawn, 4),
+                "hit": round(hit, 4),
+                "end": round(end, 4),
+                "lane": lane,
+                "stage": stage,
+                "speed": round(speed, 2),
+                "type": TYPES[hold],
+            }
+            for spawn, hit, end, lane, stage, speed, hold in zip(
+                self.spawn.tolist(), self.hit.tolist(), self.end.tolist(), self.lane.tolist(),
+                self.stage.tolist(), self.speed.tolist(), self.hold.tolist(),
+            )
+        ]
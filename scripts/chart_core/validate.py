@@ -0,0 +1,187 @@
+"""
+Timing invariants of a finished chart (the checks behind validate_chart.py).
+
+ChartRules carries the boundaries and geometry a chart was built with;
+validate_notes runs every check in CHECKS over a NoteArray and returns a
+ValidationReport of offending note indices. validate_file reads a chart back
+in any format first, the post-write gate of every generator.
+"""
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from chart_core.notes import NoteArray
+from chart_format import read_chart
+
+TOL = 2e-4  # row times are rounded to 4 decimals (binary charts store float32)
+CHECKS = ["order", "times", "lanes", "popup", "stage", "nps"]
+
+
+@dataclass
+class ChartRules:
+    boundaries: List[float]
+    popup_seconds: float = 1.4
+    miss_px: float = 60.0
+    lanes: int = 4
+    max_nps: Optional[float] = None  # None: only report the peak
+    nps_window: float = 1.0
+
+    @classmethod
+    def from_config(cls, cfg, **kw) -> "ChartRules":
+        """Rules for charts built from a ChartConfig or RandomChartConfig."""
+        return cls(
+            boundaries=list(cfg.boundaries),
+            popup_seconds=cfg.popup_seconds,
+            miss_px=cfg.miss_px,
+            lanes=cfg.lanes,
+            **kw,
+        )
+
+
+@dataclass
+class ValidationReport:
+    notes: int
+    violations: Dict[str, np.ndarray] = field(default_factory=dict)  # check -> note indices (file order)
+    peak_nps: float = 0.0
+    peak_time: float = 0.0
+    seconds: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return not any(len(v) for v in self.violations.values())
+
+    def to_dict(self, examples: int = 20) -> Dict:
+        return dict(
+            ok=self.ok,
+            notes=self.notes,
+            peak_nps=round(self.peak_nps, 3),
+            peak_time=round(self.peak_time, 4),
+            seconds=round(self.seconds, 4),
+            violations={
+                name: dict(count=len(idx), first=idx[:examples].tolist())
+                for name, idx in self.violations.items()
+            },
+        )
+
+    def format(self, notes: Optional[NoteArray] = None, examples: int = 5) -> str:
+        head = (
+            f"{'ok' if self.ok else 'FAILED'}: {self.notes} notes, peak {self.peak_nps:.1f} nps "
+            f"at {self.peak_time:.2f}s ({self.seconds * 1e3:.0f} ms)"
+        )
+        lines = [head]
+        for name, idx in self.violations.items():
+            if not len(idx):
+                continue
+            lines.append(f"  {name}: {len(idx)} note(s)")
+            for i in idx[:examples].tolist():
+                if notes is None:
+                    lines.append(f"    #{i}")
+                else:
+                    lines.append(
+                        f"    #{i}: spawn={notes.spawn[i]:.4f} hit={notes.hit[i]:.4f} end={notes.end[i]:.4f} "
+                        f"lane={notes.lane[i]} stage={notes.stage[i]}"
+                    )
+        return "\n".join(lines)
+
+
+# -------------------------
+# Checks (each returns offending note indices)
+# -------------------------
+def check_order(notes: NoteArray) -> np.ndarray:
+    return np.flatnonzero(np.diff(notes.spawn) < 0.0) + 1
+
+
+def check_times(notes: NoteArray) -> np.ndarray:
+    bad = (
+        (notes.spawn < -TOL)
+        | (notes.hit < notes.spawn - TOL)
+        | (notes.end < notes.hit - TOL)
+        | (~notes.hold & (np.abs(notes.end - notes.hit) > TOL))
+        | ~(notes.speed > 0.0)
+    )
+    return np.flatnonzero(bad)
+
+
+def check_lanes(notes: NoteArray, n_lanes: int) -> np.ndarray:
+    bad = (notes.lane < 0) | (notes.lane >= n_lanes)
+    order = np.lexsort((notes.hit, notes.lane))
+    lane, hit = notes.lane[order], notes.hit[order]
+    end = np.maximum(notes.end[order], hit)
+    # running max of note ends within each lane: offset lanes apart so the scan never crosses one
+    span = float(end.max() - min(hit.min(), 0.0)) + 1.0 if len(hit) else 1.0
+    shift = (lane - lane.min() if len(lane) else lane) * span
+    reach = np.maximum.accumulate(end + shift) - shift
+    same = np.zeros(len(order), dtype=bool)
+    same[1:] = lane[1:] == lane[:-1]
+    prev_hit = np.concatenate([[-np.inf], hit[:-1]])
+    prev_reach = np.concatenate([[-np.inf], reach[:-1]])
+    clash = same & ((hit - prev_hit <= TOL) | (hit < prev_reach - TOL))
+    bad[order[clash]] = True
+    return np.flatnonzero(bad)
+
+
+def check_popups(notes: NoteArray, rules: ChartRules) -> np.ndarray:
+    # the stage 1 popup at 0 s is part of the intro: notes may spawn under it
+    start = np.asarray(rules.boundaries[1:-1], dtype=np.float64)
+    if not len(start) or not len(notes):
+        return np.zeros(0, dtype=np.int64)
+    stop = start + rules.popup_seconds
+    with np.errstate(divide="ignore", invalid="ignore"):
+        visible_until = np.maximum(notes.end, notes.hit) + rules.miss_px / notes.speed
+    # first popup still showing after the note spawns; later ones start even later
+    k = np.searchsorted(stop, notes.spawn + TOL, side="right")
+    hit_popup = k < len(start)
+    hit_popup[hit_popup] = start[k[hit_popup]] < visible_until[hit_popup] - TOL
+    return np.flatnonzero(hit_popup)
+
+
+def check_stages(notes: NoteArray, boundaries: List[float]) -> np.ndarray:
+    b = np.asarray(boundaries, dtype=np.float64)
+    n_stages = len(b) - 1
+    valid = (notes.stage >= 1) & (notes.stage <= n_stages)
+    s = np.clip(notes.stage, 1, n_stages)
+    inside = (notes.hit >= b[s - 1] - TOL) & (notes.hit <= b[s] + TOL)
+    return np.flatnonzero(~(valid & inside))
+
+
+def rolling_nps(hit: np.ndarray, window: float):
+    """(sorted hits, notes in [hit, hit + window) starting at each)."""
+    h = np.sort(hit)
+    return h, np.searchsorted(h, h + window, side="left") - np.arange(len(h))
+
+
+# -------------------------
+# Entry points
+# -------------------------
+def validate_notes(notes: NoteArray, rules: ChartRules) -> ValidationReport:
+    t0 = time.perf_counter()
+    report = ValidationReport(notes=len(notes))
+    report.violations["order"] = check_order(notes)
+    report.violations["times"] = check_times(notes)
+    report.violations["lanes"] = check_lanes(notes, rules.lanes)
+    report.violations["popup"] = check_popups(notes, rules)
+    report.violations["stage"] = check_stages(notes, rules.boundaries)
+
+    report.violations["nps"] = np.zeros(0, dtype=np.int64)
+    if len(notes):
+        h, counts = rolling_nps(notes.hit, rules.nps_window)
+        peak = int(np.argmax(counts))
+        report.peak_nps = counts[peak] / rules.nps_window
+        report.peak_time = float(h[peak])
+        if rules.max_nps is not None:
+            # report the first note of every over-dense window
+            order = np.argsort(notes.hit, kind="stable")
+            report.violations["nps"] = np.sort(order[counts > rules.max_nps * rules.nps_window])
+    report.seconds = time.perf_counter() - t0
+    return report
+
+
+def validate_rows(rows: List[Dict], rules: ChartRules) -> ValidationReport:
+    return validate_notes(NoteArray.from_rows(rows), rules)
+
+
+def validate_file(path: str, rules: ChartRules) -> ValidationReport:
+    """Post-write gate: read the chart back (any format) and validate it."""
+    return validate_rows(read_chart(path), rules)
@@ -0,0 +1,60 @@
+"""
+Per-stage hit windows: the span of hit times a stage may use so that no note
+is on screen while a stage popup shows.
+
+- stage 1 starts at its boundary; later stages start late enough that their
+  first note spawns after the popup at the boundary has ended
+- every stage ends early enough that a missed note clears the hit line
+  (miss_px past it) before the popup at the next boundary
+- end_guard additionally keeps non-final stages that far before their end
+  boundary (generate_chart.py uses 0.01 s as a safety margin)
+"""
+from dataclasses import dataclass
+from typing import Sequence
+
+
+@dataclass(frozen=True)
+class StageWindow:
+    stage: int
+    hit_start: float
+    hit_end: float
+    speed: float
+    travel: float    # spawn -> hit line
+    clear: float     # hit line -> miss_px past it
+
+    @property
+    def playable(self) -> bool:
+        return self.hit_end > self.hit_start
+
+
+def stage_window(
+    boundaries: Sequence[float],
+    stage_idx: int,
+    *,
+    speed: float,
+    spawn_y: float,
+    hit_y: float,
+    popup_seconds: float,
+    miss_px: float,
+    duration: float,
+    end_guard: float = 0.0,
+) -> StageWindow:
+    """Hit window of stage `stage_idx` (1-based) between boundaries[stage_idx - 1] and boundaries[stage_idx]."""
+    start_boundary = boundaries[stage_idx - 1]
+    end_boundary = boundaries[stage_idx]
+    travel = (hit_y - spawn_y) / speed
+    clear = miss_px / speed
+
+    hit_start = start_boundary if stage_idx == 1 else start_boundary + popup_seconds + travel
+    hit_end = end_boundary - clear
+    if end_guard and stage_idx < len(boundaries) - 1:
+        hit_end = min(hit_end, end_boundary - end_guard)
+
+    return StageWindow(
+        stage=stage_idx,
+        hit_start=max(0.0, hit_start),
+        hit_end=min(duration, hit_end),
+        speed=speed,
+        travel=travel,
+        clear=clear,
+    )
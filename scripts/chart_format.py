@@ -0,0 +1,324 @@
+"""
+Chart writers/readers: the classic row JSON plus two struct-of-arrays formats.
+
+- "json":     [{"spawn", "hit", "end", "lane", "stage", "speed", "type"}, ...] (indent=2)
+- "columnar": minified {"format": "cursed-rhythm/columnar", "spawn": [...], ...}
+              with speed stored once per stage and type as 0=tap / 1=hold
+- "binary":   little-endian, 4-byte aligned:
+                  "CRCH" | u16 version | u16 n_speeds | u32 count
+                  f32 stage_speed[n_speeds]          (indexed by stage number)
+                  f32 spawn[count] | f32 hit[count] | f32 end[count]
+                  u8 lane[count] | u8 stage[count] | u8 type[count]
+              float32 keeps 4-decimal times exact up to ~1000 s. A chart with
+              any time float32 can't round-trip is written as version 2:
+              zero padding to an 8-byte boundary, then f64 spawn/hit/end.
+
+Each file can get .gz / .br (if the brotli package is installed) sidecars,
+and every written chart gets a seek index next to it (chart.json ->
+chart.json.seek; not *.json, so chart globs don't pick it up):
+
+    {"format": "cursed-rhythm/seek", "version": 1, "count": n, "bucket": 1.0,
+     "buckets": [first note index with spawn >= k * bucket, for k = 0, 1, ...],
+     "stages": {"1": {"first": i, "spawn": t, "hit": t}, ...}}
+
+so the game can start at any time or stage with one lookup instead of
+scanning from the first note (charts are sorted by spawn).
+src/chartFormat.js reads all three formats and the index in the game. Only
+the standard library is used, so conversion stays fast to start.
+
+    python scripts/chart_format.py convert chart.json chart.bin --format binary --compress
+    python scripts/chart_format.py check public/charts/*.json
+    python scripts/chart_format.py index public/charts/chart.json   # seek index for an existing chart
+"""
+import argparse
+import bisect
+import gzip
+import json
+import os
+import struct
+import sys
+from array import array
+from typing import Dict, List, Tuple
+
+try:
+    import brotli
+except ImportError:  # optional: only needed for .br sidecars
+    brotli = None
+
+COLUMNAR_FORMAT = "cursed-rhythm/columnar"
+BINARY_MAGIC = b"CRCH"
+BINARY_VERSION = 1      # float32 times
+BINARY_VERSION_F64 = 2  # float64 times, for charts float32 can't hold exactly
+TYPES = ["tap", "hold"]
+FORMATS = ["json", "columnar", "binary"]
+FORMAT_EXT = {"json": ".json", "columnar": ".json", "binary": ".bin"}
+SEEK_FORMAT = "cursed-rhythm/seek"
+SEEK_BUCKET_S = 1.0
+
+_HEADER = struct.Struct("<4sHHI")
+
+
+def _stage_speeds(rows: List[Dict]) -> Dict[int, float]:
+    speeds: Dict[int, float] = {}
+    for r in rows:
+        prev = speeds.setdefault(r["stage"], r["speed"])
+        if prev != r["speed"]:
+            raise ValueError(f"stage {r['stage']} mixes speeds {prev} and {r['speed']}; columnar charts store one per stage")
+    return speeds
+
+
+def to_columnar(rows: List[Dict]) -> Dict:
+    speeds = _stage_speeds(rows)
+    return {
+        "format": COLUMNAR_FORMAT,
+        "version": 1,
+        "count": len(rows),
+        "stage_speed": {str(s): v for s, v in sorted(speeds.items())},
+        "spawn": [r["spawn"] for r in rows],
+        "hit": [r["hit"] for r in rows],
+        "end": [r["end"] for r in rows],
+        "lane": [r["lane"] for r in rows],
+        "stage": [r["stage"] for r in rows],
+        "type": [TYPES.index(r["type"]) for r in rows],
+    }
+
+
+def from_columnar(data: Dict) -> List[Dict]:
+    speeds = {int(s): v for s, v in data["stage_speed"].items()}
+    return [
+        {
+            "spawn": spawn,
+            "hit": hit,
+            "end": end,
+            "lane": lane,
+            "stage": stage,
+            "speed": speeds[stage],
+            "type": TYPES[t],
+        }
+        for spawn, hit, end, lane, stage, t in zip(
+            data["spawn"], data["hit"], data["end"], data["lane"], data["stage"], data["type"]
+        )
+    ]
+
+
+def to_binary(rows: List[Dict]) -> bytes:
+    speeds = _stage_speeds(rows)
+    n_speeds = max(speeds, default=-1) + 1
+    if n_speeds > 255 or any(not 0 <= r["lane"] <= 255 for r in rows):
+        raise ValueError("binary charts store lane/stage as uint8")
+
+    stage_speed = array("f", [speeds.get(s, 0.0) for s in range(n_speeds)])
+    times = [array("f", [r[k] for r in rows]) for k in ("spawn", "hit", "end")]
+    # from_binary rounds float32 times to 4 decimals; past ~1000 s that no longer gives the input back
+    exact = all(
+        round(x, 4) == r[k] for col, k in zip(times, ("spawn", "hit", "end")) for x, r in zip(col, rows)
+    )
+    version, pad = BINARY_VERSION, b""
+    if not exact:
+        version = BINARY_VERSION_F64
+        times = [array("d", [r[k] for r in rows]) for k in ("spawn", "hit", "end")]
+        pad = bytes(-(_HEADER.size + stage_speed.itemsize * n_speeds) % 8)
+    cols = times + [
+        array("B", [r["lane"] for r in rows]),
+        array("B", [r["stage"] for r in rows]),
+        array("B", [TYPES.index(r["type"]) for r in rows]),
+    ]
+    if sys.byteorder != "little":
+        for a in [stage_speed] + cols:
+            a.byteswap()
+    header = _HEADER.pack(BINARY_MAGIC, version, n_speeds, len(rows))
+    return header + stage_speed.tobytes() + pad + b"".join(a.tobytes() for a in cols)
+
+
+def from_binary(buf: bytes) -> List[Dict]:
+    magic, version, n_speeds, count = _HEADER.unpack_from(buf, 0)
+    if magic != BINARY_MAGIC or version not in (BINARY_VERSION, BINARY_VERSION_F64):
+        raise ValueError("not a cursed-rhythm binary chart (v1/v2)")
+
+    off = _HEADER.size
+
+    def take(code: str, n: int) -> array:
+        nonlocal off
+        a = array(code)
+        a.frombytes(buf[off:off + n * a.itemsize])
+        if sys.byteorder != "little":
+            a.byteswap()
+        off += n * a.itemsize
+        return a
+
+    stage_speed = take("f", n_speeds)
+    f64 = version == BINARY_VERSION_F64
+    if f64:
+        off += -off % 8
+    spawn, hit, end = (take("d" if f64 else "f", count) for _ in range(3))
+
+    def fix(t: float) -> float:
+        return t if f64 else round(t, 4)
+
+    lane, stage, kind = take("B", count), take("B", count), take("B", count)
+    return [
+        {
+            "spawn": fix(spawn[i]),
+            "hit": fix(hit[i]),
+            "end": fix(end[i]),
+            "lane": lane[i],
+            "stage": stage[i],
+            "speed": round(stage_speed[stage[i]], 2),
+            "type": TYPES[kind[i]],
+        }
+        for i in range(count)
+    ]
+
+
+def encode_chart(rows: List[Dict], fmt: str = "json") -> bytes:
+    if fmt == "json":
+        return json.dumps(rows, indent=2).encode()
+    if fmt == "columnar":
+        return json.dumps(to_columnar(rows), separators=(",", ":")).encode()
+    if fmt == "binary":
+        return to_binary(rows)
+    raise ValueError(f"unknown chart format {fmt!r} (expected one of {FORMATS})")
+
+
+def decode_chart(buf: bytes) -> Tuple[List[Dict], str]:
+    """Returns (rows, detected format). Raises ValueError for anything that isn't a chart."""
+    if buf[:4] == BINARY_MAGIC:
+        return from_binary(buf), "binary"
+    data = json.loads(buf)
+    if isinstance(data, list):
+        return data, "json"
+    fmt = data.get("format") if isinstance(data, dict) else None
+    if fmt == COLUMNAR_FORMAT:
+        return from_columnar(data), "columnar"
+    if fmt == SEEK_FORMAT:
+        raise ValueError("this is a seek index, not a chart")
+    raise ValueError(f"not a chart (format {fmt!r})")
+
+
+def seek_index_path(chart_path: str) -> str:
+    """chart.json / chart.bin (/ .gz / .br) -> chart.json.seek / chart.bin.seek"""
+    base = chart_path[:-3] if chart_path.endswith((".gz", ".br")) else chart_path
+    return base + ".seek"
+
+
+def build_seek_index(rows: List[Dict], bucket_s: float = SEEK_BUCKET_S) -> Dict:
+    """Time buckets -> first note index, and each stage's first note, for a spawn-sorted chart."""
+    spawn = [r["spawn"] for r in rows]
+    for i in range(1, len(spawn)):
+        if spawn[i] < spawn[i - 1]:
+            raise ValueError(f"seek index needs a spawn-sorted chart (note {i} spawns before note {i - 1})")
+    n_buckets = int(spawn[-1] // bucket_s) + 2 if spawn else 1
+    stages: Dict[str, Dict] = {}
+    for i, r in enumerate(rows):
+        stages.setdefault(str(r["stage"]), dict(first=i, spawn=r["spawn"], hit=r["hit"]))
+    return {
+        "format": SEEK_FORMAT,
+        "version": 1,
+        "count": len(rows),
+        "bucket": bucket_s,
+        "buckets": [bisect.bisect_left(spawn, k * bucket_s) for k in range(n_buckets)],
+        "stages": stages,
+    }
+
+
+def write_chart(
+    rows: List[Dict], path: str, fmt: str = "json", compress: bool = False, seek_index: bool = True
+) -> List[str]:
+    """Write the chart (plus .gz/.br sidecars if compress, and its seek index). Returns the paths written."""
+    blob = encode_chart(rows, fmt)
+    with open(path, "wb") as f:
+        f.write(blob)
+    written = [path]
+    if compress:
+        with open(path + ".gz", "wb") as f:
+            f.write(gzip.compress(blob, compresslevel=9, mtime=0))
+        written.append(path + ".gz")
+        if brotli is not None:
+            with open(path + ".br", "wb") as f:
+                f.write(brotli.compress(blob, quality=11))
+            written.append(path + ".br")
+    if seek_index:
+        index_path = seek_index_path(path)
+        with open(index_path, "w") as f:
+            json.dump(build_seek_index(rows), f, separators=(",", ":"))
+        written.append(index_path)
+    return written
+
+
+def read_chart(path: str) -> List[Dict]:
+    with open(path, "rb") as f:
+        blob = f.read()
+    if path.endswith(".gz"):
+        blob = gzip.decompress(blob)
+    elif path.endswith(".br"):
+        if brotli is None:
+            raise RuntimeError("reading .br charts needs the brotli package")
+        blob = brotli.decompress(blob)
+    return decode_chart(blob)[0]
+
+
+def check_round_trip(rows: List[Dict]) -> Dict[str, int]:
+    """Encode + decode every format; raises AssertionError on any mismatch. Returns sizes."""
+    sizes = {}
+    for fmt in FORMATS:
+        blob = encode_chart(rows, fmt)
+        back, detected = decode_chart(blob)
+        assert detected == fmt, f"{fmt} decoded as {detected}"
+        for i, (a, b) in enumerate(zip(rows, back)):
+            assert a == b, f"{fmt}: note {i} differs: {a} != {b}"
+        assert len(back) == len(rows), f"{fmt}: {len(back)} notes != {len(rows)}"
+        sizes[fmt] = len(blob)
+        sizes[fmt + ".gz"] = len(gzip.compress(blob, compresslevel=9, mtime=0))
+        if brotli is not None:
+            sizes[fmt + ".br"] = len(brotli.compress(blob, quality=11))
+    return sizes
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    conv = sub.add_parser("convert", help="re-encode a chart in another format")
+    conv.add_argument("src")
+    conv.add_argument("dst")
+    conv.add_argument("--format", choices=FORMATS, default="binary")
+    conv.add_argument("--compress", action="store_true", help="also write .gz/.br sidecars")
+
+    chk = sub.add_parser("check", help="round-trip charts through every format and compare")
+    chk.add_argument("charts", nargs="+")
+
+    idx = sub.add_parser("index", help="(re)write the seek index next to existing charts")
+    idx.add_argument("charts", nargs="+")
+    idx.add_argument("--bucket", type=float, default=SEEK_BUCKET_S, help="bucket width in seconds")
+
+    args = ap.parse_args()
+
+    if args.cmd == "convert":
+        rows = read_chart(args.src)
+        for p in write_chart(rows, args.dst, args.format, compress=args.compress):
+            print(f"wrote {p} ({os.path.getsize(p)} bytes)")
+        return
+
+    if args.cmd == "index":
+        for path in args.charts:
+            index = build_seek_index(read_chart(path), bucket_s=args.bucket)
+            with open(seek_index_path(path), "w") as f:
+                json.dump(index, f, separators=(",", ":"))
+            print(f"wrote {seek_index_path(path)} ({len(index['buckets'])} buckets, {len(index['stages'])} stages)")
+        return
+
+    failed = False
+    for path in args.charts:
+        try:
+            sizes = check_round_trip(read_chart(path))
+        except Exception as e:  # any decode/encode error fails this file, not the whole check
+            print(f"{path}: FAILED {type(e).__name__}: {e}")
+            failed = True
+            continue
+        print(f"{path}: ok  " + "  ".join(f"{k}={v}" for k, v in sizes.items()))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""
+Objective difficulty metrics for finished charts, per stage and overall.
+
+    notes, holds     counts
+    nps_mean         notes per second over the span (first hit .. last end)
+    nps_peak         most notes in any rolling --nps-window (by hit), per second
+    lane_switch      mean lanes moved between consecutive hit times
+    jacks            notes in the same lane as that lane's previous note, within --jack-window
+    chord_density    share of notes hit together with another note
+    hold_coverage    share of the span during which at least one hold is held
+    strain_peak      peak of the strain curve (about notes per second, weighted by effort)
+    difficulty       strain section peaks, highest first, as a 0.9^k weighted mean
+
+Strain: every note adds its effort (1, plus switch_weight for a full-width lane
+move, jack_weight for a jack, hold_weight for a hold) to a total that decays
+with time constant --tau, so it follows sustained density and movement rather
+than single bursts. Each --section keeps its peak; difficulty weights the
+hardest sections most, like a rhythm game's star rating.
+
+A batch of charts is measured at once: the charts are concatenated with their
+times offset far apart, and every metric is a sort, a scan, a searchsorted or a
+bincount over all notes (thousands of typical charts per second).
+
+    python scripts/chart_metrics.py public/charts/chart.json public/charts/chart2.json public/charts/chart-drunk.json
+    python scripts/chart_metrics.py chart.json --require-ramp --max-nps 12 --json metrics.json
+
+With --require-ramp / --max-nps the exit status gates a release: 1 if any
+chart's stage difficulty drops from one stage to the next or a peak is too dense.
+"""
+import argparse
+import json
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from chart_core.notes import NoteArray
+from chart_format import read_chart
+
+METRICS = [
+    "notes", "holds", "nps_mean", "nps_peak", "nps_peak_time", "lane_switch", "jacks",
+    "chord_density", "hold_coverage", "strain_peak", "difficulty",
+]
+
+
+@dataclass
+class MetricRules:
+    lanes: int = 4
+    nps_window: float = 1.0
+    jack_window: float = 0.5
+    chord_tol: float = 1e-3
+    tau: float = 1.0
+    section_s: float = 0.4
+    switch_weight: float = 0.5
+    jack_weight: float = 1.0
+    hold_weight: float = 0.5
+    section_decay: float = 0.9
+
+
+# -------------------------
+# Per-note features (all charts at once, sorted by chart then hit)
+# -------------------------
+def note_features(charts: Sequence[NoteArray], rules: MetricRules) -> Dict[str, np.ndarray]:
+    cat = NoteArray.concat(list(charts)) if charts else NoteArray.concat([NoteArray.from_rows([])])
+    chart = np.repeat(np.arange(len(charts)), [len(c) for c in charts])
+    end = np.maximum(cat.end, cat.hit)
+    # far enough apart that no window, jack or strain tail reaches the next chart
+    gap = float(end.max(initial=0.0) - min(cat.hit.min(initial=0.0), 0.0)) + rules.nps_window + rules.jack_window
+    offset = chart * (gap + 50.0 * rules.tau)
+    t, e = cat.hit + offset, end + offset
+
+    order = np.lexsort((cat.lane, t))
+    t, e, offset, chart = t[order], e[order], offset[order], chart[order]
+    lane, stage, hold = cat.lane[order], cat.stage[order], cat.hold[order]
+    n = len(t)
+
+    dt = np.diff(t, prepend=-np.inf)
+    new_time = dt > rules.chord_tol
+    in_chord = ~new_time | np.append(~new_time[1:], False)
+
+    # lane movement between consecutive hit times (the first note of a chart has no predecessor)
+    same_chart = np.zeros(n, dtype=bool)
+    same_chart[1:] = chart[1:] == chart[:-1]
+    step = new_time & same_chart
+    moves = np.zeros(n)
+    moves[1:] = np.abs(np.diff(lane))
+    moves[~step] = 0.0
+
+    # jacks: previous note in the same lane (same chart) within the jack window
+    by_lane = np.lexsort((t, lane, chart))
+    tl = t[by_lane]
+    prev_same = np.zeros(n, dtype=bool)
+    prev_same[1:] = (lane[by_lane][1:] == lane[by_lane][:-1]) & (chart[by_lane][1:] == chart[by_lane][:-1])
+    gap_l = np.diff(tl, prepend=-np.inf)
+    jack = np.zeros(n, dtype=bool)
+    jack[by_lane] = prev_same & (gap_l > rules.chord_tol) & (gap_l <= rules.jack_window)
+
+    nps = (np.searchsorted(t, t + rules.nps_window, side="left") - np.arange(n)) / rules.nps_window
+
+    # hold coverage: the part of each hold not already covered by an earlier one
+    covered = np.zeros(n)
+    if np.any(hold):
+        hs, he = t[hold], e[hold]
+        reach = np.concatenate([[-np.inf], np.maximum.accumulate(he)[:-1]])
+        covered[hold] = np.maximum(he - np.maximum(hs, reach), 0.0)
+
+    # strain: sum of effort * exp(-(t - t_j) / tau) over notes j so far, in log space (no overflow)
+    effort = (
+        1.0
+        + rules.switch_weight * moves / max(rules.lanes - 1, 1)
+        + rules.jack_weight * jack
+        + rules.hold_weight * hold
+    )
+    x = t / rules.tau
+    strain = np.exp(np.logaddexp.accumulate(np.log(effort) + x) - x) / rules.tau if n else np.zeros(0)
+
+    return dict(
+        t=t, e=e, hit=t - offset, chart=chart, stage=stage, hold=hold, in_chord=in_chord,
+        step=step, moves=moves, jack=jack, nps=nps, covered=covered, strain=strain,
+        section=np.floor(np.maximum(t - offset, 0.0) / rules.section_s).astype(np.int64),
+    )
+
+
+# -------------------------
+# Aggregation over groups (stage of a chart, or whole chart)
+# -------------------------
+def aggregate(f: Dict[str, np.ndarray], group: np.ndarray, n_groups: int, rules: MetricRules) -> Dict[str, np.ndarray]:
+    count = np.bincount(group, minlength=n_groups).astype(np.float64)
+    safe = np.maximum(count, 1.0)
+
+    first = np.full(n_groups, np.inf)
+    last = np.full(n_groups, -np.inf)
+    np.minimum.at(first, group, f["t"])
+    np.maximum.at(last, group, f["e"])
+    span = np.where(count > 0, np.maximum(last - first, rules.nps_window), 1.0)
+
+    nps_peak = np.zeros(n_groups)
+    np.maximum.at(nps_peak, group, f["nps"])
+    at_peak = f["nps"] == nps_peak[group]
+    peak_time = np.full(n_groups, np.inf)
+    np.minimum.at(peak_time, group[at_peak], f["hit"][at_peak])
+
+    steps = np.bincount(group, f["step"], minlength=n_groups)
+    strain_peak = np.zeros(n_groups)
+    np.maximum.at(strain_peak, group, f["strain"])
+
+    # difficulty: each section's peak strain, sorted within the group, weighted section_decay^rank
+    key = group * (int(f["section"].max(initial=0)) + 1) + f["section"]
+    keys, inv = np.unique(key, return_inverse=True)
+    peaks = np.zeros(len(keys))
+    np.maximum.at(peaks, inv, f["strain"])
+    sec_group = keys // (int(f["section"].max(initial=0)) + 1)
+    order = np.lexsort((-peaks, sec_group))
+    sec_group, peaks = sec_group[order], peaks[order]
+    rank = np.arange(len(peaks)) - np.searchsorted(sec_group, sec_group, side="left")
+    w = rules.section_decay ** rank
+    difficulty = np.bincount(sec_group, peaks * w, minlength=n_groups) / np.maximum(
+        np.bincount(sec_group, w, minlength=n_groups), 1e-12
+    )
+
+    return dict(
+        notes=count,
+        holds=np.bincount(group, f["hold"], minlength=n_groups),
+        nps_mean=count / span,
+        nps_peak=nps_peak,
+        nps_peak_time=np.where(count > 0, peak_time, 0.0),
+        lane_switch=np.bincount(group, f["moves"], minlength=n_groups) / np.maximum(steps, 1.0),
+        jacks=np.bincount(group, f["jack"], minlength=n_groups),
+        chord_density=np.bincount(group, f["in_chord"], minlength=n_groups) / safe,
+        hold_coverage=np.bincount(group, f["covered"], minlength=n_groups) / span,
+        strain_peak=strain_peak,
+        difficulty=difficulty,
+    )
+
+
+def group_row(m: Dict[str, np.ndarray], g: int) -> Dict:
+    row = {}
+    for name in METRICS:
+        v = float(m[name][g])
+        row[name] = int(v) if name in ("notes", "holds", "jacks") else round(v, 4)
+    return row
+
+
+def measure_charts(charts: Sequence[NoteArray], rules: MetricRules = MetricRules()) -> List[Dict]:
+    """[{"overall": metrics, "stages": {stage: metrics}}] for every chart, in one vectorized pass."""
+    f = note_features(charts, rules)
+    n_charts = len(charts)
+    n_stages = int(f["stage"].max(initial=0)) + 1
+    stage_group = f["chart"] * n_stages + np.clip(f["stage"], 0, None)
+    per_stage = aggregate(f, stage_group, n_charts * n_stages, rules)
+    overall = aggregate(f, f["chart"], n_charts, rules)
+
+    out = []
+    for c in range(n_charts):
+        stages = {
+            s: group_row(per_stage, c * n_stages + s)
+            for s in range(n_stages)
+            if per_stage["notes"][c * n_stages + s] > 0
+        }
+        out.append(dict(overall=group_row(overall, c), stages=stages))
+    return out
+
+
+def measure_chart(notes: NoteArray, rules: MetricRules = MetricRules()) -> Dict:
+    return measure_charts([notes], rules)[0]
+
+
+def ramp_failures(result: Dict, tol: float = 0.0) -> List[str]:
+    """Stages whose difficulty is lower than the stage before (by more than tol)."""
+    stages = sorted(result["stages"].items())
+    return [
+        f"stage {s} difficulty {m['difficulty']:.2f} < stage {ps} {pm['difficulty']:.2f}"
+        for (ps, pm), (s, m) in zip(stages, stages[1:])
+        if m["difficulty"] < pm["difficulty"] - tol
+    ]
+
+
+def format_metrics(path: str, result: Dict) -> str:
+    cols = ["notes", "holds", "nps_mean", "nps_peak", "lane_switch", "jacks", "chord_density",
+            "hold_coverage", "strain_peak", "difficulty"]
+    heads = ["notes", "holds", "nps", "peak", "switch", "jacks", "chord", "hold%", "strain", "diff"]
+    lines = [path, "  " + f"{'':<8}" + "".join(f"{h:>8}" for h in heads)]
+    rows = [(f"stage {s}", m) for s, m in sorted(result["stages"].items())] + [("overall", result["overall"])]
+    for label, m in rows:
+        cells = []
+        for c in cols:
+            v = m[c]
+            cells.append(f"{v:>8d}" if isinstance(v, int) else f"{v * 100 if c in ('chord_density', 'hold_coverage') else v:>8.2f}")
+        lines.append("  " + f"{label:<8}" + "".join(cells))
+    return "\n".join(lines)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("charts", nargs="+", help="chart files (json / columnar / binary, optionally .gz/.br)")
+    ap.add_argument("--lanes", type=int, default=4, help="lane count (normalizes lane_switch in the strain)")
+    ap.add_argument("--nps-window", type=float, default=1.0, help="rolling window for nps_peak (s)")
+    ap.add_argument("--jack-window", type=float, default=0.5, help="same-lane repeats closer than this are jacks (s)")
+    ap.add_argument("--tau", type=float, default=1.0, help="strain decay time constant (s)")
+    ap.add_argument("--section", type=float, default=0.4, help="strain section length (s)")
+    ap.add_argument("--require-ramp", action="store_true", help="fail if a stage is easier than the one before")
+    ap.add_argument("--ramp-tol", type=float, default=0.0, help="difficulty drop allowed by --require-ramp")
+    ap.add_argument("--max-nps", type=float, help="fail if any chart's nps_peak is higher")
+    ap.add_argument("--json", help="write the metrics here")
+    args = ap.parse_args()
+
+    rules = MetricRules(
+        lanes=args.lanes, nps_window=args.nps_window, jack_window=args.jack_window,
+        tau=args.tau, section_s=args.section,
+    )
+    charts = [NoteArray.from_rows(read_chart(path)) for path in args.charts]
+    t0 = time.perf_counter()
+    results = measure_charts(charts, rules)
+    elapsed = time.perf_counter() - t0
+
+    failed = 0
+    for path, result in zip(args.charts, results):
+        print(format_metrics(path, result))
+        problems = ramp_failures(result, args.ramp_tol) if args.require_ramp else []
+        if args.max_nps is not None and result["overall"]["nps_peak"] > args.max_nps:
+            problems.append(f"nps_peak {result['overall']['nps_peak']:.1f} > {args.max_nps:g}")
+        for p in problems:
+            print(f"  FAILED: {p}")
+        failed += bool(problems)
+    print(f"measured {len(charts)} chart(s), {sum(len(c) for c in charts)} notes in {elapsed * 1e3:.1f} ms")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(dict(zip(args.charts, results)), f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,452 @@
+"""
+Warm local chart service: numpy/librosa stay imported and recently analyzed
+songs stay in memory, so a regeneration pays for charting only, not process
+startup, imports and decoding.
+
+    python scripts/chart_service.py serve --port 8765 --workers 2 --queue 8
+    python scripts/chart_service.py submit --audio song.mp3 --out chart.json --params params.json
+    curl -s localhost:8765/chart -H 'Content-Type: application/json' \\
+        -d '{"audio": "/abs/song.mp3", "params": {"bpm": 144}}'
+
+HTTP on localhost (stdlib asyncio, one request per connection):
+
+    POST /chart   {"audio", "params"?, "difficulties"?, "out"?, "format"?, "compress"?,
+                   "stream"?, "decoder"?, "sr"?, "validate"?, "progress"?}
+    GET  /status  workers, queue use, cached songs, hit/miss counts
+
+"params" are ChartConfig overrides and "difficulties" the same JSON as
+analyze_song.py --difficulties. With "out" the chart is written there (and
+read back through validate_chart.py unless "validate": false); without it the
+rows come back in the response. "out" must lie under --out-root (default: the
+service's working directory) and relative ones resolve against it; relative
+audio paths resolve against the working directory. Bodies must be sent as
+Content-Type: application/json, so a web page can't post jobs from a browser
+without a CORS preflight the service never answers. Nested difficulties are
+checked to be supersets of the previous one; a miss fails the job like a
+validation error.
+
+Jobs run on --workers threads (numpy, librosa and the decoders release the GIL
+in their heavy loops). At most --queue jobs may be waiting or running; past
+that POST /chart answers 503 with Retry-After rather than queueing without
+bound. Analyses are kept in an LRU of --songs entries keyed by path, size,
+mtime and decode settings, on top of the on-disk analysis cache. With
+"progress": true the response is chunked NDJSON: one {"event": ...} line per
+step, then the result line.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import replace
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_PORT = 8765
+MAX_BODY = 16 * 1024 * 1024
+REQUEST_ERRORS = (ValueError, TypeError, KeyError, OSError)  # bad params / paths -> 400
+
+Emit = Callable[..., None]
+
+
+class Busy(Exception):
+    """Every queue slot is taken."""
+
+
+class ChartService:
+    def __init__(
+        self,
+        *,
+        workers: int = 2,
+        queue: int = 8,
+        songs: int = 8,
+        cache_dir: Optional[str] = None,
+        out_root: Optional[str] = None,
+    ):
+        from analysis_cache import AnalysisCache
+
+        self.workers = max(1, workers)
+        self.out_root = os.path.realpath(out_root or os.getcwd())
+        self.queue = max(self.workers, queue)
+        self.songs = max(1, songs)
+        self.cache = AnalysisCache(cache_dir) if cache_dir else None
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="chart")
+        self.pending = 0  # jobs waiting or running (event loop thread only)
+        self.analyses: "OrderedDict[Tuple, object]" = OrderedDict()
+        self.lock = threading.Lock()
+        # [lock, holders + waiters] per song being analyzed; separate from the LRU so eviction can't drop a lock in use
+        self.song_locks: Dict[Tuple, List] = {}
+        self.counts = dict(jobs=0, failed=0, rejected=0, analysis_hits=0, analysis_misses=0)
+
+    def warm_up(self) -> float:
+        """Import the analysis stack and run one tiny onset pass so the first job doesn't pay for it."""
+        t0 = time.perf_counter()
+        import numpy as np
+
+        import analyze_song  # noqa: F401  (pulls in chart_core, lanes, tempo, the chart checks)
+        from onset_bands import onset_envelopes
+
+        onset_envelopes(np.zeros(22050, dtype=np.float32), sr=22050)
+        return time.perf_counter() - t0
+
+    # -------------------------
+    # Analysis LRU
+    # -------------------------
+    @contextmanager
+    def song_lock(self, key: Tuple) -> Iterator[None]:
+        """Hold the song's lock; its entry lives while anyone holds or waits on it."""
+        with self.lock:
+            entry = self.song_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.song_locks[key]
+
+    def analysis(self, path: str, *, stream: bool, decoder: str, sr: Optional[int]) -> Tuple[object, bool]:
+        """(Analysis, served from memory) for one song and decode setup."""
+        from analyze_song import analyze_audio
+
+        st = os.stat(path)
+        key = (os.path.realpath(path), st.st_size, st.st_mtime_ns, stream, decoder, sr)
+        # one analysis per song at a time; other songs proceed in parallel
+        with self.song_lock(key):
+            with self.lock:
+                if key in self.analyses:
+                    self.analyses.move_to_end(key)
+                    self.counts["analysis_hits"] += 1
+                    return self.analyses[key], True
+            analysis = analyze_audio(path, cache=self.cache, stream=stream, decoder=decoder, sr=sr)
+            with self.lock:
+                self.counts["analysis_misses"] += 1
+                self.analyses[key] = analysis
+                while len(self.analyses) > self.songs:
+                    self.analyses.popitem(last=False)
+        return analysis, False
+
+    # -------------------------
+    # Jobs
+    # -------------------------
+    def out_path(self, out: str) -> str:
+        """`out` resolved under the output root (symlinks and .. included); anything outside is a bad request."""
+        path = os.path.realpath(os.path.join(self.out_root, out))
+        if os.path.commonpath([path, self.out_root]) != self.out_root:
+            raise ValueError(f'"out" must be inside {self.out_root}, got {out!r}')
+        return path
+
+    def run(self, req: Dict, emit: Emit) -> Dict:
+        """One chart job (worker thread). Raises on bad requests."""
+        from analyze_song import (
+            ChartConfig, build_chart, build_difficulties, difficulty_configs, difficulty_path, is_superset,
+            resolve_tempo,
+        )
+        from chart_format import FORMATS, write_chart
+        from chart_core.validate import ChartRules, validate_file, validate_rows
+
+        t0 = time.perf_counter()
+        if "audio" not in req:
+            raise ValueError('request needs "audio"')
+        fmt = req.get("format", "json")
+        if fmt not in FORMATS:
+            raise ValueError(f"format must be one of {FORMATS}, got {fmt!r}")
+        cfg = ChartConfig.from_dict(req.get("params") or {})
+        out = self.out_path(req["out"]) if req.get("out") else None
+        emit("started")
+
+        analysis, cached = self.analysis(
+            req["audio"], stream=bool(req.get("stream", False)), decoder=req.get("decoder", "librosa"), sr=req.get("sr")
+        )
+        emit("analysis", cached=cached, duration=round(analysis.duration, 3))
+
+        if req.get("difficulties"):
+            cfgs = difficulty_configs(cfg, req["difficulties"])
+            tempo_cfg, beat0, tempo_map = resolve_tempo(analysis, next(iter(cfgs.values())), cache=self.cache)
+            cfgs = {name: replace(c, bpm=tempo_cfg.bpm) for name, c in cfgs.items()}
+            emit("tempo", bpm=tempo_cfg.bpm, beat0=round(beat0, 5))
+            charts = {
+                name: rows for name, (rows, _) in build_difficulties(analysis, cfgs, beat0=beat0, tempo_map=tempo_map).items()
+            }
+        else:
+            tempo_cfg, beat0, tempo_map = resolve_tempo(analysis, cfg, cache=self.cache)
+            emit("tempo", bpm=tempo_cfg.bpm, beat0=round(beat0, 5))
+            cfgs = {"": tempo_cfg}
+            charts = {"": build_chart(analysis, tempo_cfg, beat0=beat0, tempo_map=tempo_map)[0]}
+        emit("chart", notes={name or "chart": len(rows) for name, rows in charts.items()})
+
+        result = dict(ok=True, bpm=tempo_cfg.bpm, beat0=round(beat0, 5), analysis_cached=cached)
+        outputs = {}
+        prev_rows = None
+        for name, rows in charts.items():
+            entry = dict(notes=len(rows))
+            if prev_rows is not None:
+                # nested charts guarantee it; a miss fails the job like a validation error
+                entry["superset"] = is_superset(rows, prev_rows)
+                result["ok"] &= entry["superset"]
+            prev_rows = rows
+            if out:
+                path = difficulty_path(out, name) if name else out
+                write_chart(rows, path, fmt, compress=bool(req.get("compress", False)))
+                entry["path"] = path
+            if req.get("validate", True):
+                rules = ChartRules.from_config(cfgs[name])
+                report = validate_file(entry["path"], rules) if "path" in entry else validate_rows(rows, rules)
+                entry["validation"] = report.to_dict(examples=5)
+                result["ok"] &= report.ok
+            if not out:
+                entry["chart"] = rows
+            outputs[name or "chart"] = entry
+        if out:
+            emit("written", paths=[e["path"] for e in outputs.values()])
+        result["charts"] = outputs
+        result["seconds"] = round(time.perf_counter() - t0, 4)
+        return result
+
+    def reserve(self) -> None:
+        if self.pending >= self.queue:
+            self.counts["rejected"] += 1
+            raise Busy()
+        self.pending += 1
+
+    async def submit(self, req: Dict, emit: Emit) -> Dict:
+        """Run a reserved job on the pool; releases its queue slot when done."""
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self.pool, self.run, req, emit)
+        except BaseException:
+            self.counts["failed"] += 1
+            raise
+        finally:
+            self.pending -= 1
+            self.counts["jobs"] += 1
+        return result
+
+    def status(self) -> Dict:
+        with self.lock:
+            songs = [dict(path=k[0], stream=k[3], decoder=k[4], sr=k[5]) for k in self.analyses]
+        return dict(workers=self.workers, queue=self.queue, pending=self.pending, songs=songs, **self.counts)
+
+
+# -------------------------
+# HTTP
+# -------------------------
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large",
+               415: "Unsupported Media Type", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+async def read_request(reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str], bytes]:
+    line = (await reader.readline()).decode("latin-1").strip()
+    method, path, _ = (line.split(" ", 2) + ["", ""])[:3]
+    headers = {}
+    while True:
+        h = (await reader.readline()).decode("latin-1")
+        if h in ("\r\n", "\n", ""):
+            break
+        name, _, value = h.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0) or 0)
+    if length > MAX_BODY:
+        raise ValueError("request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method, path, headers, body
+
+
+def write_head(writer: asyncio.StreamWriter, code: int, headers: Dict[str, str]) -> None:
+    lines = [f"HTTP/1.1 {code} {STATUS_TEXT.get(code, '')}", "Connection: close"]
+    lines += [f"{k}: {v}" for k, v in headers.items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+
+async def send_json(writer: asyncio.StreamWriter, code: int, payload: Dict, **headers: str) -> None:
+    body = json.dumps(payload).encode()
+    write_head(writer, code, {"Content-Type": "application/json", "Content-Length": str(len(body)),
+                              **{k.replace("_", "-"): v for k, v in headers.items()}})
+    writer.write(body)
+    await writer.drain()
+
+
+async def write_chunk(writer: asyncio.StreamWriter, payload: Dict) -> None:
+    data = (json.dumps(payload) + "\n").encode()
+    writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+    await writer.drain()
+
+
+def error_payload(e: BaseException) -> Tuple[int, Dict]:
+    code = 400 if isinstance(e, REQUEST_ERRORS) else 500
+    return code, dict(ok=False, error=f"{type(e).__name__}: {e}")
+
+
+async def handle(service: ChartService, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        try:
+            method, path, headers, body = await read_request(reader)
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            await send_json(writer, 413 if "too large" in str(e) else 400, dict(ok=False, error=str(e)))
+            return
+
+        if method == "GET" and path == "/status":
+            await send_json(writer, 200, service.status())
+            return
+        if method != "POST" or path != "/chart":
+            await send_json(writer, 404, dict(ok=False, error=f"no route {method} {path}"))
+            return
+        # a browser form or no-cors fetch can't send this type without a preflight
+        if headers.get("content-type", "").split(";")[0].strip().lower() != "application/json":
+            await send_json(writer, 415, dict(ok=False, error="POST /chart needs Content-Type: application/json"))
+            return
+        try:
+            req = json.loads(body or b"{}")
+            if not isinstance(req, dict):
+                raise ValueError("request body must be a JSON object")
+        except ValueError as e:
+            await send_json(writer, 400, dict(ok=False, error=f"bad JSON: {e}"))
+            return
+        try:
+            service.reserve()
+        except Busy:
+            await send_json(writer, 503, dict(ok=False, error="queue full", pending=service.pending),
+                            Retry_After="1")
+            return
+
+        loop = asyncio.get_running_loop()
+        if not req.get("progress"):
+            try:
+                result = await service.submit(req, lambda event, **info: None)
+            except Exception as e:
+                await send_json(writer, *error_payload(e))
+                return
+            await send_json(writer, 200, result)
+            return
+
+        events: asyncio.Queue = asyncio.Queue()
+        t0 = time.perf_counter()
+
+        def emit(event: str, **info) -> None:
+            info = dict(event=event, t=round(time.perf_counter() - t0, 4), **info)
+            loop.call_soon_threadsafe(events.put_nowait, info)
+
+        task = asyncio.ensure_future(service.submit(req, emit))
+        # queued after every emit() of the job, so the stream ends with the result
+        task.add_done_callback(lambda _: events.put_nowait(None))
+        write_head(writer, 200, {"Content-Type": "application/x-ndjson", "Transfer-Encoding": "chunked"})
+        await write_chunk(writer, dict(event="queued", pending=service.pending))
+        while (event := await events.get()) is not None:
+            await write_chunk(writer, event)
+        try:
+            result = task.result()
+        except Exception as e:
+            result = error_payload(e)[1]
+        await write_chunk(writer, dict(event="result", **result))
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(service: ChartService, host: str, port: int) -> None:
+    server = await asyncio.start_server(lambda r, w: handle(service, r, w), host, port)
+    addr = server.sockets[0].getsockname()
+    print(f"chart service on http://{addr[0]}:{addr[1]} "
+          f"(workers={service.workers}, queue={service.queue}, songs={service.songs})", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+# -------------------------
+# Client
+# -------------------------
+def submit(url: str, req: Dict, *, timeout: float = 600.0) -> Dict:
+    """POST a job and return the result; progress lines are printed as they arrive."""
+    data = json.dumps(req).encode()
+    request = urllib.request.Request(url.rstrip("/") + "/chart", data=data,
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as resp:
+            if not req.get("progress"):
+                return json.load(resp)
+            result: Dict = {}
+            for line in resp:
+                event = json.loads(line)
+                if event["event"] == "result":
+                    result = {k: v for k, v in event.items() if k != "event"}
+                else:
+                    print(json.dumps(event), flush=True)
+            return result
+    except urllib.error.HTTPError as e:
+        return json.load(e)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    s = sub.add_parser("serve", help="run the service")
+    s.add_argument("--host", default="127.0.0.1")
+    s.add_argument("--port", type=int, default=DEFAULT_PORT)
+    s.add_argument("--workers", type=int, default=2, help="jobs charted at once")
+    s.add_argument("--queue", type=int, default=8, help="jobs waiting or running before 503")
+    s.add_argument("--songs", type=int, default=8, help="analyzed songs kept in memory")
+    s.add_argument("--no-cache", action="store_true", help="don't use the on-disk analysis cache")
+    s.add_argument("--cache-dir", default=None, help="on-disk analysis cache (default: .analysis_cache)")
+    s.add_argument("--out-root", default=".", help="jobs may only write charts under this directory")
+
+    c = sub.add_parser("submit", help="send one job to a running service")
+    c.add_argument("--url", default=f"http://127.0.0.1:{DEFAULT_PORT}")
+    c.add_argument("--audio", required=True)
+    c.add_argument("--out", help="write the chart here (default: print the result without rows)")
+    c.add_argument("--format", default="json")
+    c.add_argument("--params", help="JSON file of ChartConfig overrides")
+    c.add_argument("--difficulties", help="JSON {name: overrides}, as for analyze_song.py")
+    c.add_argument("--stream", action="store_true")
+    c.add_argument("--decoder", default="librosa")
+    c.add_argument("--sr", type=int)
+    c.add_argument("--progress", action="store_true", help="print progress events as they arrive")
+    args = ap.parse_args()
+
+    if args.cmd == "serve":
+        from analysis_cache import DEFAULT_CACHE_DIR
+
+        service = ChartService(
+            workers=args.workers, queue=args.queue, songs=args.songs,
+            cache_dir=None if args.no_cache else (args.cache_dir or DEFAULT_CACHE_DIR), out_root=args.out_root,
+        )
+        print(f"warmed up in {service.warm_up():.2f}s", flush=True)
+        try:
+            asyncio.run(serve(service, args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    req: Dict = dict(audio=os.path.abspath(args.audio), format=args.format, stream=args.stream,
+                     decoder=args.decoder, sr=args.sr, progress=args.progress)
+    if args.out:
+        req["out"] = os.path.abspath(args.out)
+    for key, path in (("params", args.params), ("difficulties", args.difficulties)):
+        if path:
+            with open(path) as f:
+                req[key] = json.load(f)
+    result = submit(args.url, req)
+    for entry in result.get("charts", {}).values():
+        entry.pop("chart", None)  # rows only matter to programmatic clients
+        if "validation" in entry:
+            v = entry["validation"]
+            entry["validation"] = dict(
+                ok=v["ok"], peak_nps=v["peak_nps"],
+                violations={name: c["count"] for name, c in v["violations"].items() if c["count"]},
+            )
+    print(json.dumps(result, indent=2))
+    return 0 if result.get("ok") else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""
+Check fast decode settings (backend x analysis rate) against the full-rate path.
+
+For each song the reference is librosa at the native rate. Every candidate is
+timed over decode + onset analysis (best of --repeat, no cache). Then
+beat0 and the charted notes are compared with the reference:
+
+    speedup   reference decode+onset time / candidate time
+    beat0     signed beat0 difference in ms (wrapped to +-half a beat)
+    matched   share of reference notes with a candidate note within --tol-ms
+    p95       95th percentile |hit time difference| of the matched notes
+
+A candidate passes when |beat0| <= --max-beat0-ms and matched >= --min-match.
+The fastest passing one is suggested as the song's manifest setting.
+
+    python scripts/compare_decode.py song.mp3 --sr 22050 11025 --params params.json --json decode.json
+"""
+import argparse
+import json
+import time
+from dataclasses import replace
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from analyze_song import ChartConfig, analyze_audio, build_chart, resolve_tempo
+from audio_io import DECODERS, ffmpeg_available
+from phase_timer import PhaseTimer
+
+
+def timed_analysis(path: str, *, decoder: str, sr: Optional[int], repeat: int):
+    """(analysis, best decode seconds, best onset seconds)."""
+    best_decode = best_onset = float("inf")
+    analysis = None
+    for _ in range(repeat):
+        timer = PhaseTimer()
+        analysis = analyze_audio(path, decoder=decoder, sr=sr, timer=timer)
+        totals = timer.totals()
+        best_decode = min(best_decode, totals.get("decode", 0.0))
+        best_onset = min(best_onset, totals.get("onset", 0.0))
+    return analysis, best_decode, best_onset
+
+
+def chart_for(analysis, cfg: ChartConfig) -> Tuple[ChartConfig, float, np.ndarray]:
+    cfg, beat0, tempo_map = resolve_tempo(analysis, cfg)
+    rows, _ = build_chart(analysis, cfg, beat0=beat0, tempo_map=tempo_map)
+    return cfg, beat0, np.array([r["hit"] for r in rows])
+
+
+def match_notes(ref: np.ndarray, cand: np.ndarray, tol_s: float) -> Tuple[float, float, float]:
+    """(matched share of ref, median |dt| ms, p95 |dt| ms) pairing each ref hit with its nearest cand hit."""
+    if len(ref) == 0 or len(cand) == 0:
+        return (1.0 if len(ref) == len(cand) else 0.0), 0.0, 0.0
+    cand = np.sort(cand)
+    i = np.clip(np.searchsorted(cand, ref), 1, len(cand) - 1)
+    dt = np.minimum(np.abs(ref - cand[i - 1]), np.abs(ref - cand[i]))
+    ok = dt <= tol_s
+    # a different note count means unmatched notes on one side or the other
+    share = float(np.count_nonzero(ok)) / max(len(ref), len(cand))
+    if not np.any(ok):
+        return share, float("nan"), float("nan")
+    return share, float(np.median(dt[ok]) * 1e3), float(np.percentile(dt[ok], 95) * 1e3)
+
+
+def wrapped_ms(b: float, b_ref: float, bpm: float) -> float:
+    spb = 60.0 / bpm
+    return float((np.mod(b - b_ref + spb / 2, spb) - spb / 2) * 1e3)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("audio", nargs="+")
+    ap.add_argument("--decoders", nargs="+", choices=DECODERS[1:], default=["soundfile", "librosa", "ffmpeg"])
+    ap.add_argument("--sr", type=int, nargs="+", default=[22050, 11025], help="analysis rates to try (besides native)")
+    ap.add_argument("--params", help="ChartConfig overrides used for every song (JSON)")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--tol-ms", type=float, default=10.0)
+    ap.add_argument("--max-beat0-ms", type=float, default=5.0)
+    ap.add_argument("--min-match", type=float, default=0.98)
+    ap.add_argument("--json", help="write all results here")
+    args = ap.parse_args()
+
+    cfg = ChartConfig()
+    if args.params:
+        with open(args.params) as f:
+            cfg = ChartConfig.from_dict(json.load(f))
+
+    decoders = [d for d in args.decoders if d != "ffmpeg" or ffmpeg_available()]
+    if len(decoders) < len(args.decoders):
+        print("(ffmpeg not on PATH, skipping the ffmpeg decoder)")
+    candidates = [(d, sr) for d in decoders for sr in [None] + args.sr if (d, sr) != ("librosa", None)]
+
+    all_results: List[Dict] = []
+    for path in args.audio:
+        t0 = time.perf_counter()
+        ref_analysis, ref_dec, ref_onset = timed_analysis(path, decoder="librosa", sr=None, repeat=args.repeat)
+        ref_cfg, ref_beat0, ref_hits = chart_for(ref_analysis, cfg)
+        ref_time = ref_dec + ref_onset
+        # charts must use the reference tempo, or an octave flip would swamp the comparison
+        cand_cfg = replace(cfg, bpm=ref_cfg.bpm)
+
+        print(f"\n{path}: native sr={ref_analysis.sr} BPM={ref_cfg.bpm} beat0={ref_beat0:.4f}s "
+              f"notes={len(ref_hits)} decode+onset={ref_time:.3f}s")
+        print(f"  {'decoder':<10} {'sr':>6} {'decode':>8} {'onset':>8} {'speedup':>8} "
+              f"{'beat0':>9} {'notes':>6} {'matched':>8} {'median':>8} {'p95':>8}  ok")
+
+        song = dict(audio=path, native_sr=ref_analysis.sr, bpm=ref_cfg.bpm, beat0=ref_beat0,
+                    notes=len(ref_hits), seconds=ref_time, candidates=[])
+        for decoder, sr in candidates:
+            try:
+                analysis, dec, onset = timed_analysis(path, decoder=decoder, sr=sr, repeat=args.repeat)
+            except Exception as e:
+                print(f"  {decoder:<10} {sr or 'native':>6}  failed: {type(e).__name__}: {e}")
+                song["candidates"].append(dict(decoder=decoder, sr=sr, error=f"{type(e).__name__}: {e}"))
+                continue
+            _, beat0, hits = chart_for(analysis, cand_cfg)
+            share, med, p95 = match_notes(ref_hits, hits, args.tol_ms / 1e3)
+            d_beat0 = wrapped_ms(beat0, ref_beat0, ref_cfg.bpm)
+            speedup = ref_time / max(dec + onset, 1e-9)
+            ok = abs(d_beat0) <= args.max_beat0_ms and share >= args.min_match
+            print(f"  {decoder:<10} {sr or 'native':>6} {dec:>7.3f}s {onset:>7.3f}s {speedup:>7.2f}x "
+                  f"{d_beat0:>+7.2f}ms {len(hits):>6} {share:>7.1%} {med:>6.2f}ms {p95:>6.2f}ms  {'yes' if ok else 'NO'}")
+            song["candidates"].append(dict(
+                decoder=decoder, sr=sr, decode_s=dec, onset_s=onset, speedup=speedup, beat0=beat0,
+                beat0_ms=d_beat0, notes=len(hits), matched=share, median_ms=med, p95_ms=p95, ok=ok,
+            ))
+
+        passing = [c for c in song["candidates"] if c.get("ok")]
+        if passing:
+            best = max(passing, key=lambda c: c["speedup"])
+            song["suggested"] = {"decoder": best["decoder"], "sr": best["sr"]}
+            print(f"  suggested: {json.dumps(song['suggested'])} ({best['speedup']:.2f}x)")
+        else:
+            song["suggested"] = None
+            print("  suggested: keep the full-rate path")
+        print(f"  ({time.perf_counter() - t0:.1f}s)")
+        all_results.append(song)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(all_results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+One entry point for the chart scripts.
+
+    python scripts/cursed_rhythm.py analyze --audio song.mp3 --out chart.json
+    python scripts/cursed_rhythm.py random --out chart.json
+    python scripts/cursed_rhythm.py convert chart.json chart.bin --format binary
+    python scripts/cursed_rhythm.py check-params params.json
+    python scripts/cursed_rhythm.py <command> --help
+
+Each subcommand runs the main() of its script (analyze_song.py, ...) with
+the remaining arguments; the scripts still work on their own. A script is
+imported only when its command runs, and the audio stack (librosa, scipy,
+soundfile) only once audio is actually decoded, so --help, check-params and
+chart conversion start without loading it.
+"""
+import argparse
+import importlib
+import json
+import os
+import sys
+from typing import List, Optional
+
+# command -> (module, argv prefix, summary)
+COMMANDS = {
+    "analyze": ("analyze_song", [], "beat-locked chart from an audio file"),
+    "random": ("generate_chart", [], "random fixed-BPM chart (no audio)"),
+    "batch": ("batch_chart", [], "chart a whole library from a manifest"),
+    "autotune": ("autotune", [], "tune stage parameters against a difficulty curve"),
+    "features": ("feature_store", [], "pack a library's analyses into a memory-mapped store"),
+    "convert": ("chart_format", ["convert"], "convert a chart between json/columnar/binary"),
+    "check": ("chart_format", ["check"], "round-trip chart files through every format"),
+    "index": ("chart_format", ["index"], "write seek indexes for existing charts"),
+    "validate": ("validate_chart", [], "check chart timing, lanes, popups and density"),
+    "metrics": ("chart_metrics", [], "per-stage difficulty metrics (nps, jacks, strain)"),
+    "clicks": ("click_track", [], "mix note clicks into the song (sync check by ear)"),
+    "serve": ("chart_service", ["serve"], "warm local chart service (HTTP job queue)"),
+    "submit": ("chart_service", ["submit"], "send a chart job to a running service"),
+    "bench": ("bench_pipeline", [], "time the pipeline on synthetic drum tracks"),
+    "bench-beat0": ("bench_beat0", [], "benchmark the beat0 phase search"),
+    "peaks": ("onset_peaks", [], "compare score windows by onset placement"),
+    "compare-decode": ("compare_decode", [], "check fast decode settings against the full-rate path"),
+}
+
+
+def check_params(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(
+        prog="cursed_rhythm.py check-params",
+        description="Validate config override files without loading any audio code.",
+    )
+    ap.add_argument("params", nargs="+", help="JSON files of ChartConfig (or RandomChartConfig) overrides")
+    ap.add_argument("--random", action="store_true", help="check against RandomChartConfig (generate_chart.py)")
+    args = ap.parse_args(argv)
+
+    from chart_core import ChartConfig, RandomChartConfig
+
+    cls = RandomChartConfig if args.random else ChartConfig
+    failed = 0
+    for path in args.params:
+        try:
+            with open(path) as f:
+                cfg = cls.from_dict(json.load(f))
+        except (OSError, ValueError, TypeError) as e:  # JSONDecodeError is a ValueError
+            failed += 1
+            print(f"{path}: {type(e).__name__}: {e}")
+            continue
+        print(f"{path}: ok ({cfg.n_stages} stages, {cfg.lanes} lanes)")
+    return 1 if failed else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    commands = dict(COMMANDS, **{"check-params": (None, [], "validate params JSON files")})
+    ap = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="commands:\n" + "\n".join(f"  {name:<15} {summary}" for name, (_, _, summary) in commands.items()),
+    )
+    ap.add_argument("command", choices=commands, metavar="command")
+    ap.add_argument("args", nargs=argparse.REMAINDER, help="arguments for the command (see <command> --help)")
+    args = ap.parse_args(argv)
+
+    if args.command == "check-params":
+        return check_params(args.args)
+
+    module_name, prefix, _ = COMMANDS[args.command]
+    module = importlib.import_module(module_name)
+    # the script parses sys.argv itself; make its usage line read "cursed_rhythm.py <command>"
+    # (prefixed commands are subcommands of the script, which adds the name back)
+    prog = os.path.basename(sys.argv[0])
+    sys.argv = [prog if prefix else f"{prog} {args.command}"] + prefix + args.args
+    return module.main() or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,359 @@
+"""
+Memory-mapped feature store for a song library.
+
+Every song's onset analysis is packed into a few shared .npy files plus a
+small JSON index, so a tool opens the whole library in milliseconds and only
+the pages of the songs (and time ranges) it reads are ever loaded:
+
+    store/
+      index.json           songs -> frame range, sr/hop, duration, bpm, beat0,
+                           tempo map, source file stamp and analysis settings
+      onset_env.<gen>.npy  float64 (total_frames,)  normalized broadband envelope
+      band_env.<gen>.npy   float32 (total_frames, bands)  low/mid/high envelopes
+
+Songs are concatenated along the frame axis; index.json records each song's
+[start, start + frames) slice. Adding songs writes a new generation of the
+array files and then swaps index.json in atomically. A reader maps its
+generation's arrays when it opens the store, so it keeps a consistent (older)
+view however many writes follow; the previous generation stays on disk until
+the next write, for a reader that read the old index just before the swap.
+One writer at a time.
+
+    python scripts/feature_store.py add store --manifest library.json
+    python scripts/feature_store.py add store song.mp3 other.mp3
+    python scripts/feature_store.py list store
+    python scripts/feature_store.py show store drunk --start 30 --end 45
+
+batch_chart.py --features store and autotune.py --features store --song ID
+read analyses from here instead of decoding audio.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from dataclasses import replace
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+STORE_FORMAT = "cursed-rhythm/features"
+STORE_VERSION = 1
+INDEX_NAME = "index.json"
+ARRAYS = {"onset_env": np.float64, "band_env": np.float32}
+
+
+def file_stamp(path: str) -> Dict:
+    st = os.stat(path)
+    return dict(size=st.st_size, mtime_ns=st.st_mtime_ns)
+
+
+def tempo_params(cfg) -> Dict:
+    """The ChartConfig fields resolve_tempo's result depends on, as requested (bpm may be "auto")."""
+    return dict(
+        bpm=cfg.bpm, bpm_range=list(cfg.bpm_range), tempo_map=cfg.tempo_map, tempo_warp=cfg.tempo_warp,
+        beat0_search_window=None if cfg.beat0_search_window is None else list(cfg.beat0_search_window),
+        beat0_refine=cfg.beat0_refine,
+    )
+
+
+class FeatureStore:
+    """Read-only view of a store directory; arrays are memmapped on open, pages load as they are read."""
+
+    def __init__(self, root: str):
+        self.root = root
+        path = os.path.join(root, INDEX_NAME)
+        if os.path.exists(path):
+            with open(path) as f:
+                self.index = json.load(f)
+            if self.index.get("format") != STORE_FORMAT:
+                raise ValueError(f"{path} is not a feature store index")
+            if self.index.get("version") != STORE_VERSION:
+                raise ValueError(f"{path}: unsupported store version {self.index.get('version')}")
+        else:
+            self.index = dict(format=STORE_FORMAT, version=STORE_VERSION, generation=0, arrays={}, songs={})
+        # mapped now: a mapping outlives the file, so later writes can remove this generation
+        self._arrays: Dict[str, np.ndarray] = {
+            name: np.load(os.path.join(root, fname), mmap_mode="r") for name, fname in self.index["arrays"].items()
+        }
+
+    @property
+    def songs(self) -> List[str]:
+        return list(self.index["songs"])
+
+    def __contains__(self, song_id: str) -> bool:
+        return song_id in self.index["songs"]
+
+    def __len__(self) -> int:
+        return len(self.index["songs"])
+
+    def entry(self, song_id: str) -> Dict:
+        try:
+            return self.index["songs"][song_id]
+        except KeyError:
+            raise KeyError(f"song {song_id!r} is not in the feature store {self.root}") from None
+
+    def array(self, name: str) -> np.ndarray:
+        return self._arrays[name]
+
+    # -------------------------
+    # Per-song reads (views into the memmaps)
+    # -------------------------
+    def frames(self, song_id: str, start: Optional[float] = None, end: Optional[float] = None) -> slice:
+        """Packed frame slice of a song, optionally limited to [start, end] seconds."""
+        e = self.entry(song_id)
+        fps = e["sr"] / e["hop_length"]
+        lo = 0 if start is None else int(np.clip(np.floor(start * fps), 0, e["frames"]))
+        hi = e["frames"] if end is None else int(np.clip(np.ceil(end * fps) + 1, lo, e["frames"]))
+        return slice(e["start"] + lo, e["start"] + hi)
+
+    def onset_env(self, song_id: str, start: Optional[float] = None, end: Optional[float] = None) -> np.ndarray:
+        return self.array("onset_env")[self.frames(song_id, start, end)]
+
+    def band_env(self, song_id: str, start: Optional[float] = None, end: Optional[float] = None) -> np.ndarray:
+        """(bands, frames) like Analysis.band_env."""
+        return self.array("band_env")[self.frames(song_id, start, end)].T
+
+    def frame_times(self, song_id: str, start: Optional[float] = None, end: Optional[float] = None) -> np.ndarray:
+        e = self.entry(song_id)
+        sl = self.frames(song_id, start, end)
+        return np.arange(sl.start - e["start"], sl.stop - e["start"]) * e["hop_length"] / e["sr"]
+
+    def analysis(self, song_id: str):
+        """The song's Analysis, backed by the memmaps (nothing is read until used)."""
+        from analyze_song import Analysis
+
+        e = self.entry(song_id)
+        return Analysis(
+            onset_env=self.onset_env(song_id),
+            onset_times_env=self.frame_times(song_id),
+            duration=e["duration"],
+            sr=e["sr"],
+            hop_length=e["hop_length"],
+            band_env=self.band_env(song_id),
+        )
+
+    def tempo(self, song_id: str):
+        """(bpm, beat0, TempoMap or None) resolved when the song was added."""
+        from tempo import TempoMap
+
+        e = self.entry(song_id)
+        return e["bpm"], e["beat0"], None if e["tempo_map"] is None else TempoMap.from_dict(e["tempo_map"])
+
+    def resolved_tempo(self, song_id: str, cfg):
+        """
+        resolve_tempo(analysis, cfg) from the store: (cfg with the stored bpm, beat0,
+        TempoMap or None), or None if the song was added with other tempo settings.
+        """
+        if self.entry(song_id).get("tempo_params") != tempo_params(cfg):
+            return None
+        bpm, beat0, tempo_map = self.tempo(song_id)
+        return replace(cfg, bpm=bpm), beat0, tempo_map
+
+    def is_fresh(self, song_id: str, audio: str, *, stream: bool = False, decoder: str = "librosa",
+                 sr: Optional[int] = None) -> bool:
+        """True if the stored analysis came from this exact file with these decode settings."""
+        from analyze_song import ANALYSIS_VERSION
+
+        if song_id not in self or not os.path.exists(audio):
+            return False
+        e = self.entry(song_id)
+        settings = dict(stream=stream, decoder=decoder, sr=sr, version=ANALYSIS_VERSION)
+        return (
+            e["audio"] == os.path.abspath(audio)
+            and e["stamp"] == file_stamp(audio)
+            and e["settings"] == settings
+        )
+
+
+# -------------------------
+# Writing
+# -------------------------
+def _song_entry(analysis, *, audio: str, settings: Dict, cfg, beat0: float, tempo_map, requested: Dict) -> Dict:
+    """cfg is resolve_tempo's (numeric bpm); requested is tempo_params() of the config before it."""
+    return dict(
+        audio=os.path.abspath(audio),
+        stamp=file_stamp(audio),
+        settings=settings,
+        sr=int(analysis.sr),
+        hop_length=int(analysis.hop_length),
+        duration=float(analysis.duration),
+        frames=len(analysis.onset_env),
+        bands=int(analysis.band_env.shape[0]),
+        bpm=cfg.bpm,
+        beat0=float(beat0),
+        tempo_map=None if tempo_map is None else tempo_map.to_dict(),
+        tempo_params=requested,
+    )
+
+
+def write_store(root: str, songs: Dict[str, Tuple[Dict, Dict[str, np.ndarray]]], *, generation: int) -> None:
+    """
+    Pack {song_id: (entry, {onset_env, band_env})} as a new generation and swap the index in.
+    Every song must have the same number of bands (ValueError before anything is written).
+    """
+    counts = {song_id: entry["bands"] for song_id, (entry, _) in songs.items()}
+    if len(set(counts.values())) > 1:
+        raise ValueError(f"songs have different band counts: {counts}")
+    os.makedirs(root, exist_ok=True)
+    total = sum(entry["frames"] for entry, _ in songs.values())
+    n_bands = next(iter(counts.values()), 3)
+
+    names = {name: f"{name}.{generation}.npy" for name in ARRAYS}
+    out = {
+        "onset_env": np.lib.format.open_memmap(
+            os.path.join(root, names["onset_env"]), mode="w+", dtype=ARRAYS["onset_env"], shape=(total,)
+        ),
+        "band_env": np.lib.format.open_memmap(
+            os.path.join(root, names["band_env"]), mode="w+", dtype=ARRAYS["band_env"], shape=(total, n_bands)
+        ),
+    }
+    index_songs = {}
+    start = 0
+    for song_id, (entry, arrays) in songs.items():
+        n = entry["frames"]
+        out["onset_env"][start:start + n] = arrays["onset_env"]
+        out["band_env"][start:start + n] = np.asarray(arrays["band_env"]).T
+        index_songs[song_id] = dict(entry, start=start)
+        start += n
+    for a in out.values():
+        a.flush()
+    del out
+
+    index = dict(format=STORE_FORMAT, version=STORE_VERSION, generation=generation, arrays=names, songs=index_songs)
+    fd, tmp = tempfile.mkstemp(dir=root, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(index, f, indent=1)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, os.path.join(root, INDEX_NAME))
+
+    # open readers keep their mappings and new ones use the new files; the previous generation
+    # stays for a reader that loaded the old index but hasn't mapped its arrays yet
+    for name in os.listdir(root):
+        parts = name.split(".")
+        if len(parts) == 3 and parts[0] in ARRAYS and parts[2] == "npy" and parts[1].isdigit():
+            if int(parts[1]) < generation - 1:
+                try:
+                    os.remove(os.path.join(root, name))
+                except OSError:  # still mapped on Windows; the next write retries
+                    pass
+
+
+def add_songs(
+    root: str,
+    jobs: Iterable[Dict],
+    *,
+    cache=None,
+    force: bool = False,
+    log=print,
+) -> Tuple[FeatureStore, List[str]]:
+    """
+    Analyze and add songs ({"id", "audio", "config"?, "stream"?, "decoder"?, "sr"?}),
+    skipping those already stored from the same file and settings unless force.
+    beat0 / tempo are resolved with the job's ChartConfig overrides. The store is
+    repacked once at the end. Returns (reopened store, ids that failed).
+    """
+    from analyze_song import ANALYSIS_VERSION, ChartConfig, analyze_audio, resolve_tempo
+
+    store = FeatureStore(root)
+    songs = {
+        song_id: (entry, {"onset_env": store.onset_env(song_id), "band_env": store.band_env(song_id)})
+        for song_id, entry in store.index["songs"].items()
+    }
+    added, failed = 0, []
+    for job in jobs:
+        song_id, audio = job["id"], job["audio"]
+        settings = dict(stream=bool(job.get("stream", False)), decoder=job.get("decoder", "librosa"),
+                        sr=job.get("sr"))
+        if not force and store.is_fresh(song_id, audio, **settings):
+            log(f"{song_id}: up to date")
+            continue
+        t0 = time.perf_counter()
+        try:
+            cfg = ChartConfig.from_dict(job.get("config") or {})
+            requested = tempo_params(cfg)
+            analysis = analyze_audio(audio, cache=cache, **settings)
+            # band_env is one (frames, bands) array, so every song needs the others' band count
+            others = {entry["bands"] for other, (entry, _) in songs.items() if other != song_id}
+            if others and analysis.band_env.shape[0] not in others:
+                raise ValueError(f"{analysis.band_env.shape[0]} onset bands, but the store's songs have {sorted(others)}")
+            cfg, beat0, tempo_map = resolve_tempo(analysis, cfg, cache=cache)
+        except (OSError, ValueError, TypeError) as e:  # a bad file or config doesn't sink the rest
+            failed.append(song_id)
+            log(f"{song_id}: {type(e).__name__}: {e}")
+            continue
+        entry = _song_entry(analysis, audio=audio, settings=dict(settings, version=ANALYSIS_VERSION),
+                            cfg=cfg, beat0=beat0, tempo_map=tempo_map, requested=requested)
+        songs[song_id] = (entry, {"onset_env": analysis.onset_env, "band_env": analysis.band_env})
+        added += 1
+        log(f"{song_id}: {entry['frames']} frames, bpm={cfg.bpm} beat0={beat0:.4f}s "
+            f"({time.perf_counter() - t0:.2f}s)")
+    if added:
+        write_store(root, songs, generation=store.index["generation"] + 1)
+    return FeatureStore(root), failed
+
+
+# -------------------------
+# CLI
+# -------------------------
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    a = sub.add_parser("add", help="analyze songs into the store")
+    a.add_argument("store")
+    a.add_argument("audio", nargs="*", help="audio files (id = file name without extension)")
+    a.add_argument("--manifest", help="batch_chart.py manifest: ids, audio and per-song config")
+    a.add_argument("--force", action="store_true", help="re-analyze songs that are up to date")
+    a.add_argument("--no-cache", action="store_true")
+    a.add_argument("--cache-dir", default=None, help="analysis cache (default: .analysis_cache)")
+
+    ls = sub.add_parser("list", help="songs in the store")
+    ls.add_argument("store")
+
+    sh = sub.add_parser("show", help="one song's entry and envelope stats over a time range")
+    sh.add_argument("store")
+    sh.add_argument("song")
+    sh.add_argument("--start", type=float)
+    sh.add_argument("--end", type=float)
+    args = ap.parse_args()
+
+    if args.cmd == "add":
+        from analysis_cache import DEFAULT_CACHE_DIR, AnalysisCache
+
+        jobs: List[Dict] = []
+        if args.manifest:
+            from batch_chart import load_jobs
+
+            jobs += [j for j in load_jobs(args.manifest) if j["generator"] == "analyze"]
+        jobs += [dict(id=os.path.splitext(os.path.basename(p))[0], audio=p) for p in args.audio]
+        if not jobs:
+            ap.error("nothing to add: give audio files or --manifest")
+        cache = None if args.no_cache else AnalysisCache(args.cache_dir or DEFAULT_CACHE_DIR)
+        store, failed = add_songs(args.store, jobs, cache=cache, force=args.force)
+        print(f"{len(store)} songs in {args.store}" + (f"; failed: {', '.join(failed)}" if failed else ""))
+        return 1 if failed else 0
+
+    t0 = time.perf_counter()
+    store = FeatureStore(args.store)
+    open_ms = (time.perf_counter() - t0) * 1e3
+    if args.cmd == "list":
+        print(f"{len(store)} songs (index opened in {open_ms:.1f} ms)")
+        for song_id in store.songs:
+            e = store.entry(song_id)
+            print(f"  {song_id:<20} {e['duration']:8.2f}s {e['frames']:>8} frames  bpm={e['bpm']:<8} "
+                  f"beat0={e['beat0']:.4f}  {e['audio']}")
+        return 0
+
+    e = store.entry(args.song)
+    env = store.onset_env(args.song, args.start, args.end)
+    bands = store.band_env(args.song, args.start, args.end)
+    print(json.dumps({k: v for k, v in e.items() if k != "tempo_map"}, indent=1))
+    print(f"frames {len(env)}: onset mean={float(np.mean(env)):.4f} max={float(np.max(env)):.4f}; "
+          f"band means {np.round(bands.mean(axis=1).astype(np.float64), 4).tolist()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
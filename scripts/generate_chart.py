@@ -1,51 +1,58 @@
+import argparse
+import heapq
 import json
-import random
-from dataclasses import dataclass
-from typing import List, Dict, Optional
+from typing import List, Dict, Tuple
+
+import numpy as np
+
+from chart_core import RandomChartConfig, stage_window
+from chart_core.notes import NoteArray
+from chart_core.validate import ChartRules, validate_file
+from chart_format import FORMATS, write_chart
+from lanes import NO_LANE, assign_lanes
 
 #constants
 HOLD_PROB = 0.12        # 12% of notes are holds
 HOLD_MIN_BEATS = 1.0   # minimum hold length
 HOLD_MAX_BEATS = 3.0   # maximum hold length
 
-@dataclass
-class Note:
-    hit: float
-    spawn: float
-    lane: int
-    stage: int
-    speed: float
-    type: str        # "tap" or "hold"
-    end: float       # end hit time (== hit for taps)
-
-def pick_lane(
-    rng: random.Random,
-    prev_lane: Optional[int],
-    *,
-    no_jacks: bool,
-    prefer_nearby: bool,
-    jumpiness: float,
-) -> int:
-    candidates = [0, 1, 2, 3]
-    if no_jacks and prev_lane is not None:
-        candidates = [l for l in candidates if l != prev_lane]
-
-    if prev_lane is None or not prefer_nearby:
-        return rng.choice(candidates)
 
-    weights = []
-    for l in candidates:
-        d = abs(l - prev_lane)
-        base = 1.0 / (1.0 + d)  # nearer lanes heavier
-        w = (1.0 - jumpiness) * base + jumpiness * 1.0  # blend with uniform
-        weights.append(w)
-
-    return rng.choices(candidates, weights=weights, k=1)[0]
+def forced_fill(placed: np.ndarray, n: int, every: int) -> np.ndarray:
+    """
+    Steps the max-gap rule forces: after each placement, every `every` steps
+    until the next placement (or step n). `placed` is sorted and starts at 0.
+    """
+    nxt = np.append(placed[1:], n)
+    count = np.maximum((nxt - placed - 1) // every, 0)  # forced steps strictly before the next placement
+    base = np.repeat(placed, count)
+    # j-th forced step after a placement: j = 1 .. count, from a cumulative counter reset per placement
+    j = np.arange(len(base)) - np.repeat(np.cumsum(count) - count, count) + 1
+    return base + j * every
+
+
+def cap_held_lanes(hit: np.ndarray, end: np.ndarray, is_hold: np.ndarray, max_held: int) -> np.ndarray:
+    """
+    is_hold with the holds that start while max_held holds are still running
+    turned into taps, so some lane is always free. Walks the holds only.
+    """
+    keep = is_hold.copy()
+    hit_list, end_list = hit.tolist(), end.tolist()
+    running: List[float] = []  # heap of the kept holds' ends
+    for k in np.flatnonzero(is_hold).tolist():
+        while running and running[0] <= hit_list[k]:
+            heapq.heappop(running)
+        if len(running) >= max_held:
+            keep[k] = False
+        else:
+            heapq.heappush(running, end_list[k])
+    return keep
 
 
 def generate_stage_notes(
-    rng: random.Random,
+    rng: np.random.Generator,
     *,
+    lane_rng: np.random.Generator,
+    n_lanes: int,
     bpm: float,
     offset: float,
     stage_index: int,
@@ -60,189 +67,168 @@ def generate_stage_notes(
     no_jacks: bool,
     prefer_nearby: bool,
     jumpiness: float,
-) -> List[Note]:
+) -> NoteArray:
+    """
+    One stage on the beat grid, all decisions drawn in batches:
+
+    - a grid step gets a note with probability `density`, and always once
+      max_gap_beats have passed since the last note (the first playable step
+      is always placed);
+    - a note is a hold with HOLD_PROB, lasting HOLD_MIN_BEATS..HOLD_MAX_BEATS
+      (clamped to the stage's hit window);
+    - a hold that would leave no lane free becomes a tap, so every note gets a
+      lane (assign_lanes' NO_LANE is still dropped, as a backstop).
+    """
     spb = 60.0 / bpm
+    travel_time = (hit_y - spawn_y) / speed
 
     start_beat = max(0.0, (hit_start - offset) / spb)
     end_beat = max(0.0, (hit_end - offset) / spb)
-
-    b = (start_beat // grid_beats) * grid_beats
-    if b < start_beat:
-        b += grid_beats
-
-    travel_time = (hit_y - spawn_y) / speed
-
-    notes: List[Note] = []
-    prev_lane: Optional[int] = None
-    gap_beats = max_gap_beats  # encourage early note
-
-    while b <= end_beat:
-        should_place = (rng.random() < density) or (gap_beats >= max_gap_beats)
-
-        if should_place:
-            lane = pick_lane(
-                rng, prev_lane,
-                no_jacks=no_jacks,
-                prefer_nearby=prefer_nearby,
-                jumpiness=jumpiness,
-            )
-
-            hit_t = offset + b * spb
-            spawn_t = hit_t - travel_time
-
-            if hit_start <= hit_t <= hit_end and spawn_t >= 0.0:
-                # Decide tap vs hold
-                is_hold = rng.random() < HOLD_PROB
-                hold_beats = rng.uniform(HOLD_MIN_BEATS, HOLD_MAX_BEATS) if is_hold else 0.0
-                end_hit_t = hit_t + hold_beats * spb
-
-                # Clamp hold end so it doesn't cross stage end
-                end_hit_t = min(end_hit_t, hit_end)
-
-                # Recompute spawn based on *start* hit
-                spawn_t = hit_t - travel_time
-
-                if hit_start <= hit_t <= hit_end and spawn_t >= 0.0:
-                    notes.append(Note(
-                        hit=hit_t,
-                        spawn=spawn_t,
-                        lane=lane,
-                        stage=stage_index,
-                        speed=speed,
-                        # NEW FIELDS
-                        type="hold" if is_hold and end_hit_t > hit_t else "tap",
-                        end=end_hit_t if is_hold and end_hit_t > hit_t else hit_t,
-                    ))
-                    prev_lane = lane
-                    gap_beats = 0.0
-
-                prev_lane = lane
-                gap_beats = 0.0
-            else:
-                gap_beats += grid_beats
-        else:
-            gap_beats += grid_beats
-
-        b += grid_beats
-
-    return notes
-
-
-def main():
-    rng = random.Random(42)
-
-    # --- Song constants ---
-    bpm = 75.0
-    duration_seconds = 231.0
-    offset = 0.20
-
-    # --- Match Phaser geometry ---
-    spawn_y = -60.0
-    hit_y = 600.0   # IMPORTANT: set this to your Phaser hitY for perfect visual sync
-
-    # --- Popup timing (must match your showStagePopup total on-screen time) ---
-    popup_seconds = 1.4
-
-    # --- Miss window in pixels in your Phaser code ---
-    miss_px = 60.0
-
-    # Raw conceptual stage boundaries (where popup triggers)
-    boundaries = [0.0, 35.0, 70.0, 105.0, 145.0, 190.0, 231.0]  # 6 stages
-
-    # Difficulty ramp per stage
-    params = [
-        dict(grid_beats=1.0,  density=0.70, max_gap_beats=2.0,  speed=320.0, jumpiness=0.05),
-        dict(grid_beats=0.5,  density=0.45, max_gap_beats=2.0,  speed=360.0, jumpiness=0.10),
-        dict(grid_beats=0.5,  density=0.55, max_gap_beats=1.5,  speed=400.0, jumpiness=0.18),
-        dict(grid_beats=0.5,  density=0.65, max_gap_beats=1.0,  speed=440.0, jumpiness=0.25),
-        dict(grid_beats=0.25, density=0.38, max_gap_beats=1.0,  speed=480.0, jumpiness=0.35),
-        dict(grid_beats=0.25, density=0.48, max_gap_beats=0.75, speed=520.0, jumpiness=0.45),
-    ]
-
-    all_notes: List[Note] = []
-
-    # Build per-stage HIT windows that guarantee:
-    # - no SPAWNS during popup
-    # - last note clears hit line before popup
-    for stage_idx in range(1, 7):
-        start_boundary = boundaries[stage_idx - 1]
-        end_boundary = boundaries[stage_idx]
-        p = params[stage_idx - 1]
-        speed = p["speed"]
-
-        travel_time = (hit_y - spawn_y) / speed
-        clear_time = miss_px / speed  # time after hit until it passes hitY+missPx
-
-        # Notes should STOP early enough that they're gone by popup start at end_boundary
-        hit_end = end_boundary - clear_time
-
-        # Notes should START late enough that their SPAWN occurs after popup ends.
-        # For stages after the first, popup happens at start_boundary.
-        if stage_idx == 1:
-            hit_start = start_boundary
-        else:
-            hit_start = start_boundary + popup_seconds + travel_time
-
-        # Also: avoid generating hits during the popup window after end_boundary (except last stage)
-        if stage_idx < 6:
-            # This isn't strictly necessary if you compute next stage start correctly,
-            # but it prevents edge cases near boundaries.
-            hit_end = min(hit_end, end_boundary - 0.01)
-
-        # Clamp to song duration
-        hit_start = max(0.0, hit_start)
-        hit_end = min(duration_seconds, hit_end)
-
-        if hit_end <= hit_start:
+    first = np.ceil(start_beat / grid_beats - 1e-9) * grid_beats
+    beats = first + np.arange(max(0, int(np.floor((end_beat - first) / grid_beats + 1e-9)) + 1)) * grid_beats
+    t = offset + beats * spb
+
+    # hit and spawn times grow with the step, so the playable steps are one contiguous run
+    u = rng.random(len(t))
+    playable = (t >= hit_start) & (t <= hit_end) & (t - travel_time >= 0.0)
+    t, u = t[playable], u[playable]
+
+    if len(t):
+        place = u < density
+        place[0] = True
+        placed = np.flatnonzero(place)
+        # the gap reaches max_gap_beats after ceil(max_gap / grid) empty steps; the next one is forced
+        every = int(np.ceil(max_gap_beats / grid_beats - 1e-9)) + 1
+        place[forced_fill(placed, len(t), every)] = True
+        hit = t[place]
+    else:
+        hit = np.zeros(0)
+
+    is_hold = rng.random(len(hit)) < HOLD_PROB
+    hold_beats = rng.uniform(HOLD_MIN_BEATS, HOLD_MAX_BEATS, len(hit))
+    end = np.where(is_hold, np.minimum(hit + hold_beats * spb, hit_end), hit)
+    is_hold &= end > hit
+    is_hold = cap_held_lanes(hit, end, is_hold, n_lanes - 1)
+    end = np.where(is_hold, end, hit)
+
+    lanes = assign_lanes(
+        hit, end, is_hold,
+        rng=lane_rng,
+        n_lanes=n_lanes,
+        jumpiness=jumpiness if prefer_nearby else 1.0,  # fully jumpy == uniform
+        no_jacks=no_jacks,
+    )
+    notes = NoteArray(
+        spawn=hit - travel_time,
+        hit=hit,
+        end=end,
+        lane=lanes,
+        stage=np.full(len(hit), stage_index),
+        speed=np.full(len(hit), float(speed)),
+        hold=is_hold,
+    )
+    # a note arriving while every lane is held has nowhere to go
+    return notes.take(lanes != NO_LANE)
+
+
+def build_random_chart(cfg: RandomChartConfig) -> Tuple[List[Dict], List[Dict]]:
+    """Generate every stage on the fixed BPM grid. Returns (chart rows, per-stage stats)."""
+    # independent streams for placement/holds and lanes, both from the seed
+    rng, lane_rng = [np.random.default_rng(s) for s in np.random.SeedSequence(cfg.seed).spawn(2)]
+    stages: List[NoteArray] = []
+    stats: List[Dict] = []
+
+    # Per-stage HIT windows guarantee no SPAWNS during a popup and that the
+    # last note clears the hit line before the next one
+    for stage_idx in range(1, cfg.n_stages + 1):
+        p = cfg.params[stage_idx - 1]
+        win = stage_window(
+            cfg.boundaries,
+            stage_idx,
+            speed=p["speed"],
+            spawn_y=cfg.spawn_y,
+            hit_y=cfg.hit_y,
+            popup_seconds=cfg.popup_seconds,
+            miss_px=cfg.miss_px,
+            duration=cfg.duration_seconds,
+            end_guard=0.01,  # prevents edge cases near boundaries
+        )
+        if not win.playable:
             raise ValueError(
                 f"Stage {stage_idx} has no playable time.\n"
                 f"Try reducing popup_seconds or miss_px, or lowering speed.\n"
-                f"(hit_start={hit_start:.3f}, hit_end={hit_end:.3f})"
+                f"(hit_start={win.hit_start:.3f}, hit_end={win.hit_end:.3f})"
             )
 
         notes = generate_stage_notes(
             rng,
-            bpm=bpm,
-            offset=offset,
+            lane_rng=lane_rng,
+            n_lanes=cfg.lanes,
+            bpm=cfg.bpm,
+            offset=cfg.offset,
             stage_index=stage_idx,
-            hit_start=hit_start,
-            hit_end=hit_end,
+            hit_start=win.hit_start,
+            hit_end=win.hit_end,
             grid_beats=p["grid_beats"],
             density=p["density"],
             max_gap_beats=p["max_gap_beats"],
-            speed=speed,
-            spawn_y=spawn_y,
-            hit_y=hit_y,
+            speed=win.speed,
+            spawn_y=cfg.spawn_y,
+            hit_y=cfg.hit_y,
             no_jacks=True,
             prefer_nearby=True,
             jumpiness=p["jumpiness"],
         )
-        all_notes.extend(notes)
+        stages.append(notes)
 
-        print(
-            f"Stage {stage_idx}: hits in [{hit_start:.2f}, {hit_end:.2f}] "
-            f"(speed={speed:.0f}px/s, travel={travel_time:.2f}s, clear={clear_time:.2f}s)"
-        )
+        stats.append(dict(
+            stage=stage_idx,
+            hit_start=win.hit_start,
+            hit_end=win.hit_end,
+            speed=win.speed,
+            travel=win.travel,
+            clear=win.clear,
+            notes=len(notes),
+            holds=int(np.count_nonzero(notes.hold)),
+        ))
+
+    out = NoteArray.concat(stages).sorted_by_spawn().to_rows()
+    return out, stats
 
-    all_notes.sort(key=lambda n: n.spawn)
-
-    out = [
-        {
-            "spawn": round(n.spawn, 4),
-            "hit": round(n.hit, 4),
-            "end": round(n.end, 4),
-            "lane": n.lane,
-            "stage": n.stage,
-            "speed": round(n.speed, 2),
-            "type": n.type,
-        }
-        for n in all_notes
-    ]
-
-    with open("chart.json", "w") as f:
-        json.dump(out, f, indent=2)
-
-    print(f"\nWrote {len(out)} notes to chart.json")
+
+def format_stage_stats(st: Dict) -> str:
+    return (
+        f"Stage {st['stage']}: hits in [{st['hit_start']:.2f}, {st['hit_end']:.2f}] "
+        f"(speed={st['speed']:.0f}px/s, travel={st['travel']:.2f}s, clear={st['clear']:.2f}s)"
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Generate a random fixed-BPM chart (no audio analysis).")
+    ap.add_argument("--out", default="chart.json")
+    ap.add_argument("--format", choices=FORMATS, default="json", help="row JSON, minified columnar JSON or binary")
+    ap.add_argument("--compress", action="store_true", help="also write .gz/.br sidecars")
+    ap.add_argument("--params", help="JSON file overriding RandomChartConfig fields (bpm, boundaries, params, ...)")
+    ap.add_argument("--no-validate", action="store_true", help="skip the post-write chart check (validate_chart.py)")
+    args = ap.parse_args()
+
+    cfg = RandomChartConfig()
+    if args.params:
+        with open(args.params) as f:
+            cfg = RandomChartConfig.from_dict(json.load(f))
+
+    out, stats = build_random_chart(cfg)
+    for st in stats:
+        print(format_stage_stats(st))
+
+    write_chart(out, args.out, args.format, compress=args.compress)
+
+    print(f"\nWrote {len(out)} notes to {args.out}")
+    if not args.no_validate:
+        report = validate_file(args.out, ChartRules.from_config(cfg))
+        if not report.ok:
+            print(f"{args.out}: {report.format()}")
+            raise SystemExit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,201 @@
+"""
+Lane assignment shared by both chart generators.
+
+Every note picks a lane from the lanes that aren't held at its hit time,
+weighting them by distance from the previous lane and blending towards
+uniform by jumpiness (the old pick_lane weights):
+
+    w(d) = (1 - jumpiness) / (1 + d) + jumpiness
+
+With no previous lane, or a held previous lane, the pick is uniform. With
+no_jacks the previous lane is excluded unless it is the only one left. A
+note that arrives while every lane is held gets NO_LANE (-1) and leaves the
+previous lane as it was; the generators drop those notes, since any lane
+would put it inside a hold.
+
+lane_table() precomputes those choices as cumulative distributions indexed
+by (previous lane, busy mask), where previous lane == n_lanes means "none"
+and bit l of the mask means lane l is held. assign_lanes() draws one uniform
+per note from a NumPy Generator, so a seed fixes the pattern. The busy mask
+only changes at a hold start or a hold end, so between those the notes form
+a run: each note is a map previous lane -> lane (one table lookup per state),
+and a long run is resolved by composing the maps with a log-depth scan
+instead of a Python loop per note. Short runs (frequent holds) are cheaper
+to walk with one bisect per note.
+
+With bands (one onset band index per note, scripts/onset_bands.py) and
+band_bias > 0, every weight is also scaled by band_preference(), which maps
+the bands onto the board from left (low) to right (high); each note then
+looks up the table of its own band. The uniform draws are the same, so
+band_bias=0 gives exactly the unbiased lanes.
+
+    lanes = assign_lanes(hit, end, is_hold, rng=np.random.default_rng(7), n_lanes=5, jumpiness=0.2)
+"""
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from chart_core.config import check_lane_count
+
+SHORT_RUN = 24  # below this a run is cheaper to walk note by note than to scan
+NO_LANE = -1    # every lane is held at the note's hit time
+
+
+def band_preference(n_lanes: int, n_bands: int, band: int, bias: float) -> Tuple[float, ...]:
+    """
+    Per-lane weight for a note in `band`: lanes are spread over the bands
+    (band 0 on the left) and weighted by closeness to `band`, blended with
+    1.0 by (1 - bias).
+    """
+    pos = (np.arange(n_lanes) + 0.5) / n_lanes * n_bands - 0.5
+    near = np.maximum(0.0, 1.0 - np.abs(pos - band))
+    return tuple(round(float(p), 6) for p in (1.0 - bias) + bias * near)
+
+
+@lru_cache(maxsize=64)
+def lane_table(
+    n_lanes: int,
+    jumpiness: float,
+    no_jacks: bool = False,
+    prefer: Optional[Tuple[float, ...]] = None,
+) -> np.ndarray:
+    """
+    Cumulative lane probabilities, shape (n_lanes + 1, 2**n_lanes, n_lanes).
+    `prefer` scales each lane's weight (ignored where it would rule out every allowed lane).
+    """
+    check_lane_count(n_lanes)
+    lanes = np.arange(n_lanes)
+    n_masks = 1 << n_lanes
+    cdf = np.empty((n_lanes + 1, n_masks, n_lanes))
+    for mask in range(n_masks):
+        allowed = ((mask >> lanes) & 1) == 0
+        if not allowed.any():
+            allowed = np.ones(n_lanes, dtype=bool)  # never looked up: assign_lanes gives these notes NO_LANE
+        for prev in range(n_lanes + 1):
+            ok = allowed.copy()
+            if prev == n_lanes or not allowed[prev]:
+                w = ok.astype(float)
+            else:
+                if no_jacks and ok.sum() > 1:
+                    ok[prev] = False
+                d = np.abs(lanes - prev)
+                w = np.where(ok, (1.0 - jumpiness) / (1.0 + d) + jumpiness, 0.0)
+            if prefer is not None and np.any(w * prefer > 0):
+                w = w * prefer
+            c = np.cumsum(w)
+            cdf[prev, mask] = c / c[-1]
+    cdf[..., -1] = 1.0
+    cdf.setflags(write=False)
+    return cdf
+
+
+@lru_cache(maxsize=64)
+def _table_rows(
+    n_lanes: int, jumpiness: float, no_jacks: bool, prefer: Optional[Tuple[float, ...]] = None
+) -> List[List[List[float]]]:
+    """lane_table as nested lists, for bisecting one note at a time."""
+    return lane_table(n_lanes, jumpiness, no_jacks, prefer).tolist()
+
+
+def _run_lanes(cdf_mask: np.ndarray, u: np.ndarray, state: int) -> np.ndarray:
+    """
+    Lanes for one run under a fixed busy mask, starting from previous-lane state.
+    cdf_mask is one table (states, lanes) for every note, or one per note (notes, states, lanes).
+    """
+    if cdf_mask.ndim == 2:
+        cdf_mask = cdf_mask[None, :, :]
+    # maps[k, s]: the lane note k picks when the previous lane (state) was s
+    maps = (cdf_mask <= u[:, None, None]).sum(axis=2)
+    # inclusive scan: maps[k] becomes maps[k] o maps[k-1] o ... o maps[0]
+    step = 1
+    while step < len(maps):
+        maps[step:] = np.take_along_axis(maps[step:], maps[:-step], axis=1)
+        step *= 2
+    return maps[:, state]
+
+
+def assign_lanes(
+    hit: np.ndarray,
+    end: np.ndarray,
+    is_hold: np.ndarray,
+    *,
+    rng: np.random.Generator,
+    n_lanes: int = 4,
+    jumpiness: float = 0.2,
+    no_jacks: bool = False,
+    prev_lane: Optional[int] = None,
+    bands: Optional[np.ndarray] = None,
+    band_bias: float = 0.0,
+    n_bands: int = 3,
+) -> np.ndarray:
+    """
+    Lane per note (notes sorted by hit), NO_LANE where every lane is held. A hold
+    keeps its lane busy until its end.
+    bands / band_bias: per-note onset band (0 .. n_bands - 1) and how strongly it steers the lane.
+    """
+    n = len(hit)
+    out = np.empty(n, dtype=np.int64)
+    if n == 0:
+        return out
+    jumpiness, no_jacks = float(jumpiness), bool(no_jacks)
+    if bands is None or band_bias <= 0.0:
+        cdf = lane_table(n_lanes, jumpiness, no_jacks)
+        rows = _table_rows(n_lanes, jumpiness, no_jacks)
+        band_list = None
+    else:
+        prefs = [band_preference(n_lanes, n_bands, b, float(band_bias)) for b in range(n_bands)]
+        cdfs = np.stack([lane_table(n_lanes, jumpiness, no_jacks, p) for p in prefs])
+        band_rows = [_table_rows(n_lanes, jumpiness, no_jacks, p) for p in prefs]
+        bands = np.clip(np.asarray(bands, dtype=np.int64), 0, n_bands - 1)
+        band_list = bands.tolist()
+    u = rng.random(n)
+    u_list = u.tolist()
+    hit_list = np.asarray(hit, dtype=np.float64).tolist()
+    end_list = np.asarray(end, dtype=np.float64).tolist()
+    hold = np.asarray(is_hold, dtype=bool)
+    # next_hold[i]: index of the first hold at or after note i (n if none)
+    idx = np.where(hold, np.arange(n), n)
+    next_hold = np.minimum.accumulate(idx[::-1])[::-1].tolist()
+    busy_until = [0.0] * n_lanes
+    state = n_lanes if prev_lane is None else int(prev_lane)
+    all_busy = (1 << n_lanes) - 1
+
+    i = 0
+    while i < n:
+        t = hit_list[i]
+        mask = 0
+        expiry = float("inf")
+        for lane, b in enumerate(busy_until):
+            if b > t:
+                mask |= 1 << lane
+                expiry = min(expiry, b)
+        # the run ends after the next hold starts, or before the first note at which a held lane frees up
+        stop = min(next_hold[i] + 1, n)
+        if mask:
+            stop = min(stop, bisect_left(hit_list, expiry, i + 1))
+        stop = max(stop, i + 1)
+
+        if mask == all_busy:
+            out[i:stop] = NO_LANE
+            i = stop
+            continue
+        if band_list is None and stop - i > SHORT_RUN:
+            out[i:stop] = _run_lanes(cdf[:, mask], u[i:stop], state)
+            state = int(out[stop - 1])
+        elif band_list is None:
+            for k in range(i, stop):
+                state = bisect_right(rows[state][mask], u_list[k])
+                out[k] = state
+        elif stop - i > SHORT_RUN:
+            out[i:stop] = _run_lanes(cdfs[bands[i:stop], :, mask], u[i:stop], state)
+            state = int(out[stop - 1])
+        else:
+            for k in range(i, stop):
+                state = bisect_right(band_rows[band_list[k]][state][mask], u_list[k])
+                out[k] = state
+        if hold[stop - 1]:
+            busy_until[state] = max(busy_until[state], end_list[stop - 1])
+        i = stop
+    return out
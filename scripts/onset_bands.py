@@ -0,0 +1,67 @@
+"""
+Band-split onset envelopes from the same mel pass as the broadband one.
+
+librosa's onset strength is the mean over mel bins of the positive dB flux.
+Averaging contiguous slices of those bins instead gives one envelope per
+frequency band (low = kick, mid = snare/voice, high = hats/cymbals) for the
+cost of a few extra means. onset_envelopes() returns the broadband envelope
+(identical to librosa.onset.onset_strength) plus the bands from a single
+onset_strength_multi call.
+
+Band envelopes are scaled by their own 95th percentile, so "which band
+fired" compares each band against its usual level rather than the raw
+loudness (where a kick would drown the hats).
+"""
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+BAND_EDGES_HZ = (200.0, 2500.0)
+BAND_NAMES = ("low", "mid", "high")
+N_MELS = 128
+
+
+def mel_band_slices(sr: int, edges_hz: Sequence[float] = BAND_EDGES_HZ, n_mels: int = N_MELS) -> List[slice]:
+    """Mel-bin slices splitting [0, sr/2] at edges_hz (bins assigned by center frequency)."""
+    import librosa
+
+    centers = librosa.mel_frequencies(n_mels=n_mels + 2, fmax=sr / 2.0)[1:-1]
+    cuts = [0] + [int(np.searchsorted(centers, e)) for e in edges_hz] + [n_mels]
+    return [slice(lo, hi) for lo, hi in zip(cuts[:-1], cuts[1:])]
+
+
+def normalize_bands(band_env: np.ndarray, q: float = 95.0) -> np.ndarray:
+    """Scale each band (row) to its q-th percentile, as float32."""
+    band_env = np.maximum(np.asarray(band_env, dtype=np.float32), 0.0)
+    level = np.percentile(band_env, q, axis=1, keepdims=True)
+    return band_env / np.maximum(level, 1e-9)
+
+
+def onset_envelopes(
+    y: np.ndarray,
+    *,
+    sr: int,
+    n_fft: int = 2048,
+    hop_length: int = 512,
+    edges_hz: Sequence[float] = BAND_EDGES_HZ,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """(broadband onset envelope, (n_bands, frames) band envelopes) from one STFT/mel pass."""
+    import librosa
+
+    channels = [slice(0, N_MELS)] + mel_band_slices(sr, edges_hz)
+    envs = librosa.onset.onset_strength_multi(
+        y=y, sr=sr, n_fft=n_fft, hop_length=hop_length, n_mels=N_MELS, channels=channels
+    )
+    return envs[0], envs[1:]
+
+
+def band_strength(band_env: np.ndarray, frame_times: np.ndarray, t: np.ndarray) -> np.ndarray:
+    """(n_bands, len(t)) band envelopes interpolated at times t."""
+    return np.stack([np.interp(t, frame_times, band) for band in band_env])
+
+
+def dominant_band(band_env: np.ndarray, frame_times: np.ndarray, t: np.ndarray) -> np.ndarray:
+    """Index of the strongest (normalized) band at each time in t."""
+    if len(t) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.argmax(band_strength(band_env, frame_times, t), axis=0)
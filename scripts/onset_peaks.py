@@ -0,0 +1,160 @@
+"""
+Tolerance-window onset envelopes for candidate scoring, and a placement metric.
+
+Point-sampling the onset envelope at a grid time scores a transient that lands
+a few milliseconds off the grid close to zero. sliding_max() replaces every
+frame by the maximum within +-radius frames (van Herk / Gil-Werman: a prefix
+and a suffix running max over blocks of the window width), so a grid time
+picks up any transient within the tolerance. Three passes over the envelope,
+whatever the window width; the result is built once per song and shared by
+every stage and subdivision (see analyze_song.scoring_envelopes).
+
+placement_metrics() measures how well a chart's hits sit on the song's strong
+onsets (local maxima of the envelope above a percentile):
+
+    precision   share of hits within --tol-ms of a strong onset
+    recall      share of strong onsets (between the first and last hit) with a hit within --tol-ms
+    strength    mean point-sampled onset strength at the hits
+
+Comparing score windows on real songs:
+
+    python scripts/onset_peaks.py song.mp3 --window-ms 0 25 50 --params params.json --json peaks.json
+"""
+import argparse
+import json
+import time
+from dataclasses import replace
+from typing import Dict, Optional
+
+import numpy as np
+
+from analysis_cache import DEFAULT_CACHE_DIR, AnalysisCache
+
+
+def sliding_max(x: np.ndarray, radius: int) -> np.ndarray:
+    """max(x[..., i - radius : i + radius + 1]) at every i along the last axis, O(n) for any radius."""
+    x = np.asarray(x)
+    if radius <= 0 or x.shape[-1] == 0:
+        return x.copy()
+    if not np.issubdtype(x.dtype, np.floating):
+        x = x.astype(np.float64)
+    n, w = x.shape[-1], 2 * radius + 1
+    # pad with -inf so windows near the ends see only real frames, and to a whole number of blocks
+    tail = radius + (-(n + 2 * radius)) % w
+    pad = [(0, 0)] * (x.ndim - 1) + [(radius, tail)]
+    p = np.pad(x, pad, constant_values=-np.inf)
+    blocks = p.reshape(*p.shape[:-1], -1, w)
+    prefix = np.maximum.accumulate(blocks, axis=-1).reshape(p.shape)
+    suffix = np.flip(np.maximum.accumulate(np.flip(blocks, -1), axis=-1), -1).reshape(p.shape)
+    # the window p[i : i + w] spans at most two blocks: the tail of i's block and the head of (i + w - 1)'s
+    return np.maximum(suffix[..., :n], prefix[..., w - 1:w - 1 + n])
+
+
+def frame_seconds(frame_times: np.ndarray) -> float:
+    return float(frame_times[1] - frame_times[0]) if len(frame_times) > 1 else 1.0
+
+
+def window_radius(window_s: float, frame_times: np.ndarray) -> int:
+    """Frames on each side covering +-window_s."""
+    return max(0, int(round(window_s / frame_seconds(frame_times))))
+
+
+def peak_envelope(env: np.ndarray, frame_times: np.ndarray, window_s: float) -> np.ndarray:
+    """Envelope(s) max-filtered over +-window_s along the frame axis."""
+    return sliding_max(env, window_radius(window_s, frame_times))
+
+
+def strong_onsets(
+    env: np.ndarray, frame_times: np.ndarray, *, percentile: float = 90.0, separation_s: float = 0.05
+) -> np.ndarray:
+    """Times of local envelope maxima (within +-separation_s) at or above the given percentile."""
+    if len(env) == 0:
+        return np.zeros(0)
+    is_peak = (env >= peak_envelope(env, frame_times, separation_s)) & (env >= np.percentile(env, percentile))
+    # flat tops count once
+    is_peak[1:] &= env[1:] != env[:-1]
+    return frame_times[is_peak]
+
+
+def nearest_distance(t: np.ndarray, ref: np.ndarray) -> np.ndarray:
+    """|t - nearest ref| for each t (ref sorted)."""
+    if len(ref) == 0:
+        return np.full(len(t), np.inf)
+    i = np.searchsorted(ref, t)
+    lo, hi = ref[np.maximum(i - 1, 0)], ref[np.minimum(i, len(ref) - 1)]
+    return np.minimum(np.abs(t - lo), np.abs(t - hi))
+
+
+def placement_metrics(
+    hits: np.ndarray,
+    env: np.ndarray,
+    frame_times: np.ndarray,
+    *,
+    tol_s: float = 0.05,
+    percentile: float = 90.0,
+) -> Dict:
+    hits = np.sort(np.asarray(hits, dtype=np.float64))
+    onsets = strong_onsets(env, frame_times, percentile=percentile)
+    if len(hits) == 0:
+        return dict(notes=0, onsets=len(onsets), precision=0.0, recall=0.0, strength=0.0)
+    in_span = onsets[(onsets >= hits[0] - tol_s) & (onsets <= hits[-1] + tol_s)]
+    return dict(
+        notes=len(hits),
+        onsets=len(in_span),
+        precision=float(np.mean(nearest_distance(hits, onsets) <= tol_s)),
+        recall=float(np.mean(nearest_distance(in_span, hits) <= tol_s)) if len(in_span) else 0.0,
+        strength=float(np.mean(np.interp(hits, frame_times, env))),
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("audio", nargs="+", help="songs to chart")
+    ap.add_argument("--window-ms", type=float, nargs="+", default=[0.0, 25.0, 50.0], help="score windows (+- ms) to compare")
+    ap.add_argument("--params", help="ChartConfig overrides (score_window_s is set per run)")
+    ap.add_argument("--tol-ms", type=float, default=50.0, help="a hit counts as on an onset within this distance")
+    ap.add_argument("--percentile", type=float, default=90.0, help="strong onsets are peaks at or above this percentile")
+    ap.add_argument("--no-cache", action="store_true")
+    ap.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    ap.add_argument("--json", help="write the results here")
+    args = ap.parse_args()
+
+    from analyze_song import ChartConfig, analyze_audio, build_chart, resolve_tempo
+
+    cfg = ChartConfig()
+    if args.params:
+        with open(args.params) as f:
+            cfg = ChartConfig.from_dict(json.load(f))
+    cache: Optional[AnalysisCache] = None if args.no_cache else AnalysisCache(args.cache_dir)
+
+    results = {}
+    for path in args.audio:
+        analysis = analyze_audio(path, cache=cache)
+        base, beat0, tempo_map = resolve_tempo(analysis, cfg)
+        rows_out = []
+        for ms in args.window_ms:
+            run = replace(base, score_window_s=ms / 1e3)
+            t0 = time.perf_counter()
+            rows, _ = build_chart(analysis, run, beat0=beat0, tempo_map=tempo_map)
+            chart_s = time.perf_counter() - t0
+            m = placement_metrics(
+                np.array([r["hit"] for r in rows]), analysis.onset_env, analysis.onset_times_env,
+                tol_s=args.tol_ms / 1e3, percentile=args.percentile,
+            )
+            rows_out.append(dict(window_ms=ms, chart_seconds=round(chart_s, 4), **m))
+        results[path] = rows_out
+        print(path)
+        print(f"  {'window':>8} {'notes':>6} {'precision':>9} {'recall':>7} {'strength':>8} {'chart':>8}")
+        for r in rows_out:
+            print(
+                f"  {r['window_ms']:>6.0f}ms {r['notes']:>6} {r['precision']:>9.3f} {r['recall']:>7.3f} "
+                f"{r['strength']:>8.3f} {r['chart_seconds'] * 1e3:>6.0f}ms"
+            )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Wall-clock phase timing for the chart scripts (analyze_song.py --profile).
+
+    timer = PhaseTimer()
+    with timer.phase("decode") as info:
+        y, sr = librosa.load(path)
+        info["samples"] = len(y)
+    with timer.phase("select", stage=3) as info:
+        ...
+    report = timer.report()
+
+Every phase records perf_counter seconds and the process peak RSS when it
+finished; whatever the block puts in `info` (array sizes, counts) is kept
+alongside. A disabled timer (PhaseTimer(enabled=False)) costs one dict per
+phase, so library code can take an optional timer without branching.
+"""
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return rss / (1024.0 * 1024.0) if sys.platform == "darwin" else rss / 1024.0
+
+
+def format_rss(mb: Optional[float]) -> str:
+    """Whole megabytes, or "-" where the platform has no peak RSS."""
+    return "-" if mb is None else f"{mb:.0f}"
+
+
+class PhaseTimer:
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.records: List[Dict] = []
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str, **info) -> Iterator[Dict]:
+        if not self.enabled:
+            yield info
+            return
+        t0 = time.perf_counter()
+        try:
+            yield info
+        finally:
+            self.records.append(dict(
+                name=name,
+                seconds=round(time.perf_counter() - t0, 6),
+                peak_rss_mb=peak_rss_mb(),
+                **info,
+            ))
+
+    def totals(self) -> Dict[str, float]:
+        """Seconds per phase name, summed over stages."""
+        out: Dict[str, float] = {}
+        for r in self.records:
+            out[r["name"]] = round(out.get(r["name"], 0.0) + r["seconds"], 6)
+        return out
+
+    def report(self) -> Dict:
+        return dict(
+            total_seconds=round(time.perf_counter() - self._start, 6),
+            peak_rss_mb=peak_rss_mb(),
+            totals=self.totals(),
+            phases=self.records,
+        )
+
+    def format(self) -> str:
+        width = max([len("phase")] + [len(r["name"]) + 4 for r in self.records])
+        lines = [f"{'phase':<{width}} {'seconds':>9} {'rss MB':>8}"]
+        for r in self.records:
+            label = f"{r['name']} s{r['stage']}" if "stage" in r else r["name"]
+            lines.append(f"{label:<{width}} {r['seconds']:>9.4f} {format_rss(r['peak_rss_mb']):>8}")
+        return "\n".join(lines)
@@ -0,0 +1,186 @@
+"""
+Bounded-memory onset envelope for long audio.
+
+Reproduces librosa.onset.onset_strength(y=y, sr=sr) (mel flux, center=True,
+top_db=80, lag=1) without ever holding the decoded track in memory:
+
+1. decode with soundfile in blocks, emulating stft's center zero-padding, and
+   compute mel power -> dB one block of frames at a time;
+2. spill the dB frames to a temporary float32 memmap while tracking the global
+   max (top_db clipping needs it before any flux can be computed);
+3. reread the memmap in blocks to clip, difference and average into the envelope.
+
+stream_onset_multi() averages slices of mel bins separately (like
+librosa.onset.onset_strength_multi), e.g. the band split of onset_bands.py.
+
+RAM use is set by block_frames, not by track length (the spill file and the
+1-float-per-hop envelope are the only length-dependent parts).
+
+    python scripts/stream_onset.py song.mp3 --check
+"""
+import argparse
+import os
+import tempfile
+import time
+from typing import Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+import librosa
+import soundfile as sf
+
+from phase_timer import format_rss, peak_rss_mb
+
+TOP_DB = 80.0
+TOLERANCE = 1e-4  # max abs difference from the in-memory envelope, both normalized to max 1
+
+
+def iter_centered_frames(
+    path: str,
+    *,
+    n_fft: int = 2048,
+    hop_length: int = 512,
+    block_frames: int = 2048,
+) -> Iterator[np.ndarray]:
+    """
+    Yield mono sample segments, each covering a whole number of STFT frames of the
+    center=True (zero-padded) signal, overlapping by n_fft - hop_length samples.
+    """
+    info = sf.info(path)
+    n_frames = 1 + info.frames // hop_length
+    pad = n_fft // 2
+    seg_len = (block_frames - 1) * hop_length + n_fft
+
+    buf = np.zeros(pad, dtype=np.float32)
+    done = 0
+    read_size = block_frames * hop_length
+    with sf.SoundFile(path) as f:
+        while done < n_frames:
+            chunk = f.read(read_size, dtype="float32", always_2d=True)
+            eof = len(chunk) < read_size
+            if len(chunk):
+                buf = np.concatenate([buf, np.mean(chunk.T, axis=0)])
+            if eof:
+                buf = np.concatenate([buf, np.zeros(pad, dtype=np.float32)])
+
+            while done < n_frames and (len(buf) >= seg_len or (eof and len(buf) >= n_fft)):
+                k = min(block_frames, 1 + (len(buf) - n_fft) // hop_length, n_frames - done)
+                yield buf[: (k - 1) * hop_length + n_fft]
+                buf = buf[k * hop_length:]
+                done += k
+
+            if eof:
+                break
+
+
+def stream_onset_strength(
+    path: str,
+    *,
+    n_fft: int = 2048,
+    hop_length: int = 512,
+    n_mels: int = 128,
+    block_frames: int = 2048,
+    spill_dir: str = None,
+) -> Tuple[np.ndarray, int, float]:
+    """Returns (onset_env, sr, duration) matching librosa.onset.onset_strength on the full track."""
+    envs, sr, duration = stream_onset_multi(
+        path, n_fft=n_fft, hop_length=hop_length, n_mels=n_mels, block_frames=block_frames, spill_dir=spill_dir
+    )
+    return envs[0], sr, duration
+
+
+def stream_onset_multi(
+    path: str,
+    *,
+    channels: Optional[Sequence[slice]] = None,
+    n_fft: int = 2048,
+    hop_length: int = 512,
+    n_mels: int = 128,
+    block_frames: int = 2048,
+    spill_dir: str = None,
+) -> Tuple[np.ndarray, int, float]:
+    """
+    Returns ((len(channels), frames) envelopes, sr, duration), each channel the mean
+    flux over its slice of mel bins (channels=None: one broadband channel).
+    """
+    channels = [slice(None)] if channels is None else list(channels)
+    info = sf.info(path)
+    sr = info.samplerate
+    n_frames = 1 + info.frames // hop_length
+    duration = info.frames / sr
+
+    with tempfile.TemporaryDirectory(dir=spill_dir) as tmp:
+        log_mel = np.memmap(os.path.join(tmp, "logmel.f32"), dtype=np.float32, mode="w+", shape=(n_frames, n_mels))
+
+        # Pass 1: decode -> stft -> mel dB, spilled to disk
+        peak = -np.inf
+        f0 = 0
+        for seg in iter_centered_frames(path, n_fft=n_fft, hop_length=hop_length, block_frames=block_frames):
+            power = np.abs(librosa.stft(seg, n_fft=n_fft, hop_length=hop_length, center=False)) ** 2
+            mel = librosa.feature.melspectrogram(S=power, sr=sr, n_fft=n_fft, n_mels=n_mels, fmax=0.5 * sr)
+            db = librosa.power_to_db(mel, top_db=None)
+            log_mel[f0:f0 + db.shape[1]] = db.T
+            peak = max(peak, float(db.max()))
+            f0 += db.shape[1]
+        log_mel.flush()
+
+        # Pass 2: top_db clip + first-order flux, mean over each channel's mel bands
+        floor = np.float32(peak - TOP_DB)
+        flux = np.zeros((len(channels), max(n_frames - 1, 0)), dtype=np.float32)
+        prev = None
+        for b0 in range(0, n_frames, block_frames):
+            block = np.maximum(log_mel[b0:b0 + block_frames], floor)
+            if prev is not None:
+                block = np.concatenate([prev, block])
+                start = b0 - 1
+            else:
+                start = b0
+            diff = np.maximum(0.0, block[1:] - block[:-1])
+            for c, sl in enumerate(channels):
+                flux[c, start:start + len(diff)] = np.mean(diff[:, sl], axis=1)
+            prev = block[-1:]
+        del log_mel
+
+    # onset_strength pads lag + n_fft // (2 * hop) leading zeros and trims to n_frames
+    lead = 1 + n_fft // (2 * hop_length)
+    envs = np.concatenate([np.zeros((len(channels), lead), dtype=np.float32), flux], axis=1)[:, :n_frames]
+    return envs, sr, duration
+
+
+def envelope_error(env: np.ndarray, ref: np.ndarray) -> float:
+    """Max abs difference of two envelopes, each normalized to a peak of 1."""
+    if env.shape != ref.shape:
+        raise ValueError(f"shape mismatch: streamed {env.shape} vs in-memory {ref.shape}")
+    return float(np.max(np.abs(env / np.max(env) - ref / np.max(ref))))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("audio")
+    ap.add_argument("--block-frames", type=int, default=2048)
+    ap.add_argument("--check", action="store_true", help="compare against the in-memory librosa path")
+    ap.add_argument("--tol", type=float, default=TOLERANCE, help="max abs error allowed on the normalized envelope")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    env, sr, duration = stream_onset_strength(args.audio, block_frames=args.block_frames)
+    t_stream = time.perf_counter() - t0
+    print(f"streamed: frames={len(env)} sr={sr} duration={duration:.2f}s "
+          f"time={t_stream:.2f}s peak_rss={format_rss(peak_rss_mb())}MB")
+
+    if args.check:
+        t0 = time.perf_counter()
+        y, sr_ref = librosa.load(args.audio, sr=None, mono=True)
+        ref = librosa.onset.onset_strength(y=y, sr=sr_ref)
+        t_full = time.perf_counter() - t0
+        try:
+            err = envelope_error(env, ref)
+        except ValueError as e:
+            raise SystemExit(str(e))
+        print(f"in-memory: time={t_full:.2f}s peak_rss={format_rss(peak_rss_mb())}MB")
+        print(f"max abs error (normalized) = {err:.2e} (tol {args.tol:.0e})")
+        if err > args.tol:
+            raise SystemExit("streamed envelope is outside tolerance")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,518 @@
+"""
+BPM and piecewise tempo-map estimation from the onset envelope.
+
+Everything works on the (cached) onset_strength envelope, so it costs a few
+FFTs over ~100 frames/s instead of another pass over the audio:
+
+- estimate_bpm: autocorrelation of the envelope, scored as a comb over the
+  first few multiples of each candidate beat period and weighted by a
+  log-normal tempo prior (octave errors are the usual failure mode; narrow
+  bpm_range when you know the ballpark). The winning period is refined to
+  sub-frame precision from the parabolic peaks of all its multiples.
+- estimate_tempo_map: the same estimate over sliding windows, restricted to a
+  few percent around the global tempo, split into constant-tempo segments
+  wherever the (median-smoothed) local tempo moves by more than split_tol.
+
+- track_phase / fit_time_warp: the local phase of the onsets against the
+  grid, in sliding windows over the whole song (one matrix of envelope
+  samples, window sums from a cumulative sum), fitted with a smooth
+  piecewise-linear time-warp. Small BPM errors or drift in the recording
+  accumulate along a grid extrapolated from the first 45 s; the warp pulls
+  the late stages back onto the beat.
+
+make_grid builds beat-locked grid times from either a constant BPM or a
+TempoMap whose segments carry their own phase anchor, optionally warped.
+"""
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+HOP_LENGTH = 512
+# Bump when estimate_bpm's result changes, so BPMs memoized in the analysis cache are re-estimated.
+TEMPO_VERSION = 2
+
+
+@dataclass
+class TempoSegment:
+    start: float
+    end: float
+    bpm: float
+    beat0: Optional[float] = None   # any beat time of this segment (phase anchor)
+
+
+@dataclass
+class TimeWarp:
+    knots: List[float]      # knot times (s)
+    offsets: List[float]    # grid shift at each knot (s), linear in between, constant outside
+    residuals: List[Dict] = field(default_factory=list, compare=False)  # per-stage report (warp_residuals)
+
+    def apply(self, t: np.ndarray) -> np.ndarray:
+        return t + np.interp(t, self.knots, self.offsets)
+
+    def to_dict(self) -> Dict:
+        return dict(knots=self.knots, offsets=self.offsets)
+
+
+@dataclass
+class TempoMap:
+    segments: List[TempoSegment]
+    warp: Optional[TimeWarp] = None
+
+    def bpm_at(self, t: float) -> float:
+        for seg in self.segments:
+            if t < seg.end:
+                return seg.bpm
+        return self.segments[-1].bpm
+
+    def to_list(self) -> List[Dict]:
+        return [asdict(s) for s in self.segments]
+
+    @classmethod
+    def from_list(cls, rows: List[Dict]) -> "TempoMap":
+        return cls([TempoSegment(**r) for r in rows])
+
+    def to_dict(self) -> Dict:
+        return dict(segments=self.to_list(), warp=None if self.warp is None else self.warp.to_dict())
+
+    @classmethod
+    def from_dict(cls, d) -> "TempoMap":
+        """Inverse of to_dict; also reads the older to_list() form."""
+        if isinstance(d, list):
+            return cls.from_list(d)
+        warp = d.get("warp")
+        return cls([TempoSegment(**r) for r in d["segments"]], None if warp is None else TimeWarp(**warp))
+
+
+# -------------------------
+# Autocorrelation
+# -------------------------
+def onset_autocorr(onset_env: np.ndarray, max_lag: int) -> np.ndarray:
+    """Unbiased, normalized autocorrelation of the mean-removed envelope for lags 0..max_lag."""
+    x = np.asarray(onset_env, dtype=np.float64)
+    x = x - x.mean()
+    n = len(x)
+    max_lag = min(max_lag, n - 1)
+    nfft = 1 << (2 * n - 1).bit_length()
+    spec = np.fft.rfft(x, nfft)
+    ac = np.fft.irfft(spec * np.conj(spec), nfft)[:max_lag + 1]
+    ac /= n - np.arange(max_lag + 1)
+    if ac[0] > 0:
+        ac /= ac[0]
+    return ac
+
+
+def _refine_peak(ac: np.ndarray, lag: float, radius: float) -> Optional[float]:
+    """Sub-frame position of the strongest peak within `radius` frames of `lag`."""
+    lo = max(1, int(np.floor(lag - radius)))
+    hi = min(len(ac) - 2, int(np.ceil(lag + radius)))
+    if hi < lo:
+        return None
+    i = lo + int(np.argmax(ac[lo:hi + 1]))
+    a, b, c = ac[i - 1], ac[i], ac[i + 1]
+    denom = a - 2.0 * b + c
+    shift = 0.5 * (a - c) / denom if denom < 0 else 0.0
+    return i + float(np.clip(shift, -0.5, 0.5))
+
+
+def _period_frames(
+    ac: np.ndarray,
+    lags: np.ndarray,
+    *,
+    harmonics: int,
+    prior: Optional[np.ndarray] = None,
+) -> Optional[float]:
+    """
+    Best beat period (frames) among integer `lags`, refined over its multiples.
+    The prior only arbitrates between the strongest period and its octaves
+    (half / double), never against unrelated periods.
+    """
+    keep = harmonics * lags + harmonics < len(ac)
+    lags = lags[keep]
+    if len(lags) == 0:
+        return None
+    # The true period is fractional, so the k-th multiple can sit up to k/2
+    # frames off k * lag: take the AC maximum within that reach.
+    comb = np.zeros(len(lags))
+    for k in range(1, harmonics + 1):
+        reach = (k + 1) // 2
+        comb += np.max([ac[k * lags + d] for d in range(-reach, reach + 1)], axis=0)
+    comb /= harmonics
+
+    best = int(np.argmax(comb))
+    if prior is not None:
+        prior = prior[keep]
+        family = []
+        for ratio in (0.5, 1.0, 2.0):
+            near = np.flatnonzero(np.abs(lags - ratio * lags[best]) <= max(1.0, 0.03 * ratio * lags[best]))
+            if len(near):
+                family.append(int(near[np.argmax(comb[near])]))
+        best = max(family, key=lambda i: comb[i] * prior[i])
+    lag = float(lags[best])
+
+    # Least-squares period through the refined peaks at k * lag
+    num = den = 0.0
+    for k in range(1, harmonics + 1):
+        p = _refine_peak(ac, k * lag, radius=max(1.0, 0.04 * k * lag))
+        if p is not None:
+            num += k * p
+            den += k * k
+    return num / den if den else lag
+
+
+def phase_coherence(onset_env: np.ndarray, *, fps: float, bpms: np.ndarray, harmonics: int = 8) -> np.ndarray:
+    """
+    How tightly the envelope folds onto one beat at each candidate BPM: the
+    power of the folded envelope's first `harmonics` phase harmonics (0 when
+    flat, 1 when every onset lands on one phase). Small tempo errors smear the
+    fold over a long song, so this sharpens the autocorrelation estimate. A
+    phase histogram would alias: a period of a whole number of frames puts
+    every frame into a few bins and scores as sharp as a real beat.
+    """
+    e = np.asarray(onset_env, dtype=np.float64)
+    t = np.arange(len(e)) / fps
+    total = max(float(e.sum()), 1e-12)
+    out = np.empty(len(bpms))
+    for i, bpm in enumerate(bpms):
+        z = np.exp(2j * np.pi * (bpm / 60.0) * t)
+        zh = e.astype(np.complex128)
+        power = 0.0
+        for _ in range(harmonics):
+            zh *= z
+            power += abs(zh.sum()) ** 2
+        out[i] = power / (harmonics * total * total)
+    return out
+
+
+def refine_bpm(
+    onset_env: np.ndarray,
+    *,
+    sr: int,
+    bpm: float,
+    hop_length: int = HOP_LENGTH,
+    rel_range: float = 0.006,
+    points: int = 41,
+) -> float:
+    """Phase-coherence search within +-rel_range of `bpm`, then a 20x finer pass around the best."""
+    fps = sr / hop_length
+    span = bpm * rel_range
+    for _ in range(2):
+        bpms = np.linspace(bpm - span, bpm + span, points)
+        bpm = float(bpms[int(np.argmax(phase_coherence(onset_env, fps=fps, bpms=bpms)))])
+        span = 2.0 * span / (points - 1)
+    return bpm
+
+
+def estimate_bpm(
+    onset_env: np.ndarray,
+    *,
+    sr: int,
+    hop_length: int = HOP_LENGTH,
+    bpm_range: Tuple[float, float] = (60.0, 200.0),
+    start_bpm: float = 120.0,
+    std_octaves: float = 1.0,
+    harmonics: int = 4,
+) -> float:
+    """Global tempo of the envelope, in BPM."""
+    fps = sr / hop_length
+    lo, hi = bpm_range
+    lags = np.arange(int(np.ceil(60.0 * fps / hi)), int(np.floor(60.0 * fps / lo)) + 1)
+    ac = onset_autocorr(onset_env, harmonics * int(lags[-1]) + 2)
+
+    bpms = 60.0 * fps / lags
+    prior = np.exp(-0.5 * (np.log2(bpms / start_bpm) / std_octaves) ** 2)
+    period = _period_frames(ac, lags, harmonics=harmonics, prior=prior)
+    if period is None:
+        raise ValueError("onset envelope is too short to estimate a tempo")
+    return refine_bpm(onset_env, sr=sr, bpm=60.0 * fps / period, hop_length=hop_length)
+
+
+# -------------------------
+# Tempo map
+# -------------------------
+def local_bpms(
+    onset_env: np.ndarray,
+    *,
+    sr: int,
+    bpm: float,
+    hop_length: int = HOP_LENGTH,
+    window_s: float = 16.0,
+    hop_s: float = 4.0,
+    tolerance: float = 0.06,
+    harmonics: int = 4,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """(window centre times, local BPM) over sliding windows, searched within +-tolerance of `bpm`."""
+    fps = sr / hop_length
+    win = max(int(window_s * fps), 8)
+    step = max(int(hop_s * fps), 1)
+    period = 60.0 * fps / bpm
+    lags = np.arange(int(np.floor(period / (1 + tolerance))), int(np.ceil(period / (1 - tolerance))) + 1)
+
+    centers, values = [], []
+    for f0 in range(0, max(len(onset_env) - win, 0) + 1, step):
+        seg = onset_env[f0:f0 + win]
+        ac = onset_autocorr(seg, harmonics * int(lags[-1]) + 2)
+        p = _period_frames(ac, lags, harmonics=harmonics)
+        if p is None:
+            continue
+        centers.append((f0 + len(seg) / 2) / fps)
+        values.append(60.0 * fps / p)
+    return np.asarray(centers), np.asarray(values)
+
+
+def estimate_tempo_map(
+    onset_env: np.ndarray,
+    *,
+    sr: int,
+    duration: float,
+    bpm: float,
+    hop_length: int = HOP_LENGTH,
+    window_s: float = 16.0,
+    hop_s: float = 4.0,
+    split_tol: float = 0.01,
+    min_segment_s: float = 20.0,
+) -> TempoMap:
+    """
+    Piecewise-constant tempo around `bpm`. Segments shorter than min_segment_s
+    are merged into a neighbour; each segment's BPM is re-estimated over its
+    whole span (longer window -> finer period). Phase anchors are left unset.
+    """
+    centers, local = local_bpms(
+        onset_env, sr=sr, bpm=bpm, hop_length=hop_length, window_s=window_s, hop_s=hop_s,
+    )
+    if len(local) < 3:
+        return TempoMap([TempoSegment(0.0, duration, bpm)])
+
+    padded = np.concatenate([local[:1], local, local[-1:]])
+    smooth = np.median(np.stack([padded[:-2], padded[1:-1], padded[2:]]), axis=0)
+
+    # Greedy split wherever the local tempo leaves the running segment's median
+    bounds = [0]
+    for i in range(1, len(smooth)):
+        ref = np.median(smooth[bounds[-1]:i])
+        if abs(smooth[i] - ref) / ref > split_tol:
+            bounds.append(i)
+    bounds.append(len(smooth))
+
+    edges = [0.0] + [0.5 * (centers[b - 1] + centers[b]) for b in bounds[1:-1]] + [duration]
+    spans = [[edges[j], edges[j + 1]] for j in range(len(edges) - 1)]
+
+    # Merge short segments into the previous one (or the next, for the first)
+    merged: List[List[float]] = []
+    for span in spans:
+        if merged and span[1] - span[0] < min_segment_s:
+            merged[-1][1] = span[1]
+        else:
+            merged.append(span)
+    if len(merged) > 1 and merged[0][1] - merged[0][0] < min_segment_s:
+        merged[1][0] = merged[0][0]
+        merged.pop(0)
+
+    if len(merged) == 1:
+        return TempoMap([TempoSegment(0.0, duration, bpm)])
+
+    fps = sr / hop_length
+    segments: List[TempoSegment] = []
+    for start, end in merged:
+        inside = (centers >= start) & (centers < end)
+        seg_bpm = float(np.median(smooth[inside])) if np.any(inside) else bpm
+        seg_env = onset_env[int(start * fps):int(end * fps) + 1]
+        seg_bpm = refine_bpm(seg_env, sr=sr, bpm=seg_bpm, hop_length=hop_length, rel_range=split_tol)
+        if segments and abs(seg_bpm - segments[-1].bpm) / segments[-1].bpm <= split_tol / 2:
+            segments[-1].end = end
+        else:
+            segments.append(TempoSegment(start, end, seg_bpm))
+    return TempoMap(segments)
+
+
+# -------------------------
+# Phase tracking / time-warp
+# -------------------------
+@dataclass
+class PhaseTrack:
+    centers: np.ndarray    # window centre times (s)
+    offsets: np.ndarray    # onsets' phase lead over the grid (s), unwrapped across windows
+    weights: np.ndarray    # confidence: how much the window's phase peak stands out (0 = none)
+
+
+def track_phase(
+    onset_env: np.ndarray,
+    onset_times_env: np.ndarray,
+    beats: np.ndarray,
+    *,
+    window_s: float = 8.0,
+    hop_s: float = 2.0,
+    steps: int = 48,
+    max_drift: float = 0.25,
+    drift_per_hop: float = 0.02,
+) -> PhaseTrack:
+    """
+    Local phase of the onsets against `beats` (the grid's beat times) in sliding windows.
+
+    The envelope is sampled at every beat + every fraction of a beat (one
+    (beats x steps) interp) and the window sums come from a cumulative sum
+    over the beat axis. A single window often prefers an off-beat
+    (syncopation, hats), so the path through the windows is decoded with
+    Viterbi over offsets in [-max_drift, max_drift] beats: each window scores
+    its offset (z-scored, periodic in the beat) and moving more than
+    drift_per_hop beats between windows costs quadratically.
+    """
+    duration = float(onset_times_env[-1]) if len(onset_times_env) else 0.0
+    if len(beats) < 4 or duration < window_s:
+        return PhaseTrack(np.zeros(0), np.zeros(0), np.zeros(0))
+    spb = np.gradient(beats)
+    frac = np.arange(steps) / steps - 0.5
+    s = np.interp(beats[:, None] + frac[None, :] * spb[:, None], onset_times_env, onset_env)
+    cum = np.vstack([np.zeros(steps), np.cumsum(s, axis=0)])
+
+    centers = np.arange(window_s / 2.0, duration - window_s / 2.0 + 1e-9, hop_s)
+    lo = np.searchsorted(beats, centers - window_s / 2.0)
+    hi = np.searchsorted(beats, centers + window_s / 2.0)
+    win = cum[hi] - cum[lo]                                            # (windows, steps)
+    z = (win - win.mean(axis=1, keepdims=True)) / np.maximum(win.std(axis=1, keepdims=True), 1e-12)
+    z[hi - lo < 2] = 0.0
+
+    # states: offsets k / steps beats, k in [-K, K]; observation wraps once per beat
+    k_max = int(round(max_drift * steps))
+    states = np.arange(-k_max, k_max + 1)
+    obs = z[:, (states + steps // 2) % steps]                          # frac index of offset k/steps
+    move = (states[:, None] - states[None, :]) / steps / drift_per_hop
+    trans = -0.5 * move ** 2
+    # start on the grid (beat0 was fitted there)
+    score = obs[0] - 0.5 * (states / steps / drift_per_hop) ** 2
+    back = np.zeros((len(centers), len(states)), dtype=np.int64)
+    for w in range(1, len(centers)):
+        cand = score[None, :] + trans                                  # (to, from)
+        back[w] = np.argmax(cand, axis=1)
+        score = cand[np.arange(len(states)), back[w]] + obs[w]
+    path = np.empty(len(centers), dtype=np.int64)
+    path[-1] = int(np.argmax(score))
+    for w in range(len(centers) - 1, 0, -1):
+        path[w - 1] = back[w, path[w]]
+
+    # sub-step refinement on each window's own (periodic) scores
+    rows = np.arange(len(centers))
+    col = (states[path] + steps // 2) % steps
+    a, b, c = win[rows, (col - 1) % steps], win[rows, col], win[rows, (col + 1) % steps]
+    denom = a - 2.0 * b + c
+    shift = np.where(denom < 0, 0.5 * (a - c) / np.where(denom < 0, denom, -1.0), 0.0)
+    phase = (states[path] + np.clip(shift, -0.5, 0.5)) / steps         # beats
+
+    weights = np.maximum(z[rows, col], 0.0)
+    spb_c = np.interp(centers, beats, spb)
+    return PhaseTrack(centers=centers, offsets=phase * spb_c, weights=weights)
+
+
+def fit_time_warp(
+    track: PhaseTrack,
+    *,
+    duration: float,
+    knot_s: float = 30.0,
+    smooth: float = 1.0,
+    outlier_s: float = 0.03,
+    iterations: int = 4,
+) -> Optional[TimeWarp]:
+    """
+    Smooth piecewise-linear offset curve through the tracked phase offsets:
+    confidence-weighted least squares on knots every knot_s with a second-difference
+    penalty, re-weighted so windows that locked onto an off-beat (residual >> outlier_s)
+    stop pulling the fit. None without enough confident windows.
+    """
+    ok = track.weights > 0
+    if np.count_nonzero(ok) < 4:
+        return None
+    x, y, w0 = track.centers[ok], track.offsets[ok], track.weights[ok]
+    knots = np.linspace(0.0, duration, max(2, int(np.ceil(duration / knot_s)) + 1))
+
+    # hat-function basis: column j is linear interpolation weight of knot j
+    basis = np.stack([np.interp(x, knots, np.eye(len(knots))[j]) for j in range(len(knots))], axis=1)
+    d2 = np.diff(np.eye(len(knots)), n=2, axis=0)
+    penalty = smooth * w0.mean() * d2.T @ d2
+    w = w0.copy()
+    for _ in range(iterations):
+        a = basis.T @ (w[:, None] * basis) + penalty
+        coef = np.linalg.solve(a + 1e-9 * np.eye(len(knots)), basis.T @ (w * y))
+        r = y - basis @ coef
+        w = w0 / (1.0 + (r / outlier_s) ** 2)
+    return TimeWarp(knots=[round(float(k), 4) for k in knots], offsets=[round(float(c), 5) for c in coef])
+
+
+def _weighted_rms_ms(r: np.ndarray, w: np.ndarray) -> float:
+    return round(1e3 * float(np.sqrt(np.sum(w * r ** 2) / np.sum(w))), 2)
+
+
+def warp_residuals(track: PhaseTrack, warp: Optional[TimeWarp], boundaries: List[float]) -> List[Dict]:
+    """Per stage: weighted RMS phase error (ms) of the tracked windows before and after the warp."""
+    out = []
+    shift = np.zeros(len(track.centers)) if warp is None else np.interp(track.centers, warp.knots, warp.offsets)
+    for i in range(len(boundaries) - 1):
+        sel = (track.centers >= boundaries[i]) & (track.centers < boundaries[i + 1]) & (track.weights > 0)
+        if not np.any(sel):
+            out.append(dict(stage=i + 1, windows=0, before_ms=None, after_ms=None))
+            continue
+        w = track.weights[sel]
+        out.append(dict(
+            stage=i + 1,
+            windows=int(np.count_nonzero(sel)),
+            before_ms=_weighted_rms_ms(track.offsets[sel], w),
+            after_ms=_weighted_rms_ms(track.offsets[sel] - shift[sel], w),
+        ))
+    return out
+
+
+# -------------------------
+# Grids
+# -------------------------
+def make_fixed_grid(duration_s: float, bpm: float, subdiv_per_beat: int, beat0: float) -> np.ndarray:
+    """Fixed BPM grid times. subdiv_per_beat: 1=quarters, 2=eighths, 4=sixteenths."""
+    spb = 60.0 / bpm
+    dt = spb / subdiv_per_beat
+    n = int(np.floor((duration_s - beat0) / dt)) + 1
+    t = beat0 + np.arange(max(n, 1), dtype=float) * dt
+    return t[(t >= 0.0) & (t <= duration_s)]
+
+
+def make_grid(
+    duration_s: float,
+    *,
+    bpm: float,
+    subdiv_per_beat: int,
+    beat0: float,
+    tempo_map: Optional[TempoMap] = None,
+) -> np.ndarray:
+    """
+    Beat-locked grid times in [0, duration_s]. Without a tempo map (or with a
+    one-segment map) this is the fixed grid from beat0; with one, each segment
+    lays its own grid from its anchor, and points closer than half a step to
+    the previous segment's last point are dropped so boundaries never double
+    up. A map's time-warp then shifts every point.
+    """
+    if tempo_map is None:
+        return make_fixed_grid(duration_s, bpm, subdiv_per_beat, beat0)
+    if tempo_map.warp is not None:
+        grid = make_grid(
+            duration_s, bpm=bpm, subdiv_per_beat=subdiv_per_beat, beat0=beat0,
+            tempo_map=TempoMap(tempo_map.segments),
+        )
+        grid = tempo_map.warp.apply(grid)
+        return grid[(grid >= 0.0) & (grid <= duration_s)]
+    if len(tempo_map.segments) == 1:
+        seg = tempo_map.segments[0]
+        return make_fixed_grid(duration_s, seg.bpm, subdiv_per_beat, beat0 if seg.beat0 is None else seg.beat0)
+
+    parts = []
+    last = -np.inf
+    for j, seg in enumerate(tempo_map.segments):
+        dt = 60.0 / seg.bpm / subdiv_per_beat
+        anchor = beat0 if seg.beat0 is None else seg.beat0
+        end = min(seg.end, duration_s)
+        k0 = int(np.ceil((max(seg.start, 0.0) - anchor) / dt))
+        k1 = int(np.floor((end - anchor) / dt))
+        t = anchor + np.arange(k0, k1 + 1, dtype=float) * dt
+        if j < len(tempo_map.segments) - 1:
+            t = t[t < seg.end]
+        t = t[t >= last + 0.5 * dt]
+        if len(t):
+            parts.append(t)
+            last = t[-1]
+    return np.concatenate(parts) if parts else np.zeros(0)
@@ -0,0 +1,86 @@
+"""
+Check a finished chart against the timing invariants the generators build in.
+
+Every check is a sort, a scan or a searchsorted over the note columns
+(O(n log n)), so million-note stress charts validate in seconds:
+
+- order   spawn never decreases (GameCanvas spawns with one forward chartIndex
+          scan, so a note that sorts too late spawns late)
+- times   spawn >= 0, spawn <= hit <= end, taps end where they hit, speed > 0
+- lanes   lane in [0, lanes); in each lane a note neither stacks on the
+          previous one nor starts before its hold tail has ended
+- popup   no note is on screen (spawn .. end + miss_px / speed) while a stage
+          popup shows, [boundary, boundary + popup_seconds], at a stage change
+- stage   each note hits inside its stage's boundaries
+- nps     notes per rolling --nps-window seconds (by hit) stay within --max-nps
+
+Boundaries and geometry come from a ChartConfig params file (RandomChartConfig
+with --random); the defaults match the game. Times are compared with a small
+tolerance for the 4-decimal rounding of the row format.
+
+    python scripts/validate_chart.py chart.json --params params.json
+    python scripts/validate_chart.py stress.bin --max-nps 20 --json report.json
+
+analyze_song.py, generate_chart.py and batch_chart.py run the same checks on
+every chart they write (--no-validate skips them).
+"""
+import argparse
+import json
+import sys
+import time
+
+# the checks live in chart_core.validate (numpy); they load on first use so --help stays fast
+_LAZY = ("TOL", "CHECKS", "ChartRules", "ValidationReport", "validate_notes", "validate_rows", "validate_file")
+
+
+def __getattr__(name: str):
+    if name in _LAZY:
+        from chart_core import validate
+
+        return getattr(validate, name)
+    raise AttributeError(f"module 'validate_chart' has no attribute {name!r}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("charts", nargs="+", help="chart files (json / columnar / binary, optionally .gz/.br)")
+    ap.add_argument("--params", help="ChartConfig overrides the charts were built with (boundaries, geometry, lanes)")
+    ap.add_argument("--random", action="store_true", help="--params are RandomChartConfig (generate_chart.py)")
+    ap.add_argument("--max-nps", type=float, help="fail if any rolling window holds more notes per second")
+    ap.add_argument("--nps-window", type=float, default=1.0, help="rolling window for notes per second (s)")
+    ap.add_argument("--json", help="write the reports here")
+    args = ap.parse_args()
+
+    from chart_core import ChartConfig, NoteArray, RandomChartConfig
+    from chart_core.validate import ChartRules, validate_notes
+    from chart_format import read_chart
+
+    cls = RandomChartConfig if args.random else ChartConfig
+    cfg = cls()
+    if args.params:
+        with open(args.params) as f:
+            cfg = cls.from_dict(json.load(f))
+    rules = ChartRules.from_config(cfg, max_nps=args.max_nps, nps_window=args.nps_window)
+
+    reports = {}
+    for path in args.charts:
+        t0 = time.perf_counter()
+        try:
+            notes = NoteArray.from_rows(read_chart(path))
+        except (OSError, ValueError) as e:
+            reports[path] = dict(ok=False, error=f"{type(e).__name__}: {e}")
+            print(f"{path}: FAILED {reports[path]['error']}")
+            continue
+        load_s = time.perf_counter() - t0
+        report = validate_notes(notes, rules)
+        reports[path] = dict(report.to_dict(), load_seconds=round(load_s, 4))
+        print(f"{path}: {report.format(notes)}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+    return 0 if all(r["ok"] for r in reports.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,18 @@
 import { useEffect, useRef } from "react";
 import Phaser from "phaser";
+import { isBinaryChart, noteIndexAt, parseChart, seekIndexUrl, stageStartIndex } from "./chartFormat";
+
+// Practice / retry-from-stage: ?stage=4 starts at stage 4's boundary, ?t=95.5 at any time.
+// With the HashRouter the query can also come after the route (#/ryan?stage=4).
+function readPracticeStart() {
+    const hashQuery = window.location.hash.split("?")[1] ?? "";
+    const params = new URLSearchParams(`${window.location.search.slice(1)}&${hashQuery}`);
+    const stage = parseInt(params.get("stage"), 10);
+    const time = parseFloat(params.get("t"));
+    if (stage > 1) return { stage };
+    if (time > 0) return { time };
+    return null;
+}
 
 class PlayScene extends Phaser.Scene {
     constructor(onGameOver, song, chart, end) {
@@ -7,12 +20,17 @@ class PlayScene extends Phaser.Scene {
         this.onGameOver = onGameOver;
         this.song = song
         this.chart = chart
+        this.chartUrl = chart
         this.end = end
+        this.practice = readPracticeStart();
     }
 
     preload() {
         this.load.audio("song", this.song);
-        this.load.json("chart", this.chart);
+        if (isBinaryChart(this.chartUrl)) this.load.binary("chart", this.chartUrl);
+        else this.load.json("chart", this.chartUrl);
+        // seek index written next to the chart by scripts/chart_format.py (only needed to start mid-song)
+        if (this.practice) this.load.json("seek", seekIndexUrl(this.chartUrl));
 
         this.load.image("arrowL", "sprites/arrow_left.png");
         this.load.image("arrowD", "sprites/arrow_down.png");
@@ -246,17 +264,40 @@ class PlayScene extends Phaser.Scene {
             .setDepth(1500);
 
         // ---- Load chart ----
-        const data = this.cache.json.get("chart");
-        this.chart = Array.isArray(data) ? data : [];
+        // Row JSON, columnar JSON or binary (see scripts/chart_format.py)
+        const data = isBinaryChart(this.chartUrl)
+            ? this.cache.binary.get("chart")
+            : this.cache.json.get("chart");
+        this.chart = parseChart(data);
         this.chartIndex = 0;
 
+        // ---- Practice start: jump straight to the stage / time via the seek index ----
+        let startTime = 0;
+        if (this.practice) {
+            const seek = this.cache.json.get("seek"); // undefined if the chart has none: binary search instead
+            const { stage, time } = this.practice;
+            let i = stage
+                ? Math.min(stage, this.stages.length) - 1
+                : this.stages.findIndex((s) => time < s.end);
+            if (i < 0) i = this.stages.length - 1;
+            this.stageIndex = i;
+            this.applyStage(i);
+            if (stage) {
+                startTime = this.stages[i].start;
+                this.chartIndex = stageStartIndex(this.chart, i + 1, seek);
+            } else {
+                startTime = time;
+                this.chartIndex = noteIndexAt(this.chart, time, seek);
+            }
+        }
+
         // Quick sanity log (remove later)
         // console.log("chart[0]", this.chart?.[0]);
 
         // ---- Audio ----
         this.sound.pauseOnBlur = false;
         this.song = this.sound.add("song", { volume: 0.8 });
-        this.song.play();
+        this.song.play({ seek: startTime });
 
         // Arrow keys -> lanes
         const arrowKeys = this.input.keyboard.createCursorKeys();
@@ -265,8 +306,9 @@ class PlayScene extends Phaser.Scene {
         arrowKeys.up.on("down", () => this.tryHit(2));
         arrowKeys.right.on("down", () => this.tryHit(3));
 
-        // Optional: show Stage 1 popup right away
-        this.showStagePopup("READY, PUPPY?", this.stages[0].message, () => { });
+        // Optional: show the first stage's popup right away (Stage 1 unless practicing)
+        const firstStage = this.stages[this.stageIndex];
+        this.showStagePopup(firstStage.name, firstStage.message, () => { });
     }
 
     applyStage(i) {
@@ -0,0 +1,125 @@
+// Chart decoding for the formats written by scripts/chart_format.py:
+// - row JSON:      [{ spawn, hit, end, lane, stage, speed, type }, ...]
+// - columnar JSON: { format: "cursed-rhythm/columnar", spawn: [...], ..., stage_speed: { "1": 320, ... } }
+// - binary (.bin): "CRCH" header + float32 time columns (float64 in v2, for long charts)
+//                  + uint8 lane/stage/type columns
+// plus the seek index written next to each chart (chart.json -> chart.json.seek).
+
+export const COLUMNAR_FORMAT = "cursed-rhythm/columnar";
+export const SEEK_FORMAT = "cursed-rhythm/seek";
+const BINARY_MAGIC = "CRCH";
+const BINARY_VERSION = 1;
+const BINARY_VERSION_F64 = 2;
+const TYPES = ["tap", "hold"];
+
+export function isBinaryChart(url) {
+    return /\.bin(\?|#|$)/.test(url ?? "");
+}
+
+export function expandColumnarChart(data) {
+    const n = data.count ?? data.spawn.length;
+    const rows = new Array(n);
+    for (let i = 0; i < n; i++) {
+        const stage = data.stage[i];
+        rows[i] = {
+            spawn: data.spawn[i],
+            hit: data.hit[i],
+            end: data.end[i],
+            lane: data.lane[i],
+            stage,
+            speed: data.stage_speed[stage],
+            type: TYPES[data.type[i]] ?? "tap",
+        };
+    }
+    return rows;
+}
+
+export function decodeBinaryChart(buffer) {
+    const view = new DataView(buffer);
+    const magic = String.fromCharCode(
+        view.getUint8(0), view.getUint8(1), view.getUint8(2), view.getUint8(3)
+    );
+    const version = view.getUint16(4, true);
+    if (magic !== BINARY_MAGIC || (version !== BINARY_VERSION && version !== BINARY_VERSION_F64)) {
+        throw new Error(`Not a v${BINARY_VERSION}/v${BINARY_VERSION_F64} binary chart`);
+    }
+    const nSpeeds = view.getUint16(6, true);
+    const count = view.getUint32(8, true);
+
+    // Columns are 4-byte aligned (v2 times 8-byte); assumes a little-endian host (every browser we target)
+    let off = 12;
+    const f32 = (n) => { const a = new Float32Array(buffer, off, n); off += 4 * n; return a; };
+    const f64 = (n) => { const a = new Float64Array(buffer, off, n); off += 8 * n; return a; };
+    const u8 = (n) => { const a = new Uint8Array(buffer, off, n); off += n; return a; };
+
+    const stageSpeed = f32(nSpeeds);
+    if (version === BINARY_VERSION_F64) off += (8 - (off % 8)) % 8;
+    const time = version === BINARY_VERSION_F64 ? f64 : f32;
+    const spawn = time(count);
+    const hit = time(count);
+    const end = time(count);
+    const lane = u8(count);
+    const stage = u8(count);
+    const type = u8(count);
+
+    const rows = new Array(count);
+    for (let i = 0; i < count; i++) {
+        rows[i] = {
+            spawn: spawn[i],
+            hit: hit[i],
+            end: end[i],
+            lane: lane[i],
+            stage: stage[i],
+            speed: stageSpeed[stage[i]],
+            type: TYPES[type[i]] ?? "tap",
+        };
+    }
+    return rows;
+}
+
+// Any supported chart payload -> array of note rows sorted by spawn (as written).
+export function parseChart(data) {
+    if (Array.isArray(data)) return data;
+    if (data instanceof ArrayBuffer) return decodeBinaryChart(data);
+    if (data && data.format === COLUMNAR_FORMAT) return expandColumnarChart(data);
+    return [];
+}
+
+// ---- Seek index ----
+// { format: "cursed-rhythm/seek", count, bucket, buckets: [first note index with spawn >= k * bucket],
+//   stages: { "1": { first, spawn, hit }, ... } }
+
+export function seekIndexUrl(chartUrl) {
+    return chartUrl.replace(/\.(gz|br)$/, "") + ".seek";
+}
+
+function usableIndex(seek, chart) {
+    return seek && seek.format === SEEK_FORMAT && seek.count === chart.length;
+}
+
+// Index of the first note spawning at or after time t: one bucket lookup plus a short walk
+// inside that bucket. Without a (matching) index, a binary search over spawn.
+export function noteIndexAt(chart, t, seek) {
+    if (usableIndex(seek, chart)) {
+        const k = Math.min(Math.max(0, Math.floor(t / seek.bucket)), seek.buckets.length - 1);
+        let i = seek.buckets[k];
+        while (i < chart.length && chart[i].spawn < t) i++;
+        return i;
+    }
+    let lo = 0;
+    let hi = chart.length;
+    while (lo < hi) {
+        const mid = (lo + hi) >> 1;
+        if (chart[mid].spawn < t) lo = mid + 1;
+        else hi = mid;
+    }
+    return lo;
+}
+
+// Index of the first note of `stage` (1-based), or chart.length if it has none.
+export function stageStartIndex(chart, stage, seek) {
+    const entry = usableIndex(seek, chart) ? seek.stages?.[String(stage)] : null;
+    if (entry) return entry.first;
+    const i = chart.findIndex((n) => n.stage >= stage);
+    return i < 0 ? chart.length : i;
+}
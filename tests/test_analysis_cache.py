@@ -0,0 +1,27 @@
+import os
+
+from analysis_cache import AnalysisCache
+
+
+def fill(cache, n, size=1000):
+    os.makedirs(cache.root, exist_ok=True)
+    for i in range(n):
+        with open(os.path.join(cache.root, f"k{i}.npy"), "wb") as f:
+            f.write(b"x" * size)
+
+
+def test_housekeeping_skips_files_removed_by_another_process(tmp_path, monkeypatch):
+    cache = AnalysisCache(str(tmp_path / "cache"), max_bytes=2500)
+    fill(cache, 5)
+    listed = cache._entries()
+    # another worker evicts two files between our listing and our stat calls
+    os.remove(listed[0])
+    os.remove(listed[1])
+    monkeypatch.setattr(cache, "_entries", lambda: listed)
+
+    assert cache.size_bytes() == 3000
+    cache.evict()
+    monkeypatch.undo()
+    assert cache.size_bytes() <= 2500
+    cache.clear()
+    assert cache.size_bytes() == 0
@@ -0,0 +1,43 @@
+import pytest
+
+import analyze_song
+from analyze_song import analyze_audio, find_beat0
+from audio_io import HOP_LENGTH, N_FFT, analysis_frame
+from bench_pipeline import ensure_fixture
+
+NATIVE_SR = 44100
+NATIVE_HOP_S = HOP_LENGTH / NATIVE_SR
+
+
+def test_analysis_frame():
+    assert analysis_frame(None, NATIVE_SR) == (N_FFT, HOP_LENGTH)
+    assert analysis_frame(48000, NATIVE_SR) == (N_FFT, HOP_LENGTH)  # never upscaled
+    assert analysis_frame(22050, NATIVE_SR) == (1024, 256)
+    assert analysis_frame(11025, NATIVE_SR) == (512, 128)
+    assert analysis_frame(24000, 48000) == (1024, 256)
+    # no power of two fits exactly: the closest one
+    assert analysis_frame(16000, NATIVE_SR) == (1024, 256)
+
+
+@pytest.fixture(scope="module")
+def song(tmp_path_factory):
+    path = ensure_fixture(str(tmp_path_factory.mktemp("fixtures")), minutes=1.0, bpm=120.0, subdiv=4, sr=NATIVE_SR)
+    native = analyze_audio(path, cache=None, decoder="soundfile")
+    return path, find_beat0(native, bpm=120.0, refine=2)
+
+
+@pytest.mark.parametrize("sr, hop_tol, beat0_tol", [(22050, 1e-12, 0.002), (11025, 1e-12, 0.002), (16000, 0.005, 0.01)])
+def test_reduced_rate_keeps_the_native_frame(song, sr, hop_tol, beat0_tol):
+    path, native_beat0 = song
+    analysis = analyze_audio(path, cache=None, decoder="soundfile", sr=sr)
+    assert analysis.sr == sr
+    assert abs(analysis.hop_length / analysis.sr - NATIVE_HOP_S) <= hop_tol
+    assert abs(find_beat0(analysis, bpm=120.0, refine=2) - native_beat0) <= beat0_tol
+
+
+def test_fixed_frame_at_reduced_rate_lags(song, monkeypatch):
+    # the reason analysis_frame exists: 2048/512 at 22.05 kHz lasts twice as long and pulls beat0 late
+    path, native_beat0 = song
+    monkeypatch.setattr(analyze_song, "analysis_frame", lambda sr, native_sr: (N_FFT, HOP_LENGTH))
+    analysis = analyze_audio(path, cache=None, decoder="soundfile", sr=22050)
+    assert find_beat0(analysis, bpm=120.0, refine=2) - native_beat0 > 0.01
@@ -0,0 +1,38 @@
+from dataclasses import replace
+
+import pytest
+
+from analyze_song import ChartConfig, analyze_audio, build_chart, resolve_tempo
+from autotune import stage_metrics
+from bench_pipeline import ensure_fixture
+
+SECONDS = 60.0
+
+
+@pytest.fixture(scope="module")
+def song(tmp_path_factory):
+    path = ensure_fixture(str(tmp_path_factory.mktemp("fixtures")), minutes=SECONDS / 60, bpm=120.0, subdiv=4, sr=22050)
+    base = ChartConfig(bpm=120.0)
+    cfg = replace(base, boundaries=[b * SECONDS / base.boundaries[-1] for b in base.boundaries])
+    analysis = analyze_audio(path, cache=None)
+    cfg, beat0, tempo_map = resolve_tempo(analysis, cfg)
+    return analysis, cfg, beat0, tempo_map
+
+
+@pytest.mark.parametrize("holdy", [False, True])
+def test_stage_metrics_count_the_shipped_notes(song, holdy):
+    analysis, cfg, beat0, tempo_map = song
+    if holdy:
+        # wide clusters and short hold minimums keep every lane busy, so some notes find no lane
+        n = cfg.n_stages
+        cfg = replace(cfg, stage_cluster_gap=[0.46] * n, stage_keep=[0.95] * n, stage_min_gap=[0.15] * n, hold_min_s=0.2)
+    rows, _ = build_chart(analysis, cfg, beat0=beat0, tempo_map=tempo_map)
+    cands = {}
+    for stage_idx in range(1, cfg.n_stages + 1):
+        m = stage_metrics(analysis, cfg, stage_idx, beat0=beat0, cands=cands, tempo_map=tempo_map)
+        stage_rows = [r for r in rows if r["stage"] == stage_idx]
+        if m is None:
+            assert not stage_rows
+            continue
+        assert m["notes"] == len(stage_rows)
+        assert m["holds"] == sum(r["type"] == "hold" for r in stage_rows)
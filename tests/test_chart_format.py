@@ -0,0 +1,110 @@
+import glob
+import gzip
+import os
+
+import pytest
+
+import chart_format
+from chart_format import (
+    BINARY_VERSION,
+    BINARY_VERSION_F64,
+    FORMATS,
+    check_round_trip,
+    decode_chart,
+    read_chart,
+    seek_index_path,
+    write_chart,
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PUBLIC_CHARTS = sorted(glob.glob(os.path.join(ROOT, "public", "charts", "*.json")))
+SIDECARS = ["", ".gz", ".br"]
+
+
+def long_chart(seconds=4000.0, step=0.3712):
+    """Synthetic chart past float32's exact range: 4-decimal times, a hold every 7th note, 6 stages."""
+    rows = []
+    n = int(seconds / step)
+    for i in range(n):
+        hit = round(2.0 + i * step, 4)
+        stage = 1 + i * 6 // n
+        hold = i % 7 == 0
+        rows.append(dict(
+            spawn=round(hit - 1.5, 4),
+            hit=hit,
+            end=round(hit + 0.75, 4) if hold else hit,
+            lane=i % 5,
+            stage=stage,
+            speed=300.0 + 20.0 * stage,
+            type="hold" if hold else "tap",
+        ))
+    return rows
+
+
+CHARTS = [pytest.param(p, id=os.path.basename(p)) for p in PUBLIC_CHARTS] + [pytest.param("long", id="long")]
+
+
+def load(chart):
+    return long_chart() if chart == "long" else read_chart(chart)
+
+
+def test_public_charts_found():
+    assert PUBLIC_CHARTS, "no charts in public/charts"
+
+
+@pytest.mark.parametrize("sidecar", SIDECARS)
+@pytest.mark.parametrize("fmt", FORMATS)
+@pytest.mark.parametrize("chart", CHARTS)
+def test_round_trip(tmp_path, chart, fmt, sidecar):
+    if sidecar == ".br" and chart_format.brotli is None:
+        pytest.skip("brotli not installed")
+    rows = load(chart)
+    path = str(tmp_path / ("chart" + chart_format.FORMAT_EXT[fmt]))
+    written = write_chart(rows, path, fmt, compress=bool(sidecar))
+
+    assert path + sidecar in written
+    assert seek_index_path(path) in written
+    assert read_chart(path + sidecar) == rows
+
+
+@pytest.mark.parametrize("chart", CHARTS)
+def test_check_round_trip(chart):
+    sizes = check_round_trip(load(chart))
+    assert set(FORMATS) <= set(sizes)
+
+
+def test_binary_switches_to_float64_past_float32_range():
+    short = long_chart(seconds=900.0)
+    assert decode_chart(chart_format.encode_chart(short, "binary"))[0] == short
+    assert int.from_bytes(chart_format.encode_chart(short, "binary")[4:6], "little") == BINARY_VERSION
+
+    rows = long_chart()
+    blob = chart_format.encode_chart(rows, "binary")
+    assert int.from_bytes(blob[4:6], "little") == BINARY_VERSION_F64
+    assert decode_chart(blob) == (rows, "binary")
+
+
+def test_seek_index_is_not_a_chart(tmp_path):
+    path = str(tmp_path / "chart.json")
+    write_chart(long_chart(seconds=60.0), path)
+    assert seek_index_path(path) == path + ".seek"
+    with pytest.raises(ValueError, match="seek index"):
+        read_chart(seek_index_path(path))
+
+
+def test_check_reports_every_file(tmp_path, monkeypatch, capsys):
+    good = str(tmp_path / "good.json")
+    write_chart(long_chart(seconds=60.0), good)
+    bad = str(tmp_path / "bad.json.gz")
+    with open(bad, "wb") as f:
+        f.write(gzip.compress(b"{not json"))
+    truncated = str(tmp_path / "truncated.bin")
+    with open(truncated, "wb") as f:
+        f.write(b"CRCH")
+
+    monkeypatch.setattr("sys.argv", ["chart_format.py", "check", bad, truncated, seek_index_path(good), good])
+    with pytest.raises(SystemExit) as exit_info:
+        chart_format.main()
+    assert exit_info.value.code == 1
+    out = capsys.readouterr().out.splitlines()
+    assert [line.split(":")[1].split()[0] for line in out] == ["FAILED", "FAILED", "FAILED", "ok"]
@@ -0,0 +1,74 @@
+import math
+
+import numpy as np
+import pytest
+
+from chart_core.notes import NoteArray
+from chart_metrics import MetricRules, note_features
+
+
+def brute_features(charts, rules):
+    """note_features one chart and one note at a time, every quantity straight from its definition."""
+    rows = []
+    for c, chart in enumerate(charts):
+        order = sorted(range(len(chart)), key=lambda i: (chart.hit[i], chart.lane[i]))
+        hit = [float(chart.hit[i]) for i in order]
+        end = [max(float(chart.end[i]), hit[k]) for k, i in enumerate(order)]
+        lane = [int(chart.lane[i]) for i in order]
+        hold = [bool(chart.hold[i]) for i in order]
+        strain = []
+        for k in range(len(order)):
+            in_chord = any(j != k and abs(hit[j] - hit[k]) <= rules.chord_tol for j in range(len(order)))
+            step = k > 0 and hit[k] - hit[k - 1] > rules.chord_tol
+            moves = abs(lane[k] - lane[k - 1]) if step else 0
+            prev = [j for j in range(k) if lane[j] == lane[k]]
+            gap = hit[k] - hit[prev[-1]] if prev else math.inf
+            jack = rules.chord_tol < gap <= rules.jack_window
+            nps = sum(1 for j in range(k, len(order)) if hit[j] < hit[k] + rules.nps_window) / rules.nps_window
+            covered = 0.0
+            if hold[k]:
+                reach = max([end[j] for j in range(k) if hold[j]], default=-math.inf)
+                covered = max(end[k] - max(hit[k], reach), 0.0)
+            effort = (1.0 + rules.switch_weight * moves / max(rules.lanes - 1, 1)
+                      + rules.jack_weight * jack + rules.hold_weight * hold[k])
+            strain.append(effort)
+            total = sum(s * math.exp(-(hit[k] - hit[j]) / rules.tau) for j, s in enumerate(strain)) / rules.tau
+            rows.append(dict(
+                chart=c, hit=hit[k], end=end[k], stage=int(chart.stage[order[k]]), hold=hold[k],
+                in_chord=in_chord, step=step, moves=moves, jack=jack, nps=nps, covered=covered, strain=total,
+                section=int(math.floor(max(hit[k], 0.0) / rules.section_s)),
+            ))
+    return rows
+
+
+def random_chart(rng, n, lanes):
+    """Hits on a coarse grid (chords, exact jack-window gaps) with some holds."""
+    hit = np.sort(rng.integers(0, max(n, 1) * 2, n) * 0.125)
+    hold = rng.random(n) < 0.25
+    end = np.where(hold, hit + rng.integers(1, 12, n) * 0.125, hit)
+    return NoteArray(
+        spawn=hit - 1.0, hit=hit, end=end, lane=rng.integers(0, lanes, n), stage=rng.integers(1, 7, n),
+        speed=np.full(n, 400.0), hold=hold,
+    )
+
+
+@pytest.mark.parametrize("seed", range(12))
+def test_note_features_match_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    lanes = int(rng.integers(4, 8))
+    rules = MetricRules(lanes=lanes, nps_window=[1.0, 0.5][seed % 2], jack_window=[0.5, 0.25][seed % 3 % 2])
+    charts = [random_chart(rng, int(rng.integers(0, 80)), lanes) for _ in range(int(rng.integers(1, 5)))]
+
+    got = note_features(charts, rules)
+    want = brute_features(charts, rules)
+    assert len(got["hit"]) == len(want)
+    for name in ("chart", "hit", "stage", "hold", "in_chord", "step", "moves", "jack", "section"):
+        np.testing.assert_array_equal(got[name], [w[name] for w in want], err_msg=name)
+    np.testing.assert_allclose(got["e"] - got["t"] + got["hit"], [w["end"] for w in want])
+    for name in ("nps", "covered", "strain"):
+        np.testing.assert_allclose(got[name], [w[name] for w in want], rtol=1e-9, atol=1e-12, err_msg=name)
+
+
+def test_note_features_no_charts():
+    got = note_features([], MetricRules())
+    assert all(len(v) == 0 for v in got.values())
@@ -0,0 +1,217 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+import pytest
+
+import analyze_song
+from bench_pipeline import ensure_fixture
+from chart_core import ChartConfig
+from chart_service import ChartService, handle
+
+SECONDS = 60.0
+
+
+@pytest.fixture(scope="module")
+def song(tmp_path_factory):
+    return ensure_fixture(str(tmp_path_factory.mktemp("fixtures")), minutes=SECONDS / 60, bpm=120.0, subdiv=4, sr=22050)
+
+
+def params():
+    base = ChartConfig()
+    scale = SECONDS / base.boundaries[-1]
+    return dict(bpm=120.0, boundaries=[b * scale for b in base.boundaries])
+
+
+class Server:
+    """The service's HTTP handler on an ephemeral port, on an event loop in a background thread."""
+
+    def __init__(self, service: ChartService):
+        self.service = service
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+        async def start():
+            return await asyncio.start_server(lambda r, w: handle(service, r, w), "127.0.0.1", 0)
+
+        self.server = asyncio.run_coroutine_threadsafe(start(), self.loop).result()
+        self.url = "http://127.0.0.1:%d" % self.server.sockets[0].getsockname()[1]
+
+    def post(self, req, timeout=120.0, content_type="application/json"):
+        """(status, headers, body bytes)"""
+        headers = {"Content-Type": content_type} if content_type else {}
+        request = urllib.request.Request(self.url + "/chart", data=json.dumps(req).encode(), headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as resp:
+                return resp.status, resp.headers, resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers, e.read()
+
+    def close(self):
+        self.server.close()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+        self.service.pool.shutdown(wait=True)
+
+
+@pytest.fixture
+def server():
+    servers = []
+
+    def make(**kw):
+        servers.append(Server(ChartService(**kw)))
+        return servers[-1]
+
+    yield make
+    for s in servers:
+        s.close()
+
+
+def test_chart_job(server, song):
+    srv = server(workers=1, queue=2)
+    code, _, body = srv.post(dict(audio=song, params=params()))
+    result = json.loads(body)
+    assert code == 200, result
+    assert result["ok"] and not result["analysis_cached"]
+    chart = result["charts"]["chart"]
+    assert chart["notes"] == len(chart["chart"]) > 0
+    assert chart["validation"]["ok"]
+
+    code, _, body = srv.post(dict(audio=song, params=params()))
+    assert code == 200 and json.loads(body)["analysis_cached"]
+    assert srv.service.song_locks == {}
+
+
+def test_bad_request(server, tmp_path):
+    srv = server(workers=1, queue=1)
+    code, _, body = srv.post(dict(audio=str(tmp_path / "missing.wav")))
+    assert code == 400 and not json.loads(body)["ok"]
+    code, _, _ = srv.post(dict(params={}))
+    assert code == 400
+
+
+def test_post_needs_json_content_type(server, song):
+    srv = server(workers=1, queue=1)
+    for content_type in (None, "text/plain", "application/x-www-form-urlencoded"):
+        code, _, body = srv.post(dict(audio=song, params=params()), content_type=content_type)
+        assert code == 415, content_type
+        assert not json.loads(body)["ok"]
+    code, _, _ = srv.post(dict(audio=song, params=params()), content_type="application/json; charset=utf-8")
+    assert code == 200
+    assert srv.service.counts["jobs"] == 1
+
+
+def test_out_stays_under_the_out_root(server, song, tmp_path):
+    root = tmp_path / "charts"
+    root.mkdir()
+    (tmp_path / "elsewhere").mkdir()
+    os.symlink(tmp_path / "elsewhere", root / "link")
+    srv = server(workers=1, queue=1, out_root=str(root))
+    for out in (str(tmp_path / "escape.json"), "../escape.json", "link/escape.json"):
+        code, _, body = srv.post(dict(audio=song, params=params(), out=out))
+        assert code == 400, out
+        assert '"out" must be inside' in json.loads(body)["error"]
+    assert not list(tmp_path.glob("escape.json")) and not list((tmp_path / "elsewhere").iterdir())
+
+    code, _, body = srv.post(dict(audio=song, params=params(), out="sub/../chart.json"))
+    assert code == 200
+    assert json.loads(body)["charts"]["chart"]["path"] == str(root / "chart.json")
+    assert (root / "chart.json").exists()
+
+
+def test_difficulties_fail_when_not_supersets(server, song, tmp_path, monkeypatch):
+    srv = server(workers=1, queue=1, out_root=str(tmp_path))
+    req = dict(audio=song, params=params(), out="chart.json",
+               difficulties={"easy": {"stage_keep": [0.3] * 6}, "hard": {"stage_keep": [0.9] * 6}})
+    code, _, body = srv.post(req)
+    result = json.loads(body)
+    assert code == 200 and result["ok"], result
+    assert result["charts"]["hard"]["superset"] and "superset" not in result["charts"]["easy"]
+    assert (tmp_path / "chart.easy.json").exists() and (tmp_path / "chart.hard.json").exists()
+
+    monkeypatch.setattr(analyze_song, "is_superset", lambda harder, easier: False)
+    code, _, body = srv.post(req)
+    result = json.loads(body)
+    assert code == 200 and not result["ok"]
+    assert result["charts"]["hard"]["superset"] is False
+
+
+def test_queue_full_answers_503(server, song):
+    srv = server(workers=1, queue=1)
+    release, started = threading.Event(), threading.Event()
+
+    def blocked(req, emit):
+        started.set()
+        release.wait(30)
+        return dict(ok=True)
+
+    srv.service.run = blocked
+    first = {}
+    t = threading.Thread(target=lambda: first.update(zip(("code", "headers", "body"), srv.post(dict(audio=song)))))
+    t.start()
+    assert started.wait(10)
+
+    code, headers, body = srv.post(dict(audio=song))
+    assert code == 503
+    assert headers["Retry-After"] == "1"
+    assert json.loads(body)["error"] == "queue full"
+
+    release.set()
+    t.join(30)
+    assert first["code"] == 200
+    # the slot is free again
+    code, _, _ = srv.post(dict(audio=song))
+    assert code == 200
+    assert srv.service.counts["rejected"] == 1
+
+
+def test_progress_stream(server, song):
+    srv = server(workers=1, queue=2)
+    code, headers, body = srv.post(dict(audio=song, params=params(), progress=True))
+    assert code == 200
+    assert headers["Content-Type"] == "application/x-ndjson"
+    events = [json.loads(line) for line in body.decode().splitlines()]
+    assert [e["event"] for e in events] == ["queued", "started", "analysis", "tempo", "chart", "result"]
+    assert events[-1]["ok"] and events[-1]["charts"]["chart"]["notes"] > 0
+
+
+def test_eviction_never_runs_one_song_twice_at_once(monkeypatch, tmp_path):
+    """An LRU of one song, two songs requested from many threads: each song is analyzed by one thread at a time."""
+    paths = []
+    for name in ("a.wav", "b.wav"):
+        (tmp_path / name).write_bytes(b"x")
+        paths.append(str(tmp_path / name))
+    running, worst = defaultdict(int), defaultdict(int)
+    guard = threading.Lock()
+
+    def fake_analyze(path, **kw):
+        with guard:
+            running[path] += 1
+            worst[path] = max(worst[path], running[path])
+        time.sleep(0.002)
+        with guard:
+            running[path] -= 1
+        return object()
+
+    monkeypatch.setattr(analyze_song, "analyze_audio", fake_analyze)
+    service = ChartService(workers=1, queue=1, songs=1)
+
+    def worker(i):
+        for k in range(40):
+            service.analysis(paths[(i + k) % 2], stream=False, decoder="librosa", sr=None)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    service.pool.shutdown()
+
+    assert dict(worst) == {p: 1 for p in paths}
+    assert service.song_locks == {}
@@ -0,0 +1,26 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+SCRIPTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts")
+
+# run main() in a fresh interpreter and report whether numpy got imported
+PROBE = """
+import sys
+import cursed_rhythm
+try:
+    cursed_rhythm.main(sys.argv[1:])
+except SystemExit:
+    pass
+print("numpy" in sys.modules)
+"""
+
+
+@pytest.mark.parametrize("argv", [["validate", "--help"], ["check-params", "--help"], ["--help"]])
+def test_help_does_not_load_numpy(argv):
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE, *argv], cwd=SCRIPTS, capture_output=True, text=True, check=True,
+    ).stdout
+    assert out.splitlines()[-1] == "False"
@@ -0,0 +1,57 @@
+from dataclasses import replace
+
+import pytest
+
+from analyze_song import (
+    ChartConfig,
+    analyze_audio,
+    build_difficulties,
+    difficulty_configs,
+    is_superset,
+    resolve_tempo,
+)
+from bench_pipeline import ensure_fixture
+from chart_core.notes import NoteArray
+from chart_core.validate import ChartRules, validate_notes
+
+PROFILES = {
+    "easy": {"stage_subdiv": [1, 1, 2, 2, 2, 2], "stage_keep": [0.3, 0.35, 0.4, 0.45, 0.5, 0.55],
+             "stage_min_gap": [0.5, 0.45, 0.42, 0.4, 0.38, 0.35]},
+    "normal": {},
+    "hard": {"stage_subdiv": [2, 2, 4, 4, 4, 4], "stage_keep": [0.6, 0.7, 0.75, 0.8, 0.85, 0.9],
+             "stage_min_gap": [0.25, 0.22, 0.2, 0.18, 0.16, 0.15]},
+}
+
+
+@pytest.fixture(scope="module")
+def song(tmp_path_factory):
+    # default boundaries end at 230 s; a drum track that long covers every stage
+    path = ensure_fixture(str(tmp_path_factory.mktemp("fixtures")), minutes=230 / 60, bpm=120.0, subdiv=4, sr=22050)
+    analysis = analyze_audio(path, cache=None)
+    cfgs = difficulty_configs(ChartConfig(bpm=120.0), PROFILES)
+    tempo_cfg, beat0, tempo_map = resolve_tempo(analysis, cfgs["easy"])
+    return analysis, cfgs, beat0, tempo_map
+
+
+@pytest.mark.parametrize("band_lanes", [0.0, 0.7])
+def test_nested_difficulties_are_valid_supersets(song, band_lanes):
+    analysis, cfgs, beat0, tempo_map = song
+    cfgs = {name: replace(cfg, band_lanes=band_lanes) for name, cfg in cfgs.items()}
+    charts = build_difficulties(analysis, cfgs, beat0=beat0, tempo_map=tempo_map, nested=True)
+
+    names = list(PROFILES)
+    assert list(charts) == names
+    for name in names:
+        rows, _ = charts[name]
+        report = validate_notes(NoteArray.from_rows(rows), ChartRules.from_config(cfgs[name]))
+        assert report.ok, f"{name}: {report.format()}"
+    for easier, harder in zip(names, names[1:]):
+        assert len(charts[harder][0]) > len(charts[easier][0])
+        assert is_superset(charts[harder][0], charts[easier][0]), f"{harder} drops notes of {easier}"
+
+
+def test_is_superset():
+    a = [dict(hit=1.0, lane=0), dict(hit=2.0, lane=1)]
+    assert is_superset(a + [dict(hit=3.0, lane=2)], a)
+    assert not is_superset(a, a + [dict(hit=3.0, lane=2)])
+    assert not is_superset([dict(hit=1.0, lane=1), a[1]], a)
@@ -0,0 +1,88 @@
+import os
+
+import numpy as np
+import pytest
+
+from batch_chart import chart_song
+from bench_pipeline import ensure_fixture
+from chart_core import ChartConfig
+from feature_store import FeatureStore, add_songs, tempo_params, write_store
+
+SECONDS = 60.0
+
+
+def song_entry(frames, bands):
+    return dict(frames=frames, bands=bands, sr=22050, hop_length=512), dict(onset_env=np.zeros(frames), band_env=np.zeros((bands, frames)))
+
+
+def test_write_store_rejects_mixed_band_counts(tmp_path):
+    with pytest.raises(ValueError, match="band counts"):
+        write_store(str(tmp_path), {"a": song_entry(10, 3), "b": song_entry(12, 4)}, generation=1)
+    assert os.listdir(tmp_path) == []
+
+    write_store(str(tmp_path), {"a": song_entry(10, 4), "b": song_entry(12, 4)}, generation=1)
+    store = FeatureStore(str(tmp_path))
+    assert store.band_env("b").shape == (4, 12)
+
+
+def test_open_reader_survives_later_generations(tmp_path):
+    root = str(tmp_path)
+    first = {"a": song_entry(10, 3)}
+    first["a"][1]["onset_env"][:] = 1.0
+    write_store(root, first, generation=1)
+    reader = FeatureStore(root)
+
+    write_store(root, {"a": song_entry(10, 3), "b": song_entry(5, 3)}, generation=2)
+    # the previous generation is still on disk for readers that only loaded the old index
+    assert sorted(os.listdir(root)) == [
+        "band_env.1.npy", "band_env.2.npy", "index.json", "onset_env.1.npy", "onset_env.2.npy",
+    ]
+    np.testing.assert_array_equal(reader.onset_env("a"), np.ones(10))
+
+    write_store(root, {"a": song_entry(10, 3)}, generation=3)
+    assert "onset_env.1.npy" not in os.listdir(root)
+    # mapped when it was opened, so the reader still sees generation 1
+    np.testing.assert_array_equal(reader.onset_env("a"), np.ones(10))
+    assert reader.band_env("a").shape == (3, 10) and "b" not in reader
+    np.testing.assert_array_equal(FeatureStore(root).onset_env("a"), np.zeros(10))
+
+
+@pytest.fixture(scope="module")
+def library(tmp_path_factory):
+    root = tmp_path_factory.mktemp("library")
+    audio = ensure_fixture(str(root / "fixtures"), minutes=SECONDS / 60, bpm=120.0, subdiv=4, sr=22050)
+    base = ChartConfig()
+    config = dict(bpm="auto", boundaries=[b * SECONDS / base.boundaries[-1] for b in base.boundaries])
+    store, failed = add_songs(str(root / "store"), [dict(id="drums", audio=audio, config=config)], log=lambda *a: None)
+    assert failed == []
+    return str(root), audio, config
+
+
+def job(root, audio, config, *, features):
+    return dict(id="drums", generator="analyze", audio=audio, out=os.path.join(root, f"out{bool(features)}.json"),
+                config=dict(config, seed=1), stream=False, decoder="librosa", sr=None, cache_dir=None,
+                format="json", compress=False, validate=True, features=features)
+
+
+def test_resolved_tempo_needs_matching_settings(library):
+    root, _, config = library
+    store = FeatureStore(os.path.join(root, "store"))
+    cfg = ChartConfig.from_dict(config)
+    resolved = store.resolved_tempo("drums", cfg)
+    assert resolved is not None
+    assert resolved[0].bpm == store.entry("drums")["bpm"] != "auto"
+    assert store.entry("drums")["tempo_params"] == tempo_params(cfg)
+
+    assert store.resolved_tempo("drums", ChartConfig.from_dict(dict(config, bpm=120.0))) is None
+    assert store.resolved_tempo("drums", ChartConfig.from_dict(dict(config, tempo_map=True))) is None
+
+
+def test_batch_chart_uses_stored_analysis_and_tempo(library):
+    root, audio, config = library
+    plain = chart_song(job(root, audio, config, features=None))
+    stored = chart_song(job(root, audio, config, features=os.path.join(root, "store")))
+    assert plain["ok"] and stored["ok"], (plain.get("error"), stored.get("error"))
+    assert stored["features"] and stored["stored_tempo"]
+    assert (stored["bpm"], stored["beat0"], stored["notes"]) == (plain["bpm"], plain["beat0"], plain["notes"])
+    with open(plain["out"]) as a, open(stored["out"]) as b:
+        assert a.read() == b.read()
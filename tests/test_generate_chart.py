@@ -0,0 +1,65 @@
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+from chart_core import RandomChartConfig
+from chart_core.notes import NoteArray
+from chart_core.validate import ChartRules, validate_notes
+from generate_chart import build_random_chart, cap_held_lanes, forced_fill
+
+# 1/16 grid, heavy density and long holds: lanes fill up often
+DENSE = [
+    dict(grid_beats=0.25, density=0.9, max_gap_beats=0.5, speed=500.0, jumpiness=0.4)
+] * 6
+
+
+def check(cfg):
+    rows, stats = build_random_chart(cfg)
+    notes = NoteArray.from_rows(rows)
+    report = validate_notes(notes, ChartRules.from_config(cfg))
+    assert report.ok, f"seed {cfg.seed}: {report.format(notes)}"
+    return rows, stats
+
+
+@pytest.mark.parametrize("seed", range(1, 61))
+def test_default_config_passes_validation(seed):
+    check(RandomChartConfig(seed=seed))
+
+
+@pytest.mark.parametrize("lanes", [4, 5, 7])
+def test_dense_configs_pass_validation(lanes):
+    for seed in range(10):
+        check(RandomChartConfig(seed=seed, lanes=lanes, params=DENSE))
+
+
+def test_max_gap_rule():
+    cfg = RandomChartConfig(seed=5)
+    rows, stats = check(cfg)
+    spb = 60.0 / cfg.bpm
+    for st, p in zip(stats, cfg.params):
+        hit = np.array([r["hit"] for r in rows if r["stage"] == st["stage"]])
+        assert st["notes"] == len(hit)
+        # a note is forced after max_gap_beats of empty steps, so no gap exceeds max_gap + one step
+        assert np.max(np.diff(hit)) <= (p["max_gap_beats"] + p["grid_beats"]) * spb + 1e-3
+
+
+def test_seed_determinism():
+    cfg = replace(RandomChartConfig(seed=7), params=DENSE)
+    assert build_random_chart(cfg) == build_random_chart(cfg)
+    assert build_random_chart(cfg)[0] != build_random_chart(replace(cfg, seed=8))[0]
+
+
+def test_forced_fill():
+    # placements at 0 and 9 of 20 steps, forced every 3rd step in between and after
+    assert forced_fill(np.array([0, 9]), 20, 3).tolist() == [3, 6, 12, 15, 18]
+    assert forced_fill(np.array([0, 1, 2]), 3, 2).tolist() == []
+
+
+def test_cap_held_lanes():
+    hit = np.array([0.0, 1.0, 2.0, 3.0, 4.0])
+    end = np.array([5.0, 5.0, 5.0, 3.5, 4.5])
+    is_hold = np.ones(5, dtype=bool)
+    # 2 may run at once: the third hold becomes a tap, and the one at 4.0 still waits (ends at 5.0)
+    assert cap_held_lanes(hit, end, is_hold, 2).tolist() == [True, True, False, False, False]
+    assert cap_held_lanes(hit, end, is_hold, 3).tolist() == [True, True, True, False, False]
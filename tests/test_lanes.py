@@ -0,0 +1,116 @@
+from bisect import bisect_right
+
+import numpy as np
+import pytest
+
+from lanes import NO_LANE, SHORT_RUN, assign_lanes, band_preference
+
+
+def reference_lanes(hit, end, is_hold, u, *, n_lanes, jumpiness, no_jacks, prev_lane=None, prefs=None, bands=None):
+    """The rule in lanes.py, walked one note at a time with the weights rebuilt per note."""
+    lanes = np.arange(n_lanes)
+    busy_until = [0.0] * n_lanes
+    prev = n_lanes if prev_lane is None else prev_lane
+    out = []
+    for i in range(len(hit)):
+        allowed = np.array([b <= hit[i] for b in busy_until])
+        if not allowed.any():
+            out.append(NO_LANE)
+            continue
+        ok = allowed.copy()
+        if prev == n_lanes or not allowed[prev]:
+            w = ok.astype(float)
+        else:
+            if no_jacks and ok.sum() > 1:
+                ok[prev] = False
+            w = np.where(ok, (1.0 - jumpiness) / (1.0 + np.abs(lanes - prev)) + jumpiness, 0.0)
+        if prefs is not None:
+            prefer = prefs[bands[i]]
+            if np.any(w * prefer > 0):
+                w = w * prefer
+        c = np.cumsum(w)
+        cdf = c / c[-1]
+        cdf[-1] = 1.0
+        prev = bisect_right(cdf.tolist(), u[i])
+        out.append(prev)
+        if is_hold[i]:
+            busy_until[prev] = max(busy_until[prev], end[i])
+    return np.array(out, dtype=np.int64)
+
+
+def random_notes(rng, n, *, hold_prob, grid=0.125):
+    """Sorted hits on a grid (so ties and hold ends landing exactly on hits happen), holds of 1-12 steps."""
+    hit = np.cumsum(rng.integers(0, 4, n)) * grid
+    is_hold = rng.random(n) < hold_prob
+    end = np.where(is_hold, hit + rng.integers(1, 13, n) * grid, hit)
+    return hit, end, is_hold
+
+
+@pytest.mark.parametrize("hold_prob", [0.0, 0.02, 0.3])
+@pytest.mark.parametrize("no_jacks", [False, True])
+@pytest.mark.parametrize("n_lanes", [4, 5, 6, 7])
+def test_matches_reference_walk(n_lanes, no_jacks, hold_prob):
+    for seed in range(8):
+        hit, end, is_hold = random_notes(np.random.default_rng(1000 + seed), 400, hold_prob=hold_prob)
+        prev_lane = [None, 0, n_lanes - 1, 2][seed % 4]
+        # prefer_nearby off is jumpiness 1.0 (uniform) in both generators
+        for jumpiness in (0.0, 0.35, 1.0):
+            got = assign_lanes(
+                hit, end, is_hold, rng=np.random.default_rng(seed),
+                n_lanes=n_lanes, jumpiness=jumpiness, no_jacks=no_jacks, prev_lane=prev_lane,
+            )
+            want = reference_lanes(
+                hit, end, is_hold, np.random.default_rng(seed).random(len(hit)),
+                n_lanes=n_lanes, jumpiness=jumpiness, no_jacks=no_jacks, prev_lane=prev_lane,
+            )
+            np.testing.assert_array_equal(got, want)
+
+
+@pytest.mark.parametrize("hold_prob", [0.0, 0.3])
+@pytest.mark.parametrize("n_lanes", [4, 7])
+def test_band_preference_matches_reference_walk(n_lanes, hold_prob):
+    n_bands = 3
+    for seed in range(6):
+        rng = np.random.default_rng(2000 + seed)
+        hit, end, is_hold = random_notes(rng, 400, hold_prob=hold_prob)
+        bands = rng.integers(0, n_bands, len(hit))
+        for bias in (0.4, 1.0):
+            prefs = [np.array(band_preference(n_lanes, n_bands, b, bias)) for b in range(n_bands)]
+            got = assign_lanes(
+                hit, end, is_hold, rng=np.random.default_rng(seed), n_lanes=n_lanes, jumpiness=0.2,
+                no_jacks=bool(seed % 2), bands=bands, band_bias=bias, n_bands=n_bands,
+            )
+            want = reference_lanes(
+                hit, end, is_hold, np.random.default_rng(seed).random(len(hit)), n_lanes=n_lanes,
+                jumpiness=0.2, no_jacks=bool(seed % 2), prefs=prefs, bands=bands,
+            )
+            np.testing.assert_array_equal(got, want)
+
+
+def test_long_runs_take_the_scan_path():
+    # no holds: one run of every note, far above SHORT_RUN
+    hit = np.arange(10 * SHORT_RUN) * 0.1
+    got = assign_lanes(hit, hit, np.zeros(len(hit), bool), rng=np.random.default_rng(3), n_lanes=5, jumpiness=0.1)
+    want = reference_lanes(
+        hit, hit, np.zeros(len(hit), bool), np.random.default_rng(3).random(len(hit)),
+        n_lanes=5, jumpiness=0.1, no_jacks=False,
+    )
+    np.testing.assert_array_equal(got, want)
+
+
+def test_no_lane_while_every_lane_is_held():
+    # four overlapping holds fill a 4-lane board; the tap at 2.0 has nowhere to go, the one at 5.0 does
+    hit = np.array([0.0, 0.5, 1.0, 1.5, 2.0, 5.0])
+    end = np.array([4.0, 4.0, 4.0, 4.0, 2.0, 5.0])
+    is_hold = np.array([True, True, True, True, False, False])
+    lanes = assign_lanes(hit, end, is_hold, rng=np.random.default_rng(0), n_lanes=4)
+    assert sorted(lanes[:4]) == [0, 1, 2, 3]
+    assert lanes[4] == NO_LANE
+    assert 0 <= lanes[5] < 4
+
+
+def test_seed_fixes_the_pattern():
+    hit, end, is_hold = random_notes(np.random.default_rng(0), 300, hold_prob=0.1)
+    a = assign_lanes(hit, end, is_hold, rng=np.random.default_rng(42), n_lanes=6, no_jacks=True)
+    b = assign_lanes(hit, end, is_hold, rng=np.random.default_rng(42), n_lanes=6, no_jacks=True)
+    np.testing.assert_array_equal(a, b)
@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+
+from analyze_song import cluster_to_holds, enforce_max_gap_on_grid, thin_by_gap
+
+
+def reference_thin(times, min_gap_s):
+    """The greedy keep loop thin_by_gap replaced."""
+    out = []
+    last = -1e9
+    for t in times:
+        t = float(t)
+        if t - last >= min_gap_s:
+            out.append(t)
+            last = t
+    return np.array(out)
+
+
+def reference_max_gap(chosen, grid, hit_start, hit_end, max_gap_s, fill_rate):
+    """The gap-by-gap fill loop enforce_max_gap_on_grid replaced."""
+    chosen = np.array(sorted(float(t) for t in chosen if hit_start <= t <= hit_end), dtype=float)
+    stage_grid = grid[(grid >= hit_start) & (grid <= hit_end)]
+    if len(stage_grid) == 0:
+        return chosen
+    if len(chosen) == 0:
+        chosen = np.array([float(stage_grid[len(stage_grid) // 2])])
+
+    filled = []
+
+    def insert_between(a, b):
+        if b - a <= max_gap_s:
+            return
+        between = stage_grid[(stage_grid > a) & (stage_grid < b)]
+        if len(between) == 0:
+            return
+        k = min(fill_rate, len(between))
+        for idx in np.linspace(0, len(between) - 1, k + 2)[1:-1].astype(int):
+            filled.append(float(between[idx]))
+
+    filled.append(float(chosen[0]))
+    insert_between(hit_start, float(chosen[0]))
+    for a, b in zip(chosen[:-1], chosen[1:]):
+        insert_between(float(a), float(b))
+        filled.append(float(b))
+    insert_between(float(chosen[-1]), hit_end)
+    return np.array(sorted(set(np.round(filled, 4))), dtype=float)
+
+
+def reference_holds(hit_times, cluster_gap_s, hold_min_s, hit_end_limit, breaks=None):
+    """The run-walking loop cluster_to_holds replaced, with breaks cutting a run."""
+    hit, end, is_hold = [], [], []
+    i, n = 0, len(hit_times)
+    while i < n:
+        start = stop = hit_times[i]
+        j = i
+        while j + 1 < n and hit_times[j + 1] - hit_times[j] <= cluster_gap_s and not (breaks is not None and breaks[j]):
+            stop = hit_times[j + 1]
+            j += 1
+        stop = min(stop, hit_end_limit)
+        if stop - start >= hold_min_s:
+            hit.append(start); end.append(stop); is_hold.append(True)
+            i = j + 1
+        else:
+            hit.append(start); end.append(start); is_hold.append(False)
+            i += 1
+    return np.array(hit), np.array(end), np.array(is_hold, dtype=bool)
+
+
+def random_times(rng, n, step):
+    """Sorted times on a decimal grid (gaps that equal the threshold up to rounding) with some exact repeats."""
+    return np.cumsum(rng.integers(0, 6, n)) * step
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_thin_by_gap_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    times = random_times(rng, 500, 0.1)
+    for min_gap_s in (0.0, 0.1, 0.2, 0.3, 0.35, 1.7):
+        np.testing.assert_array_equal(thin_by_gap(times, min_gap_s), reference_thin(times, min_gap_s))
+    jittered = np.sort(rng.random(500) * 60.0)
+    np.testing.assert_array_equal(thin_by_gap(jittered, 0.25), reference_thin(jittered, 0.25))
+
+
+def test_thin_by_gap_empty():
+    assert len(thin_by_gap(np.array([]), 0.2)) == 0
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_enforce_max_gap_matches_reference(seed):
+    rng = np.random.default_rng(100 + seed)
+    grid = np.arange(0.0, 90.0, 60.0 / 137.0 / 2)
+    hit_start, hit_end = sorted(rng.uniform(0.0, 90.0, 2))
+    # sparse picks make oversized gaps, a few fall outside the stage, a few are empty
+    n = [0, 1, 3, 40][seed % 4]
+    chosen = rng.choice(grid, size=min(n, len(grid)), replace=False)
+    for max_gap_s in (0.5, 1.6, 4.0):
+        for fill_rate in (1, 2, 5):
+            np.testing.assert_array_equal(
+                enforce_max_gap_on_grid(chosen, grid, hit_start, hit_end, max_gap_s, fill_rate),
+                reference_max_gap(chosen, grid, hit_start, hit_end, max_gap_s, fill_rate),
+            )
+
+
+def test_enforce_max_gap_outside_grid():
+    grid = np.arange(10.0, 20.0, 0.5)
+    # no grid inside the stage: the in-stage picks come back untouched, nothing is filled
+    np.testing.assert_array_equal(enforce_max_gap_on_grid(np.array([1.0, 7.0]), grid, 0.0, 5.0, 1.0), [1.0])
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_cluster_to_holds_matches_reference(seed):
+    rng = np.random.default_rng(200 + seed)
+    times = random_times(rng, 400, 0.05)
+    breaks = rng.random(len(times) - 1) < 0.1
+    for cluster_gap_s in (0.05, 0.1, 0.15):
+        for hold_min_s in (0.0, 0.15, 0.4):
+            hit_end_limit = float(times[-1]) - rng.uniform(0.0, 1.0)
+            for b in (None, breaks):
+                got = cluster_to_holds(
+                    times, cluster_gap_s=cluster_gap_s, hold_min_s=hold_min_s,
+                    hit_end_limit=hit_end_limit, breaks=b,
+                )
+                want = reference_holds(list(times), cluster_gap_s, hold_min_s, hit_end_limit, b)
+                for g, w in zip(got, want):
+                    np.testing.assert_array_equal(g, w)
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from onset_peaks import sliding_max
+
+
+def brute_sliding_max(x: np.ndarray, radius: int) -> np.ndarray:
+    n = x.shape[-1]
+    if n == 0:
+        return x.astype(np.float64)
+    cols = [x[..., max(0, i - radius):i + radius + 1].max(axis=-1) for i in range(n)]
+    return np.stack(cols, axis=-1).astype(np.float64)
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_sliding_max_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(0, 40))
+    lead = [(), (int(rng.integers(1, 4)),), (2, int(rng.integers(1, 4)))][seed % 3]
+    shape = lead + (n,)
+    # small integers make ties and flat runs; floats make every window distinct
+    x = rng.integers(-3, 4, shape) if seed % 2 else rng.standard_normal(shape)
+    for radius in range(0, n + 3):
+        got = sliding_max(x, radius)
+        assert got.shape == shape
+        np.testing.assert_array_equal(got, brute_sliding_max(x, radius) if radius else x)
+
+
+def test_sliding_max_keeps_float32_and_leaves_input():
+    x = np.array([0.5, 2.0, -1.0, 3.0, 0.0], dtype=np.float32)
+    before = x.copy()
+    got = sliding_max(x, 1)
+    assert got.dtype == np.float32
+    np.testing.assert_array_equal(got, [2.0, 2.0, 3.0, 3.0, 3.0])
+    np.testing.assert_array_equal(x, before)
+    assert sliding_max(x, 0) is not x
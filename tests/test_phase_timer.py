@@ -0,0 +1,22 @@
+import phase_timer
+from phase_timer import PhaseTimer, format_rss
+
+
+def test_format_rss():
+    assert format_rss(None) == "-"
+    assert format_rss(123.4) == "123"
+
+
+def test_report_without_rss(monkeypatch):
+    # Windows has no resource module: every peak RSS is None and must still format
+    monkeypatch.setattr(phase_timer, "resource", None)
+    timer = PhaseTimer()
+    with timer.phase("decode"):
+        pass
+    with timer.phase("select", stage=2):
+        pass
+    report = timer.report()
+    assert report["peak_rss_mb"] is None
+    lines = timer.format().splitlines()
+    assert lines[1].split()[-1] == "-"
+    assert lines[2].startswith("select s2")
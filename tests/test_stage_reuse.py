@@ -0,0 +1,52 @@
+from dataclasses import replace
+
+import pytest
+
+from analyze_song import ChartConfig, analyze_audio, build_chart, resolve_tempo, stage_results
+from bench_pipeline import ensure_fixture
+
+SECONDS = 60.0
+STAGE_LISTS = (
+    "stage_speeds", "stage_subdiv", "stage_keep", "stage_min_gap", "stage_jumpiness",
+    "stage_cluster_gap", "stage_max_gap", "stage_fill_rate",
+)
+
+
+@pytest.fixture(scope="module")
+def song(tmp_path_factory):
+    path = ensure_fixture(str(tmp_path_factory.mktemp("fixtures")), minutes=SECONDS / 60, bpm=120.0, subdiv=4, sr=22050)
+    base = ChartConfig(bpm=120.0)
+    cfg = replace(base, boundaries=[b * SECONDS / base.boundaries[-1] for b in base.boundaries])
+    analysis = analyze_audio(path, cache=None)
+    cfg, beat0, tempo_map = resolve_tempo(analysis, cfg)
+    return analysis, cfg, beat0, tempo_map
+
+
+def split_stage(cfg: ChartConfig, at: float) -> ChartConfig:
+    """Insert a boundary at `at`; both halves keep the split stage's parameters."""
+    i = next(k for k, b in enumerate(cfg.boundaries) if b > at)
+    lists = {name: getattr(cfg, name)[:i] + getattr(cfg, name)[i - 1:] for name in STAGE_LISTS}
+    return replace(cfg, boundaries=cfg.boundaries[:i] + [at] + cfg.boundaries[i:], **lists)
+
+
+def test_spliced_rebuild_matches_full_rebuild_after_boundary_edit(song):
+    analysis, cfg, beat0, tempo_map = song
+    reuse = stage_results(*build_chart(analysis, cfg, beat0=beat0, tempo_map=tempo_map))
+
+    # every stage after 5.0 moves up one index with its window and parameters unchanged
+    edited = split_stage(cfg, 5.0)
+    assert edited.n_stages == cfg.n_stages + 1
+    spliced, stats = build_chart(analysis, edited, beat0=beat0, tempo_map=tempo_map, reuse=reuse)
+    full, _ = build_chart(analysis, edited, beat0=beat0, tempo_map=tempo_map)
+
+    assert spliced == full
+    # the stage before the edit is still spliced in, the renumbered ones are rebuilt
+    assert [st["reused"] for st in stats] == [True] + [False] * (edited.n_stages - 1)
+
+
+def test_unchanged_rebuild_reuses_every_stage(song):
+    analysis, cfg, beat0, tempo_map = song
+    rows, stats = build_chart(analysis, cfg, beat0=beat0, tempo_map=tempo_map)
+    again, again_stats = build_chart(analysis, cfg, beat0=beat0, tempo_map=tempo_map, reuse=stage_results(rows, stats))
+    assert again == rows
+    assert all(st["reused"] for st in again_stats)
@@ -0,0 +1,43 @@
+import librosa
+import numpy as np
+import pytest
+import soundfile as sf
+
+from stream_onset import TOLERANCE, envelope_error, stream_onset_strength
+
+
+def synthetic_song(path, *, sr=22050, seconds=20.0, channels=1, seed=0):
+    """Decaying noise bursts on an uneven grid over a quiet tone, written as 16-bit WAV."""
+    rng = np.random.default_rng(seed)
+    n = int(sr * seconds)
+    t = np.arange(n) / sr
+    y = 0.05 * np.sin(2 * np.pi * 220.0 * t)
+    burst = rng.standard_normal(int(0.08 * sr)) * np.exp(-np.arange(int(0.08 * sr)) / (0.015 * sr))
+    for onset in np.cumsum(rng.uniform(0.12, 0.4, int(seconds / 0.12))):
+        i = int(onset * sr)
+        if i + len(burst) > n:
+            break
+        y[i:i + len(burst)] += rng.uniform(0.2, 0.8) * burst
+    y = np.clip(y, -1.0, 1.0)
+    data = np.stack([y * (1.0 - 0.3 * c) for c in range(channels)], axis=1)
+    sf.write(path, data, sr, subtype="PCM_16")
+    return path
+
+
+@pytest.mark.parametrize("channels", [1, 2])
+@pytest.mark.parametrize("block_frames", [37, 256, 2048])
+def test_streamed_envelope_matches_in_memory(tmp_path, channels, block_frames):
+    path = synthetic_song(str(tmp_path / "song.wav"), channels=channels)
+
+    env, sr, duration = stream_onset_strength(path, block_frames=block_frames)
+    y, sr_ref = librosa.load(path, sr=None, mono=True)
+    ref = librosa.onset.onset_strength(y=y, sr=sr_ref)
+
+    assert sr == sr_ref
+    assert duration == pytest.approx(len(y) / sr_ref)
+    assert envelope_error(env, ref) < TOLERANCE
+
+
+def test_envelope_error_rejects_shape_mismatch():
+    with pytest.raises(ValueError):
+        envelope_error(np.ones(10), np.ones(11))
@@ -0,0 +1,218 @@
+from dataclasses import replace
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from analyze_song import ChartConfig, analyze_audio, resolve_tempo
+from bench_pipeline import ensure_fixture, render_drums
+from tempo import (
+    PhaseTrack,
+    TempoMap,
+    TempoSegment,
+    TimeWarp,
+    estimate_bpm,
+    estimate_tempo_map,
+    fit_time_warp,
+    make_fixed_grid,
+    make_grid,
+    track_phase,
+)
+
+SR = 22050
+STAGES = [0.0, 15.0, 30.0, 75.0, 110.0, 160.0, 240.0]
+
+
+@pytest.fixture(scope="module")
+def fixture_dir(tmp_path_factory):
+    return str(tmp_path_factory.mktemp("fixtures"))
+
+
+def grid_offsets(grid: np.ndarray, truth: np.ndarray) -> np.ndarray:
+    """Signed distance from each grid time to the nearest true beat."""
+    i = np.clip(np.searchsorted(truth, grid), 1, len(truth) - 1)
+    near = np.where(np.abs(truth[i - 1] - grid) < np.abs(truth[i] - grid), truth[i - 1], truth[i])
+    return grid - near
+
+
+def iqr(x: np.ndarray) -> float:
+    q1, q3 = np.percentile(x, [25, 75])
+    return float(q3 - q1)
+
+
+# -------------------------
+# estimate_bpm
+# -------------------------
+@pytest.mark.parametrize("bpm", [float(b) for b in range(62, 191, 8)])
+def test_estimate_bpm_up_to_octave(fixture_dir, bpm):
+    path = ensure_fixture(fixture_dir, minutes=0.5, bpm=bpm, subdiv=2, sr=SR)
+    analysis = analyze_audio(path, cache=None)
+    est = estimate_bpm(analysis.onset_env, sr=analysis.sr, hop_length=analysis.hop_length)
+    octave = 2.0 ** np.round(np.log2(est / bpm))
+    assert octave in (0.5, 1.0, 2.0)
+    assert abs(est / octave - bpm) < 0.01
+
+
+@pytest.mark.parametrize("bpm, subdiv", [(130.0, 2), (118.0, 4)])
+def test_estimate_bpm_near_whole_frame_periods(fixture_dir, bpm, subdiv):
+    # 129.2 and 117.45 BPM are beat periods of exactly 20 and 22 frames, which a
+    # binned phase fold scores as perfectly sharp
+    path = ensure_fixture(fixture_dir, minutes=3.0, bpm=bpm, subdiv=subdiv, sr=SR)
+    analysis = analyze_audio(path, cache=None)
+    est = estimate_bpm(analysis.onset_env, sr=analysis.sr, hop_length=analysis.hop_length)
+    assert abs(est - bpm) < 0.01
+
+
+# -------------------------
+# Tempo map
+# -------------------------
+@pytest.fixture(scope="module")
+def stepped(fixture_dir):
+    """Three minutes of drums at 120 -> 126 -> 123 BPM, and the true beat times."""
+    parts, truth = [], []
+    for j, bpm in enumerate((120.0, 126.0, 123.0)):
+        parts.append(render_drums(60 * SR, start=0, sr=SR, bpm=bpm, subdiv=2, beat0=0.1, rng=np.random.default_rng(j)))
+        spb = 60.0 / bpm
+        truth.append(60.0 * j + 0.1 + np.arange(0.0, 60.0 / spb) * spb)
+    path = f"{fixture_dir}/stepped.wav"
+    sf.write(path, np.concatenate(parts), SR, subtype="PCM_16")
+    return analyze_audio(path, cache=None), np.concatenate(truth)
+
+
+def test_tempo_map_finds_the_steps(stepped):
+    analysis, _ = stepped
+    bpm = estimate_bpm(analysis.onset_env, sr=analysis.sr, hop_length=analysis.hop_length)
+    tempo_map = estimate_tempo_map(
+        analysis.onset_env, sr=analysis.sr, duration=analysis.duration, bpm=bpm, hop_length=analysis.hop_length,
+    )
+    segs = tempo_map.segments
+    assert [round(s.bpm, 1) for s in segs] == [120.0, 126.0, 123.0]
+    assert segs[0].start == 0.0 and segs[-1].end == analysis.duration
+    assert abs(segs[1].start - 60.0) < 5.0 and abs(segs[2].start - 120.0) < 5.0
+
+
+def test_tempo_map_grid_stays_on_the_beat(stepped):
+    analysis, truth = stepped
+    spread = {}
+    for use_map in (False, True):
+        cfg, beat0, tempo_map = resolve_tempo(analysis, replace(ChartConfig(), bpm="auto", tempo_map=use_map))
+        grid = make_grid(analysis.duration, bpm=cfg.bpm, subdiv_per_beat=1, beat0=beat0, tempo_map=tempo_map)
+        d = grid_offsets(grid, truth)
+        spread[use_map] = [iqr(d[(grid >= t) & (grid < t + 60.0)]) for t in (0.0, 60.0, 120.0)]
+    # one fixed BPM smears the sections it doesn't match; the map keeps every section tight
+    assert min(spread[False][:2]) > 0.05
+    assert max(spread[True]) < 0.01
+
+
+def test_estimate_tempo_map_constant_tempo(fixture_dir):
+    path = ensure_fixture(fixture_dir, minutes=1.5, bpm=120.0, subdiv=4, sr=SR)
+    analysis = analyze_audio(path, cache=None)
+    tempo_map = estimate_tempo_map(
+        analysis.onset_env, sr=analysis.sr, duration=analysis.duration, bpm=120.0, hop_length=analysis.hop_length,
+    )
+    assert tempo_map.segments == [TempoSegment(0.0, analysis.duration, 120.0)]
+
+
+# -------------------------
+# Grids
+# -------------------------
+def test_make_grid_without_map_is_the_fixed_grid():
+    grid = make_grid(30.0, bpm=128.0, subdiv_per_beat=4, beat0=0.2)
+    np.testing.assert_array_equal(grid, make_fixed_grid(30.0, 128.0, 4, 0.2))
+    assert grid[0] == 0.2 and grid[-1] <= 30.0
+    np.testing.assert_allclose(np.diff(grid), 60.0 / 128.0 / 4)
+
+
+def test_make_grid_one_segment_map_uses_its_anchor():
+    tempo_map = TempoMap([TempoSegment(0.0, 30.0, 100.0, beat0=0.35)])
+    np.testing.assert_array_equal(
+        make_grid(30.0, bpm=128.0, subdiv_per_beat=2, beat0=0.2, tempo_map=tempo_map),
+        make_fixed_grid(30.0, 100.0, 2, 0.35),
+    )
+
+
+def test_make_grid_segments_never_double_up():
+    tempo_map = TempoMap([
+        TempoSegment(0.0, 20.0, 120.0, beat0=0.1),
+        TempoSegment(20.0, 40.0, 126.0, beat0=20.05),
+        TempoSegment(40.0, 60.0, 123.0),
+    ])
+    grid = make_grid(60.0, bpm=120.0, subdiv_per_beat=2, beat0=0.1, tempo_map=tempo_map)
+    assert np.all(np.diff(grid) > 0.5 * 60.0 / 126.0 / 2)
+    assert grid[0] >= 0.0 and grid[-1] <= 60.0
+    # inside each segment the step is that segment's
+    inner = grid[(grid > 21.0) & (grid < 39.0)]
+    np.testing.assert_allclose(np.diff(inner), 60.0 / 126.0 / 2)
+
+
+def test_make_grid_applies_the_warp():
+    warp = TimeWarp(knots=[0.0, 60.0], offsets=[0.0, 0.06])
+    tempo_map = TempoMap([TempoSegment(0.0, 60.0, 120.0, beat0=0.5)], warp=warp)
+    grid = make_grid(60.0, bpm=120.0, subdiv_per_beat=1, beat0=0.5, tempo_map=tempo_map)
+    plain = make_fixed_grid(60.0, 120.0, 1, 0.5)
+    shifted = plain + np.interp(plain, [0.0, 60.0], [0.0, 0.06])
+    np.testing.assert_allclose(grid, shifted[shifted <= 60.0])
+
+
+# -------------------------
+# Phase tracking / time-warp
+# -------------------------
+def wobble(t: np.ndarray) -> np.ndarray:
+    """50 ms of slow drift, about one cycle over the song."""
+    return 0.05 * np.sin(2.0 * np.pi * t / 180.0)
+
+
+@pytest.fixture(scope="module")
+def wobbly(fixture_dir):
+    """Four minutes at 128 BPM with a 0.03% tempo error, time-warped by wobble(); returns true beats too."""
+    bpm, beat0, n = 128.0 * 1.0003, 0.25, 240 * SR
+    y = render_drums(n, start=0, sr=SR, bpm=bpm, subdiv=2, beat0=beat0, rng=np.random.default_rng(1))
+    t = np.arange(n) / SR
+    path = f"{fixture_dir}/wobbly.wav"
+    sf.write(path, np.interp(t - wobble(t), t, y).astype(np.float32), SR, subtype="PCM_16")
+    spb = 60.0 / bpm
+    beats = beat0 + np.arange(0.0, 240.0 / spb) * spb
+    return analyze_audio(path, cache=None), beats + wobble(beats)
+
+
+def test_time_warp_follows_a_wobble(wobbly):
+    analysis, truth = wobbly
+    spread = {}
+    for warp in (False, True):
+        cfg, beat0, tempo_map = resolve_tempo(analysis, replace(ChartConfig(), bpm=128.0, tempo_warp=warp))
+        grid = make_grid(analysis.duration, bpm=cfg.bpm, subdiv_per_beat=1, beat0=beat0, tempo_map=tempo_map)
+        d = grid_offsets(grid, truth)
+        # a constant lag is onset detection latency; what matters is how far it moves between stages
+        med = [np.median(d[(grid >= lo) & (grid < hi)]) for lo, hi in zip(STAGES, STAGES[1:])]
+        spread[warp] = max(med) - min(med)
+    assert spread[False] > 0.08
+    assert spread[True] < 0.02
+
+    residuals = tempo_map.warp.residuals
+    assert [r["stage"] for r in residuals] == [1, 2, 3, 4, 5, 6]
+    assert all(r["after_ms"] < 10.0 for r in residuals)
+
+
+def test_track_phase_on_a_clean_envelope():
+    # impulses at the wobbled beats on a 100 fps envelope: the tracked lead is the wobble itself
+    fps, bpm = 100.0, 120.0
+    times = np.arange(0.0, 180.0, 1.0 / fps)
+    beats = make_fixed_grid(180.0, bpm, 1, 0.5)
+    env = np.zeros(len(times))
+    for b in beats + wobble(beats):
+        env += np.exp(-0.5 * ((times - b) / 0.01) ** 2)
+    track = track_phase(env, times, beats)
+    ok = track.weights > 0
+    assert np.count_nonzero(ok) > 0.9 * len(track.centers)
+    np.testing.assert_allclose(track.offsets[ok], wobble(track.centers[ok]), atol=0.006)
+
+    # knots every 30 s can only approximate the sine; past the last window it is extrapolated
+    warp = fit_time_warp(track, duration=180.0)
+    inside = beats[(beats >= track.centers[0]) & (beats <= track.centers[-1])]
+    np.testing.assert_allclose(warp.apply(inside), inside + wobble(inside), atol=0.015)
+
+
+def test_fit_time_warp_needs_confident_windows():
+    track = PhaseTrack(centers=np.arange(4.0, 60.0, 2.0), offsets=np.zeros(28), weights=np.zeros(28))
+    assert fit_time_warp(track, duration=60.0) is None
+    assert track_phase(np.zeros(10), np.arange(10) / 100.0, np.arange(3.0)).centers.size == 0